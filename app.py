@@ -3,12 +3,17 @@ from system_search.search import SystemSearch
 from werkzeug.utils import secure_filename
 import os
 import re
+import sys
 import numpy as np
 import subprocess
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "mmc"))
+from track_codec import decode_records
+
 # Init app and system
 app = Flask(__name__, template_folder='templates', static_folder='static')
 USE_GPU = True
+FUSED_W_REID = None  # w_reid of the collection's "vector_fused" (database/upload_data.py) to search images on it
 
 
 # CONFIG
@@ -28,7 +33,7 @@ system_search = None
 def get_search_system():
     global system_search
     if system_search is None:
-        system_search = SystemSearch()
+        system_search = SystemSearch(fused_w_reid=FUSED_W_REID)
     return system_search
 
 system_search = get_search_system()
@@ -178,6 +183,11 @@ def api_get_video():
         return jsonify({"error": "No track found"}), 400
 
     detections = track.get("detections")
+    try:
+        if not detections and track.get("detections_codec"):
+            detections = decode_records(track["detections_codec"])
+    except Exception as e:
+        return jsonify({"error": f"Invalid detections_codec with error {e}"}), 400
     if not detections:
         return jsonify({"error": "No detections found"}), 400
     try:
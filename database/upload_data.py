@@ -1,12 +1,22 @@
 import os
 import pickle
+import sys
 import uuid
 from collections import defaultdict
 from typing import Dict, Tuple, List
 
 import numpy as np
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams, PointStruct
+from qdrant_client.http.models import (
+    Datatype, Distance, PointStruct, ScalarQuantization, ScalarQuantizationConfig, ScalarType, VectorParams
+)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "mmc"))
+from detection_store import DetectionStore
+from embedding_store import EmbeddingStore
+from exclusions import ExclusionSet, load_exclusions
+from fusion import fuse_embeddings
+from track_codec import encode_records, encode_track_text
 
 
 ############################################
@@ -109,6 +119,17 @@ def load_all_detections(metadata_root: str):
     return all_tracks
 
 
+def load_all_detections_store(store_dir: str):
+    """
+    Same mapping as load_all_detections, memory-mapped from a detection store
+    (see mmc/detection_store.py); detection lists are only built for the
+    tracks that are looked up.
+    """
+    store = DetectionStore(store_dir)
+    print(f"[INFO] Opened detection store with {len(store)} tracks")
+    return store
+
+
 ############################################
 # 3. LOAD FEATURE PKL (TRACK-LEVEL)
 ############################################
@@ -125,12 +146,14 @@ def load_feature_pkl(pkl_path: str):
         return pickle.load(f)
 
 
-def load_all_features(feature_root: str):
+def load_all_features(feature_root: str, exclusions: ExclusionSet = None):
     """
     feature_root/
       seq_xxx/
         seq_xxx_camera_y.pkl
 
+    exclusions: tracks to leave out (see mmc/exclusions.py)
+
     return:
       dict[(seq, cam, obj)] = feature
     """
@@ -153,10 +176,33 @@ def load_all_features(feature_root: str):
                     print(f"[WARN] Duplicate feature for track {k}")
                 all_features[k] = v
 
+    if exclusions is not None:
+        all_features = exclude_tracks(all_features, exclusions)
     print(f"[INFO] Loaded features for {len(all_features)} tracks")
     return all_features
 
 
+def load_all_features_store(store_dir: str, exclusions: ExclusionSet = None):
+    """
+    Same mapping as load_all_features, with row views into a memory-mapped
+    embedding store (see mmc/embedding_store.py) instead of unpickled arrays.
+    """
+    store = EmbeddingStore(store_dir)
+    rows = np.arange(len(store))
+    if exclusions is not None:
+        rows = rows[~exclusions.mask(store.keys)]
+    all_features = store.feature_dict(rows)
+    print(f"[INFO] Loaded features for {len(all_features)} tracks from {store_dir}")
+    return all_features
+
+
+def exclude_tracks(all_features, exclusions: ExclusionSet):
+    """Drop the excluded tracks, reporting how many were left out."""
+    kept = exclusions.filter(all_features)
+    print(f"[INFO] Excluded {len(all_features) - len(kept)} tracks")
+    return kept
+
+
 ############################################
 # 4. BUILD QDRANT POINTS (1 TRACK = 1 POINT)
 ############################################
@@ -164,8 +210,16 @@ def load_all_features(feature_root: str):
 def build_qdrant_points(
     feature_dict,
     detections_dict,
-    global_mapping
+    global_mapping,
+    fused_w_reid=None,
+    detection_tolerance=None
 ) -> List[PointStruct]:
+    """
+    fused_w_reid: if set, also store the fused ReID/CLIP vector as "vector_fused"
+        (mmc/fusion.py, of the L2-normalized vectors)
+    detection_tolerance: if set, store the detections as "detections_codec" text
+        (mmc/track_codec.py, boxes within this many pixels) instead of the list
+    """
 
     points = []
     skipped_no_det = 0
@@ -176,8 +230,15 @@ def build_qdrant_points(
             skipped_no_det += 1
             continue
 
-        detections = detections_dict[(seq_id, cam_id, obj_id)]
-        if len(detections) == 0:
+        key = (seq_id, cam_id, obj_id)
+        if detection_tolerance is not None and isinstance(detections_dict, DetectionStore):
+            # Encode straight from the store columns, without building the detection list
+            frames = detections_dict.frames(key)
+            detections = None
+        else:
+            detections = detections_dict[key]
+            frames = [d["frame_id"] for d in detections]
+        if len(frames) == 0:
             skipped_no_det += 1
             continue
 
@@ -189,6 +250,8 @@ def build_qdrant_points(
             "vector_reid": feat["reid"].tolist(),
             "vector_clip": feat["clip"].tolist()
         }
+        if fused_w_reid is not None:
+            vectors["vector_fused"] = fuse_embeddings(feat["reid"], feat["clip"], fused_w_reid, normalize=True).tolist()
 
         payload = {
             "global_id": global_id,
@@ -196,11 +259,18 @@ def build_qdrant_points(
             "cam_id": cam_id,
             "obj_id": obj_id,
             "track_key": f"{seq_id}_{cam_id}_{obj_id}",
-            "detections": detections,
-            "frame_start": detections[0]["frame_id"],
-            "frame_end": detections[-1]["frame_id"],
-            "num_detections": len(detections)
+            "frame_start": int(frames[0]),
+            "frame_end": int(frames[-1]),
+            "num_detections": len(frames)
         }
+        if detection_tolerance is None:
+            payload["detections"] = detections
+        elif detections is None:
+            payload["detections_codec"] = encode_track_text(
+                frames, detections_dict.bboxes(key), detection_tolerance
+            )
+        else:
+            payload["detections_codec"] = encode_records(detections, detection_tolerance)
 
         points.append(PointStruct(
             id=point_id,
@@ -223,29 +293,51 @@ def upsert_to_qdrant(
     host="localhost",
     port=6333,
     drop=False,
-    batch_size=64
+    batch_size=64,
+    fused=False,
+    precision="float32"
 ):
+    """
+    precision: "float16" stores the vectors as float16; "int8" keeps float32 vectors
+    on disk with an in-RAM int8 scalar-quantized copy that searches rescore from.
+    """
     client = QdrantClient(host=host, port=port)
+    datatype = Datatype.FLOAT16 if precision == "float16" else None
+    quantization_config = None
+    if precision == "int8":
+        quantization_config = ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, always_ram=True)
+        )
 
     if drop and client.collection_exists(collection_name):
         client.delete_collection(collection_name)
         print(f"[INFO] Dropped collection {collection_name}")
 
     if not client.collection_exists(collection_name):
+        vectors_config = {
+            "vector_reid": VectorParams(
+                size=512,
+                distance=Distance.COSINE,
+                datatype=datatype
+            ),
+            "vector_clip": VectorParams(
+                size=1024,
+                distance=Distance.COSINE,
+                datatype=datatype
+            )
+        }
+        if fused:
+            vectors_config["vector_fused"] = VectorParams(
+                size=512 + 1024,
+                distance=Distance.DOT,
+                datatype=datatype
+            )
         client.create_collection(
             collection_name=collection_name,
-            vectors_config={
-                "vector_reid": VectorParams(
-                    size=512,
-                    distance=Distance.COSINE
-                ),
-                "vector_clip": VectorParams(
-                    size=1024,
-                    distance=Distance.COSINE
-                )
-            }
+            vectors_config=vectors_config,
+            quantization_config=quantization_config
         )
-        print(f"[INFO] Created collection {collection_name}")
+        print(f"[INFO] Created collection {collection_name} ({precision})")
 
     for i in range(0, len(points), batch_size):
         batch = points[i:i + batch_size]
@@ -259,41 +351,99 @@ def upsert_to_qdrant(
 # 6. MAIN PIPELINE (ALL SEQ, ALL CAM)
 ############################################
 
-def main():
-    # ===== PATH CONFIG =====
-    FEATURE_ROOT = "data/new_feature_objects"
-    METADATA_ROOT = "data/new_metadata_objects"
-    GLOBAL_MATCH_PKL = "global_matching_results_2 (1).pkl"
-
-    COLLECTION_NAME = "person_retrieval"
-
+def run_upload(
+    global_match_pkl,
+    feature_root="data/new_feature_objects",
+    metadata_root="data/new_metadata_objects",
+    detection_store=None,
+    embedding_store=None,
+    exclusions=None,
+    collection_name="person_retrieval",
+    fused_w_reid=None,
+    detection_tolerance=None,
+    precision="float32"
+):
+    """
+    Load global matching, detections and features, and re-create the Qdrant
+    collection. With `detection_store` / `embedding_store`, detections and features
+    are read from those stores instead of the metadata / feature trees (the same
+    choice as for matching). With `exclusions`, the tracks of that exclusion set
+    (mmc/exclusions.py) are left out, as matching does when given the same set.
+    """
     print("========== START PIPELINE ==========")
 
     print("[STEP 1] Load global matching")
-    global_mapping = load_global_mapping_from_groups(GLOBAL_MATCH_PKL)
+    global_mapping = load_global_mapping_from_groups(global_match_pkl)
 
     print("[STEP 2] Load all metadata")
-    detections = load_all_detections(METADATA_ROOT)
+    if detection_store is not None:
+        detections = load_all_detections_store(detection_store)
+    else:
+        detections = load_all_detections(metadata_root)
 
     print("[STEP 3] Load all features")
-    features = load_all_features(FEATURE_ROOT)
+    exclusions = load_exclusions(exclusions)
+    if embedding_store is not None:
+        features = load_all_features_store(embedding_store, exclusions)
+    else:
+        features = load_all_features(feature_root, exclusions)
 
     print("[STEP 4] Build Qdrant points")
     points = build_qdrant_points(
         feature_dict=features,
         detections_dict=detections,
-        global_mapping=global_mapping
+        global_mapping=global_mapping,
+        fused_w_reid=fused_w_reid,
+        detection_tolerance=detection_tolerance
     )
 
     print("[STEP 5] Upsert to Qdrant")
     upsert_to_qdrant(
         points,
-        collection_name=COLLECTION_NAME,
+        collection_name=collection_name,
         drop=True,
-        batch_size=64
+        batch_size=64,
+        fused=fused_w_reid is not None,
+        precision=precision
     )
 
     print("========== PIPELINE FINISHED ==========")
+    return len(points)
+
+
+def main():
+    import argparse
+
+    # ===== PATH CONFIG =====
+    FEATURE_ROOT = "data/new_feature_objects"
+    METADATA_ROOT = "data/new_metadata_objects"
+    GLOBAL_MATCH_PKL = "global_matching_results_2 (1).pkl"
+    FUSED_W_REID = None  # e.g. 0.75 to also store "vector_fused"
+    DETECTION_TOLERANCE = None  # e.g. 0 (lossless) to store "detections_codec" instead of "detections"
+    PRECISION = "float32"  # or "float16" / "int8" (see upsert_to_qdrant)
+
+    COLLECTION_NAME = "person_retrieval"
+
+    parser = argparse.ArgumentParser(description="Upload global matching results to Qdrant")
+    parser.add_argument('--detection-store',
+                        help=f"read detections from this store (see mmc/detection_store.py) instead of {METADATA_ROOT}")
+    parser.add_argument('--embedding-store',
+                        help=f"read features from this store (see mmc/embedding_store.py) instead of {FEATURE_ROOT}")
+    parser.add_argument('--exclusions', help="exclusion set of tracks to leave out (see mmc/exclusions.py)")
+    args = parser.parse_args()
+
+    run_upload(
+        GLOBAL_MATCH_PKL,
+        feature_root=FEATURE_ROOT,
+        metadata_root=METADATA_ROOT,
+        detection_store=args.detection_store,
+        embedding_store=args.embedding_store,
+        exclusions=args.exclusions,
+        collection_name=COLLECTION_NAME,
+        fused_w_reid=FUSED_W_REID,
+        detection_tolerance=DETECTION_TOLERANCE,
+        precision=PRECISION
+    )
 
 
 if __name__ == "__main__":
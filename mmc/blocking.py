@@ -0,0 +1,166 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from config import config
+
+# Reasons a pair can be pruned
+KEPT = 0
+PRUNED_TOPOLOGY = 1
+PRUNED_TRANSIT = 2
+
+
+@dataclass
+class BlockingReport:
+    total_pairs: int
+    kept_pairs: int
+    pruned_topology: int
+    pruned_transit: int
+
+    @property
+    def pruned_pairs(self):
+        return self.pruned_topology + self.pruned_transit
+
+    def summary(self):
+        ratio = self.total_pairs / max(self.kept_pairs, 1)
+        return (
+            f"Blocking: {self.kept_pairs}/{self.total_pairs} candidate pairs kept "
+            f"({self.pruned_pairs} pruned: {self.pruned_topology} by camera topology, "
+            f"{self.pruned_transit} by transit window; {ratio:.1f}x reduction)"
+        )
+
+
+def camera_adjacency(spatial_neighbors=None):
+    """
+    Symmetric camera adjacency matrix from `{"C1": ["C2", ...]}`.
+    Indexed by integer cam_id; a camera is always adjacent to itself.
+    """
+    if spatial_neighbors is None:
+        spatial_neighbors = config.spatial_neighbors
+
+    def cam_index(name):
+        return int(str(name).lstrip("Cc"))
+
+    cams = {cam_index(c) for c in spatial_neighbors}
+    cams |= {cam_index(n) for ns in spatial_neighbors.values() for n in ns}
+    adjacency = np.zeros((max(cams) + 1, max(cams) + 1), dtype=bool)
+    np.fill_diagonal(adjacency, True)
+    for cam, neighbors in spatial_neighbors.items():
+        for neighbor in neighbors:
+            adjacency[cam_index(cam), cam_index(neighbor)] = True
+            adjacency[cam_index(neighbor), cam_index(cam)] = True
+    return adjacency
+
+
+def transit_windows(temporal_neighbors=None, n_cams=None):
+    """
+    Min/max transit frames for `"a-b"` camera pairs (b seen after a).
+    Returns (min_frames, max_frames) matrices; pairs without data are unbounded.
+    """
+    if temporal_neighbors is None:
+        temporal_neighbors = config.temporal_neighbors
+
+    pairs = {tuple(int(c) for c in key.split("-")): window for key, window in temporal_neighbors.items()}
+    if n_cams is None:
+        n_cams = max((max(p) for p in pairs), default=0) + 1
+
+    min_frames = np.full((n_cams, n_cams), -np.inf)
+    max_frames = np.full((n_cams, n_cams), np.inf)
+    for (cam_a, cam_b), window in pairs.items():
+        if cam_a < n_cams and cam_b < n_cams:
+            min_frames[cam_a, cam_b] = window["min"]
+            max_frames[cam_a, cam_b] = window["max"]
+    return min_frames, max_frames
+
+
+def pair_candidates(i, j, seq_ids, cam_ids, intervals, adjacency, min_frames, max_frames):
+    """
+    Classify item pairs (i, j) (index arrays, broadcastable) as KEPT or pruned.
+
+    Rules, applied only to pairs from the same sequence and different cameras
+    (other pairs are left to the clustering constraints):
+      - cameras must be adjacent in the spatial graph;
+      - if the intervals do not overlap, the gap between the end of the earlier
+        track and the start of the later one must lie inside the transit window
+        of (earlier camera -> later camera), when that window is known.
+    """
+    seq_ids = np.asarray(seq_ids)
+    cam_ids = np.asarray(cam_ids)
+    intervals = np.asarray(intervals, dtype=np.int64).reshape(-1, 2)
+    starts, ends = intervals[:, 0], intervals[:, 1]
+
+    cam_i, cam_j = cam_ids[i], cam_ids[j]
+    n_cams = len(adjacency)
+    known = (cam_i < n_cams) & (cam_j < n_cams)
+    ci, cj = np.where(known, cam_i, 0), np.where(known, cam_j, 0)
+
+    applies = (seq_ids[i] == seq_ids[j]) & (cam_i != cam_j) & known
+    adjacent = adjacency[ci, cj]
+
+    # j after i: gap = start_j - end_i, window (cam_i -> cam_j); symmetric for i after j
+    j_after = starts[j] > ends[i]
+    i_after = starts[i] > ends[j]
+    gap = np.where(j_after, starts[j] - ends[i], starts[i] - ends[j])
+    src = np.where(j_after, ci, cj)
+    dst = np.where(j_after, cj, ci)
+    n_windows = len(min_frames)
+    in_table = (src < n_windows) & (dst < n_windows)
+    src, dst = np.where(in_table, src, 0), np.where(in_table, dst, 0)
+    in_window = ~in_table | ((gap >= min_frames[src, dst]) & (gap <= max_frames[src, dst]))
+    transit_ok = ~(j_after | i_after) | in_window
+
+    reason = np.full(np.broadcast(i, j).shape, KEPT, dtype=np.int8)
+    reason[applies & ~adjacent] = PRUNED_TOPOLOGY
+    reason[applies & adjacent & ~transit_ok] = PRUNED_TRANSIT
+    return reason
+
+
+def candidate_mask(seq_ids, cam_ids, intervals, spatial_neighbors=None, temporal_neighbors=None):
+    """
+    Dense (N, N) candidate mask for N items (tracklets or nodes).
+
+    Args:
+        seq_ids, cam_ids: per-item sequence and camera ids
+        intervals: per-item (frame_start, frame_end)
+        spatial_neighbors / temporal_neighbors: default to `config`
+
+    Returns:
+        (mask, BlockingReport)
+    """
+    adjacency = camera_adjacency(spatial_neighbors)
+    min_frames, max_frames = transit_windows(temporal_neighbors, n_cams=len(adjacency))
+
+    n = len(seq_ids)
+    idx = np.arange(n)
+    reason = pair_candidates(idx[:, None], idx[None, :], seq_ids, cam_ids, intervals,
+                             adjacency, min_frames, max_frames)
+
+    upper = np.triu(np.ones((n, n), dtype=bool), k=1)
+    report = BlockingReport(
+        total_pairs=int(upper.sum()),
+        kept_pairs=int(((reason == KEPT) & upper).sum()),
+        pruned_topology=int(((reason == PRUNED_TOPOLOGY) & upper).sum()),
+        pruned_transit=int(((reason == PRUNED_TRANSIT) & upper).sum()),
+    )
+    return reason == KEPT, report
+
+
+def edge_candidates(rows, cols, seq_ids, cam_ids, intervals, spatial_neighbors=None, temporal_neighbors=None):
+    """
+    Same rules as `candidate_mask` applied to the edges of a sparse graph.
+
+    Returns:
+        (keep, BlockingReport) where keep is a boolean mask over the edges
+    """
+    adjacency = camera_adjacency(spatial_neighbors)
+    min_frames, max_frames = transit_windows(temporal_neighbors, n_cams=len(adjacency))
+    reason = pair_candidates(np.asarray(rows), np.asarray(cols), seq_ids, cam_ids, intervals,
+                             adjacency, min_frames, max_frames)
+
+    report = BlockingReport(
+        total_pairs=len(reason),
+        kept_pairs=int((reason == KEPT).sum()),
+        pruned_topology=int((reason == PRUNED_TOPOLOGY).sum()),
+        pruned_transit=int((reason == PRUNED_TRANSIT).sum()),
+    )
+    return reason == KEPT, report
@@ -0,0 +1,221 @@
+import argparse
+import glob
+import os
+import shutil
+import time
+
+import numpy as np
+
+# Crops of a camera live in `{crops_base}/seq_xxx/camera_y/{obj_id}_{frame_id}.webp`.
+# A camera can also be packed into two files next to its folder:
+#   camera_y.pack       the crop files back to back, grouped by object, by frame inside an object
+#   camera_y.idx.npz    obj, frame, offset, size and original file name of every crop
+PACK_SUFFIX = '.pack'
+INDEX_SUFFIX = '.idx.npz'
+
+
+def parse_crop_name(filename):
+    """(obj_id, frame_id) of a `{obj_id}_{frame_id}.webp` crop, or None for other files."""
+    if not filename.endswith('.webp'):
+        return None
+    parts = filename[:-len('.webp')].split('_')
+    if len(parts) != 2 or not parts[0].isdigit() or not parts[1].isdigit():
+        return None
+    return int(parts[0]), int(parts[1])
+
+
+class CameraCrops:
+    """
+    Crops of one (seq, cam), indexed once: obj_id -> [(frame_id, filename)] sorted
+    by frame. Reads come from the folder, or from the packed shard when there is one.
+    """
+
+    def __init__(self, crops_dir, use_pack=True):
+        self.crops_dir = os.path.normpath(crops_dir)
+        self.pack_path = self.crops_dir + PACK_SUFFIX
+        self.packed = use_pack and os.path.exists(self.crops_dir + INDEX_SUFFIX)
+        self.exists = self.packed or os.path.isdir(self.crops_dir)
+        self.index = {}
+        self._location = {}
+        self._pack = None
+
+        if self.packed:
+            with np.load(self.crops_dir + INDEX_SUFFIX) as data:
+                entries = zip(data['obj'].tolist(), data['frame'].tolist(), data['name'].tolist(),
+                              data['offset'].tolist(), data['size'].tolist())
+                for obj_id, frame_id, name, offset, size in entries:
+                    self.index.setdefault(obj_id, []).append((frame_id, name))
+                    self._location[name] = (offset, size)
+        elif self.exists:
+            with os.scandir(self.crops_dir) as it:
+                for entry in it:
+                    parsed = parse_crop_name(entry.name)
+                    if parsed is not None:
+                        self.index.setdefault(parsed[0], []).append((parsed[1], entry.name))
+            for crops in self.index.values():
+                crops.sort()
+
+    def __len__(self):
+        return sum(len(crops) for crops in self.index.values())
+
+    def __contains__(self, obj_id):
+        return int(obj_id) in self.index
+
+    def objects(self):
+        return sorted(self.index)
+
+    def crops(self, obj_id):
+        """[(frame_id, filename)] of an object, empty if it has no crops."""
+        return self.index.get(int(obj_id), [])
+
+    def counts(self):
+        """{obj_id: number of crops}"""
+        return {obj_id: len(crops) for obj_id, crops in self.index.items()}
+
+    def path(self, filename):
+        """Path of a crop file in the folder (not available for packed cameras)."""
+        if self.packed:
+            raise ValueError(f"{self.crops_dir} is packed; read crops with read() or copy()")
+        return os.path.join(self.crops_dir, filename)
+
+    def source(self, filename):
+        """Where a crop's bytes are: {'path'} of its file, or {'path', 'offset', 'size'} in the pack."""
+        if not self.packed:
+            return {'path': self.path(filename)}
+        offset, size = self._location[filename]
+        return {'path': self.pack_path, 'offset': offset, 'size': size}
+
+    def read(self, filename):
+        """Encoded bytes of a crop."""
+        if not self.packed:
+            with open(self.path(filename), 'rb') as f:
+                return f.read()
+        offset, size = self._location[filename]
+        return bytes(self._pack_view()[offset:offset + size])
+
+    def _pack_view(self):
+        """The pack file, mapped once per camera on the first read."""
+        if self._pack is None:
+            if os.path.getsize(self.pack_path) == 0:
+                self._pack = np.zeros(0, dtype=np.uint8)
+            else:
+                self._pack = np.memmap(self.pack_path, dtype=np.uint8, mode='r')
+        return self._pack
+
+    def close(self):
+        """Unmap the pack file; the next read maps it again."""
+        self._pack = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pack'] = None
+        return state
+
+    def copy(self, filename, dst_path):
+        """Copy a crop to `dst_path`."""
+        if not self.packed:
+            shutil.copy2(self.path(filename), dst_path)
+            return
+        with open(dst_path, 'wb') as f:
+            f.write(self.read(filename))
+
+
+class CropCatalog:
+    """Crops of every camera under `crops_base_dir`; each camera is indexed on first use."""
+
+    def __init__(self, crops_base_dir='data/crops', use_packs=True):
+        self.crops_base_dir = crops_base_dir
+        self.use_packs = use_packs
+        self._cameras = {}
+
+    def camera(self, seq_id, cam_id):
+        key = (int(seq_id), int(cam_id))
+        if key not in self._cameras:
+            crops_dir = os.path.join(self.crops_base_dir, f"seq_{key[0]:03d}", f"camera_{key[1]}")
+            self._cameras[key] = CameraCrops(crops_dir, self.use_packs)
+        return self._cameras[key]
+
+    def crops(self, seq_id, cam_id, obj_id):
+        return self.camera(seq_id, cam_id).crops(obj_id)
+
+
+def pack_camera(crops_dir):
+    """
+    Pack the crops of one camera folder into `camera_y.pack` + `camera_y.idx.npz`.
+    The folder itself is left in place.
+
+    Returns:
+        Number of packed crops
+    """
+    camera = CameraCrops(crops_dir, use_pack=False)
+    pack_path = camera.crops_dir + PACK_SUFFIX
+    index_path = camera.crops_dir + INDEX_SUFFIX
+
+    objs, frames, names, offsets, sizes = [], [], [], [], []
+    offset = 0
+    with open(pack_path + '.tmp', 'wb') as pack:
+        for obj_id in camera.objects():
+            for frame_id, name in camera.crops(obj_id):
+                data = camera.read(name)
+                pack.write(data)
+                objs.append(obj_id)
+                frames.append(frame_id)
+                names.append(name)
+                offsets.append(offset)
+                sizes.append(len(data))
+                offset += len(data)
+
+    with open(index_path + '.tmp', 'wb') as f:
+        np.savez(
+            f,
+            obj=np.asarray(objs, dtype=np.int64),
+            frame=np.asarray(frames, dtype=np.int64),
+            name=np.asarray(names, dtype=str),
+            offset=np.asarray(offsets, dtype=np.int64),
+            size=np.asarray(sizes, dtype=np.int64),
+        )
+    # The index is renamed last: a camera counts as packed only once both files are complete
+    os.replace(pack_path + '.tmp', pack_path)
+    os.replace(index_path + '.tmp', index_path)
+    return len(names)
+
+
+def pack_crops(crops_base_dir='data/crops'):
+    """Pack every `seq_*/camera_*` folder under `crops_base_dir`."""
+    start = time.perf_counter()
+    crops_dirs = sorted(d for d in glob.glob(os.path.join(crops_base_dir, 'seq_*', 'camera_*')) if os.path.isdir(d))
+    total = 0
+    for crops_dir in crops_dirs:
+        n = pack_camera(crops_dir)
+        total += n
+        print(f"  {os.path.relpath(crops_dir, crops_base_dir)}: {n} crops")
+    print(f"Packed {total} crops of {len(crops_dirs)} cameras in {time.perf_counter() - start:.2f}s")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crop catalog and packed crop shards")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pack = subparsers.add_parser('pack', help="pack every camera folder into one shard file")
+    pack.add_argument('--crops-dir', default='data/crops')
+
+    info = subparsers.add_parser('info', help="print the number of objects and crops per camera")
+    info.add_argument('--crops-dir', default='data/crops')
+
+    args = parser.parse_args()
+    if args.command == 'pack':
+        pack_crops(args.crops_dir)
+        return
+
+    for crops_dir in sorted(glob.glob(os.path.join(args.crops_dir, 'seq_*', 'camera_*'))):
+        if not os.path.isdir(crops_dir):
+            continue
+        camera = CameraCrops(crops_dir)
+        source = 'packed' if camera.packed else 'folder'
+        print(f"  {os.path.relpath(crops_dir, args.crops_dir)}: {len(camera.index)} objects, "
+              f"{len(camera)} crops ({source})")
+
+
+if __name__ == "__main__":
+    main()
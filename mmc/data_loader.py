@@ -1,9 +1,10 @@
 import json
 import pickle
-import re
-import ast
 import os
 from config import config
+from detection_store import DetectionStore
+from embedding_store import EmbeddingStore
+from feature_import import FeatureDimensionError, parse_feature_line
 
 def load_metadata_file(file_path):
     # Giả sử mỗi dòng có định dạng: seq_id cam_id frame_id object_id x y w h
@@ -20,28 +21,26 @@ def load_metadata_file(file_path):
             metadata[key].append({'frame_id': frame_id, 'bbox': bbox})
     return metadata
 
+def load_metadata_store(store_dir, seq_id, cam_id):
+    # Same mapping as load_metadata_file, memory-mapped from a detection store (mmc/detection_store.py)
+    return DetectionStore(store_dir).camera(seq_id, cam_id)
+
 def load_features_file(file_path):
     # Giả sử mỗi dòng có định dạng: int int int list list (seq_id, cam_id, object_id, vector_reid, vector_clip)
+    # Lines are parsed by feature_import.parse_feature_line; each vector is checked against its own dimension
     features = {}
     with open(file_path, 'r') as f:
         for line in f:
-            numbers = re.findall(r'\b\d+\b', line)
-
-            # Vector
-            lists = re.findall(r'\[[^\]]*\]', line)
-            if len(lists) != 2: continue
-
-            vector_reid = ast.literal_eval(lists[0])
-            vector_clip = ast.literal_eval(lists[1])
-
-            if len(vector_reid) != config.reid_dim or len(vector_clip) != config.reid_dim:
+            if not line.strip(): continue
+            try:
+                key, vector_reid, vector_clip = parse_feature_line(line, config.reid_dim, config.clip_dim)
+            except FeatureDimensionError:
                 print(f"Lỗi: Chiều của vector reid hoặc clip không khớp!")
                 continue
+            except ValueError as e:
+                print(f"Lỗi: Dòng không đúng định dạng ({e})")
+                continue
 
-            # Seq + Cam + Object
-            seq_id, cam_id, object_id = numbers[0], numbers[1], numbers[2]
-
-            key = (seq_id, cam_id, object_id)
             features[key] = {
                 "vector_reid": vector_reid,
                 "vector_clip": vector_clip,
@@ -61,13 +60,39 @@ def load_features_pkl(file_path):
     return features
 
 
-def load_all_data(cam_files):
+def load_features_store(store_dir, seq_id, cam_id):
+    # Same mapping as load_features_pkl, with row views into an embedding store (mmc/embedding_store.py)
+    store = EmbeddingStore(store_dir)
+    features = {}
+    for key, values in store.feature_dict(store.select(seq_id, cam_id)).items():
+        features[key] = {
+            "vector_reid": values['reid'],
+            "vector_clip": values['clip']
+        }
+    return features
+
+def load_all_data(cam_files, exclusions=None):
     # Dịnh dạng: (meta_file_path, feature_file_path)
+    # meta_file may also be a DetectionStore view (see load_metadata_store),
+    # features_file an already loaded feature dict (see load_features_store)
+    # exclusions: ExclusionSet (mmc/exclusions.py) of tracks to drop; a DetectionStore
+    # view is kept as is since tracks are driven by the features
+    def features(features_file):
+        features = features_file if isinstance(features_file, dict) else load_features_pkl(features_file)
+        return exclusions.filter(features) if exclusions is not None else features
+
+    def metadata(meta_file):
+        metadata = load_metadata_file(meta_file)
+        return exclusions.filter(metadata) if exclusions is not None else metadata
+
+    if len(cam_files) == 1 and isinstance(cam_files[0][0], DetectionStore):
+        return cam_files[0][0], features(cam_files[0][1])
+
     all_metadatas = {}
     all_features = {}
     for meta_file, features_file in cam_files:
-        all_metadatas.update(load_metadata_file(meta_file))
-        all_features.update(load_features_pkl(features_file))
+        all_metadatas.update(meta_file if isinstance(meta_file, DetectionStore) else metadata(meta_file))
+        all_features.update(features(features_file))
     return all_metadatas, all_features
 
 
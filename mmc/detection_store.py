@@ -0,0 +1,215 @@
+import argparse
+import copy
+import glob
+import json
+import os
+import re
+import time
+from collections.abc import Mapping
+
+import numpy as np
+
+# Store layout (one directory for a whole site):
+#   meta.json            files (seq, cam, source, track range), counts, bbox dtype
+#   seq.npy, cam.npy,    per-detection int32 columns, rows grouped by track
+#   obj.npy, frame.npy   and sorted by frame inside a track
+#   bbox.npy             (N, 4) x1 y1 x2 y2, int32 if the source is integral else float32
+#   track_keys.npy       (T, 3) (seq_id, cam_id, obj_id), tracks in first-appearance order per file
+#   track_offsets.npy    (T + 1,) rows of track t are [offsets[t], offsets[t + 1])
+STORE_VERSION = 1
+COLUMNS = ('seq', 'cam', 'obj', 'frame', 'bbox')
+
+
+def _read_metadata_text(path):
+    """Parse a `seq cam frame obj x1 y1 x2 y2` metadata file into an (N, 8) array."""
+    if os.path.getsize(path) == 0:
+        return np.zeros((0, 8))
+    return np.loadtxt(path, dtype=np.float64, ndmin=2)[:, :8]
+
+
+def convert_metadata_dir(metadata_dir='data/new_metadata_objects', store_dir='data/detection_store'):
+    """
+    Convert every `seq_*/seq_*_camera_*.txt` file under `metadata_dir` into a
+    columnar store in `store_dir`.
+    """
+    paths = sorted(glob.glob(os.path.join(metadata_dir, 'seq_*', 'seq_*_camera_*.txt')))
+    if not paths:
+        raise FileNotFoundError(f"No metadata files found in {metadata_dir}")
+
+    start = time.perf_counter()
+    blocks, files, track_keys, track_sizes = [], [], [], []
+    for path in paths:
+        data = _read_metadata_text(path)
+        seq_name, cam_id = re.match(r"(seq_\d+)_camera_(\d+)\.txt$", os.path.basename(path)).groups()
+
+        keys = data[:, [0, 1, 3]].astype(np.int64)
+        unique, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        # Tracks in order of first appearance, like the dicts of `load_metadata_file`
+        rank = np.empty(len(unique), dtype=np.int64)
+        rank[np.argsort(first, kind='stable')] = np.arange(len(unique))
+        track_of_row = rank[inverse.reshape(-1)]
+        order = np.lexsort((data[:, 2], track_of_row))
+
+        files.append({
+            'seq_id': int(seq_name.split('_')[-1]),
+            'cam_id': int(cam_id),
+            'source': os.path.relpath(path, metadata_dir),
+            'track_start': len(track_keys),
+            'track_stop': len(track_keys) + len(unique),
+        })
+        track_keys.extend(unique[np.argsort(first, kind='stable')].tolist())
+        track_sizes.extend(np.bincount(track_of_row, minlength=len(unique)).tolist())
+        blocks.append(data[order])
+
+    data = np.concatenate(blocks)
+    integral = bool(np.all(data[:, 4:8] == np.round(data[:, 4:8])))
+    bbox_dtype = np.int32 if integral else np.float32
+
+    os.makedirs(store_dir, exist_ok=True)
+    np.save(os.path.join(store_dir, 'seq.npy'), data[:, 0].astype(np.int32))
+    np.save(os.path.join(store_dir, 'cam.npy'), data[:, 1].astype(np.int32))
+    np.save(os.path.join(store_dir, 'frame.npy'), data[:, 2].astype(np.int32))
+    np.save(os.path.join(store_dir, 'obj.npy'), data[:, 3].astype(np.int32))
+    np.save(os.path.join(store_dir, 'bbox.npy'), data[:, 4:8].astype(bbox_dtype))
+    np.save(os.path.join(store_dir, 'track_keys.npy'), np.asarray(track_keys, dtype=np.int64).reshape(-1, 3))
+    np.save(os.path.join(store_dir, 'track_offsets.npy'), np.concatenate([[0], np.cumsum(track_sizes)]).astype(np.int64))
+    with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+        json.dump({
+            'version': STORE_VERSION,
+            'n_detections': len(data),
+            'n_tracks': len(track_keys),
+            'bbox_dtype': np.dtype(bbox_dtype).name,
+            'files': files,
+        }, f, indent=2)
+
+    print(f"Converted {len(paths)} files: {len(data)} detections, {len(track_keys)} tracks "
+          f"in {time.perf_counter() - start:.2f}s -> {store_dir}")
+    return store_dir
+
+
+class DetectionStore(Mapping):
+    """
+    Memory-mapped view of a detection store.
+
+    Behaves as a read-only mapping {(seq_id, cam_id, obj_id): [{'frame_id', 'bbox'}, ...]}
+    like `load_metadata_file`, but records are only built for the tracks that are
+    accessed; `frames(key)`, `bboxes(key)`, `intervals()` and the column arrays
+    give array views without building them at all.
+    """
+
+    def __init__(self, store_dir='data/detection_store'):
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != STORE_VERSION:
+            raise ValueError(f"Unsupported detection store version {self.meta['version']} in {store_dir}")
+
+        self.store_dir = store_dir
+        load = lambda name: np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode='r')
+        self.columns = {name: load(name) for name in COLUMNS}
+        self.track_keys = load('track_keys')
+        self.track_offsets = load('track_offsets')
+        self._tracks = (0, self.meta['n_tracks'])
+        self._index = None
+
+    @property
+    def files(self):
+        return self.meta['files']
+
+    def camera(self, seq_id, cam_id):
+        """View restricted to the tracks of one (seq_id, cam_id) file."""
+        for entry in self.files:
+            if entry['seq_id'] == seq_id and entry['cam_id'] == cam_id:
+                view = copy.copy(self)
+                view._tracks = (entry['track_start'], entry['track_stop'])
+                view._index = None
+                return view
+        raise KeyError(f"No detections for seq {seq_id}, camera {cam_id}")
+
+    @property
+    def rows(self):
+        """Row range of this view (the rows of a camera are contiguous)."""
+        return int(self.track_offsets[self._tracks[0]]), int(self.track_offsets[self._tracks[1]])
+
+    def column(self, name):
+        """Column array (view) for the rows of this store or camera view."""
+        start, stop = self.rows
+        return self.columns[name][start:stop]
+
+    def keys_array(self):
+        """(T, 3) track keys of this view."""
+        return self.track_keys[self._tracks[0]:self._tracks[1]]
+
+    def offsets(self):
+        """(T + 1,) track offsets of this view, relative to `column()`."""
+        offsets = self.track_offsets[self._tracks[0]:self._tracks[1] + 1]
+        return offsets - offsets[0]
+
+    def intervals(self):
+        """(T, 2) first and last frame of every track of this view."""
+        frames, offsets = self.column('frame'), self.offsets()
+        if len(offsets) < 2:
+            return np.zeros((0, 2), dtype=np.int32)
+        return np.stack([frames[offsets[:-1]], frames[offsets[1:] - 1]], axis=1)
+
+    def _track(self, key):
+        if self._index is None:
+            start = self._tracks[0]
+            self._index = {tuple(k): start + i for i, k in enumerate(self.keys_array().tolist())}
+        return self._index[tuple(int(k) for k in key)]
+
+    def _slice(self, key):
+        track = self._track(key)
+        return slice(int(self.track_offsets[track]), int(self.track_offsets[track + 1]))
+
+    def frames(self, key):
+        return self.columns['frame'][self._slice(key)]
+
+    def bboxes(self, key):
+        return self.columns['bbox'][self._slice(key)]
+
+    def __getitem__(self, key):
+        rows = self._slice(key)
+        frames = self.columns['frame'][rows].tolist()
+        bboxes = self.columns['bbox'][rows].tolist()
+        return [{'frame_id': frame, 'bbox': bbox} for frame, bbox in zip(frames, bboxes)]
+
+    def __contains__(self, key):
+        try:
+            self._track(key)
+        except (KeyError, TypeError, ValueError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(tuple(k) for k in self.keys_array().tolist())
+
+    def __len__(self):
+        return self._tracks[1] - self._tracks[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar detection store")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert = subparsers.add_parser('convert', help="convert metadata text files into a store")
+    convert.add_argument('--metadata-dir', default='data/new_metadata_objects')
+    convert.add_argument('--store', default='data/detection_store')
+
+    info = subparsers.add_parser('info', help="print store statistics")
+    info.add_argument('--store', default='data/detection_store')
+
+    args = parser.parse_args()
+    if args.command == 'convert':
+        convert_metadata_dir(args.metadata_dir, args.store)
+        return
+
+    start = time.perf_counter()
+    store = DetectionStore(args.store)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"Opened {args.store} in {elapsed:.1f} ms")
+    print(f"  {store.meta['n_detections']} detections, {store.meta['n_tracks']} tracks, "
+          f"{len(store.files)} files, bbox {store.meta['bbox_dtype']}")
+
+
+if __name__ == "__main__":
+    main()
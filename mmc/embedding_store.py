@@ -0,0 +1,336 @@
+import argparse
+import glob
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+
+from quantization import quantize_int8
+
+# Store layout (one directory):
+#   meta.json           dtype, dimension per modality, number of committed rows
+#   keys.bin            (N, 3) int64 (seq_id, cam_id, obj_id) in row (append) order
+#   {modality}.bin      (N, D) float32, float16 or int8 rows, contiguous, one file per modality
+#   {modality}.scale.bin  (N,) float32 per-row scale of int8 stores (vector = codes * scale)
+#   sorted_codes.npy    packed keys in ascending order ...
+#   sorted_rows.npy     ... and the row of each, for vectorized lookup
+# Rows past meta.json's `n_rows` (an interrupted append) are ignored.
+STORE_VERSION = 1
+MODALITIES = {'reid': 512, 'clip': 1024}
+
+# Packed key: seq_id (21 bits) | cam_id (10 bits) | obj_id (32 bits)
+_CAM_SHIFT = 32
+_SEQ_SHIFT = 42
+_KEY_LIMITS = np.array([1 << (63 - _SEQ_SHIFT), 1 << (_SEQ_SHIFT - _CAM_SHIFT), 1 << _CAM_SHIFT], dtype=np.int64)
+
+
+def encode_keys(keys):
+    """Pack (N, 3) (seq_id, cam_id, obj_id) keys into sortable int64 codes."""
+    keys = np.asarray(keys, dtype=np.int64).reshape(-1, 3)
+    bad = ((keys < 0) | (keys >= _KEY_LIMITS)).any(axis=1)
+    if bad.any():
+        raise ValueError(f"{bad.sum()} keys outside the packed key range (seq_id < {_KEY_LIMITS[0]}, "
+                         f"cam_id < {_KEY_LIMITS[1]}, obj_id < {_KEY_LIMITS[2]}), "
+                         f"e.g. {tuple(keys[bad][0].tolist())}")
+    return (keys[:, 0] << _SEQ_SHIFT) | (keys[:, 1] << _CAM_SHIFT) | keys[:, 2]
+
+
+class DequantizedRows:
+    """
+    Row view of an int8 store modality: indexing dequantizes only the requested
+    rows, so the matrix is never materialized in float32.
+    """
+
+    def __init__(self, store, modality):
+        self.store, self.modality = store, modality
+        self.shape = store.matrices[modality].shape
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+        return self.store.take(self.modality, rows)
+
+    def __iter__(self, chunk_size=4096):
+        for start in range(0, len(self), chunk_size):
+            yield from self[start:start + chunk_size]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+
+class EmbeddingStore:
+    """
+    Per-track embeddings as contiguous memory-mapped matrices, one per modality,
+    with a sorted key index for vectorized key -> row lookup.
+    """
+
+    def __init__(self, store_dir='data/embedding_store'):
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != STORE_VERSION:
+            raise ValueError(f"Unsupported embedding store version {self.meta['version']} in {store_dir}")
+        self.store_dir = store_dir
+        self._open()
+
+    @classmethod
+    def create(cls, store_dir='data/embedding_store', dtype='float32', dims=None):
+        """Create an empty store; `dims` defaults to MODALITIES."""
+        if np.dtype(dtype) not in (np.float32, np.float16, np.int8):
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
+        if os.path.exists(os.path.join(store_dir, 'meta.json')):
+            raise FileExistsError(f"An embedding store already exists in {store_dir}")
+
+        os.makedirs(store_dir, exist_ok=True)
+        dims = dict(dims or MODALITIES)
+        names = ['keys'] + list(dims)
+        if np.dtype(dtype) == np.int8:
+            names += [f"{name}.scale" for name in dims]
+        for name in names:
+            open(os.path.join(store_dir, f"{name}.bin"), 'wb').close()
+        np.save(os.path.join(store_dir, 'sorted_codes.npy'), np.zeros(0, dtype=np.int64))
+        np.save(os.path.join(store_dir, 'sorted_rows.npy'), np.zeros(0, dtype=np.int64))
+        with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+            json.dump({'version': STORE_VERSION, 'dtype': np.dtype(dtype).name, 'dims': dims, 'n_rows': 0}, f, indent=2)
+        return cls(store_dir)
+
+    def _open(self):
+        n = self.meta['n_rows']
+        dtype = np.dtype(self.meta['dtype'])
+
+        def memmap(name, dt, width):
+            if n == 0:
+                return np.zeros((0, width), dtype=dt)
+            return np.memmap(os.path.join(self.store_dir, f"{name}.bin"), dtype=dt, mode='r', shape=(n, width))
+
+        self.keys = memmap('keys', np.int64, 3)
+        self.matrices = {name: memmap(name, dtype, dim) for name, dim in self.meta['dims'].items()}
+        self.scales = None
+        if dtype == np.int8:
+            self.scales = {name: memmap(f"{name}.scale", np.float32, 1)[:, 0] for name in self.meta['dims']}
+        self.sorted_codes = np.load(os.path.join(self.store_dir, 'sorted_codes.npy'), mmap_mode='r')
+        self.sorted_rows = np.load(os.path.join(self.store_dir, 'sorted_rows.npy'), mmap_mode='r')
+        if len(self.sorted_rows) and self.sorted_rows.max() >= n:
+            # Index already rewritten by an append that has not committed yet
+            keep = np.asarray(self.sorted_rows) < n
+            self.sorted_codes, self.sorted_rows = self.sorted_codes[keep], self.sorted_rows[keep]
+
+    def __len__(self):
+        return self.meta['n_rows']
+
+    @property
+    def dtype(self):
+        return np.dtype(self.meta['dtype'])
+
+    def matrix(self, modality):
+        """
+        (N, D) memory-mapped matrix of a modality, rows in append order. For int8
+        stores this is a `DequantizedRows` view that dequantizes the rows it is
+        indexed with; see also `codes` and `take`.
+        """
+        if self.scales is not None:
+            return DequantizedRows(self, modality)
+        return self.matrices[modality]
+
+    def codes(self, modality):
+        """Stored rows as they are: (matrix, None), or (int8 codes, per-row scales) for int8 stores."""
+        return self.matrices[modality], None if self.scales is None else self.scales[modality]
+
+    def take(self, modality, rows):
+        """float32 (or float16) vectors of `rows` (indices or a slice), dequantized for int8 stores."""
+        block = self.matrices[modality][rows]
+        if self.scales is None:
+            return np.asarray(block)
+        return block.astype(np.float32) * np.asarray(self.scales[modality][rows])[..., None]
+
+    def rows(self, keys, missing='raise'):
+        """
+        Rows of (N, 3) keys. Unknown keys raise KeyError, or give -1 with
+        missing='ignore'.
+        """
+        codes = encode_keys(keys)
+        sorted_codes = np.asarray(self.sorted_codes)
+        if len(sorted_codes):
+            pos = np.minimum(np.searchsorted(sorted_codes, codes), len(sorted_codes) - 1)
+            found = sorted_codes[pos] == codes
+        else:
+            pos, found = np.zeros(len(codes), dtype=np.int64), np.zeros(len(codes), dtype=bool)
+        if missing == 'raise' and not found.all():
+            first = np.asarray(keys, dtype=np.int64).reshape(-1, 3)[~found][0]
+            raise KeyError(f"{(~found).sum()} keys not in the store, e.g. {tuple(first.tolist())}")
+        rows = np.full(len(codes), -1, dtype=np.int64)
+        rows[found] = np.asarray(self.sorted_rows)[pos[found]]
+        return rows
+
+    def get(self, modality, keys):
+        """(len(keys), D) embeddings of the given keys (a copy)."""
+        return self.take(modality, self.rows(keys))
+
+    def select(self, seq_id, cam_id=None):
+        """Rows of one sequence (or one camera of it) via the sorted index, in append order."""
+        lo = encode_keys([(seq_id, cam_id or 0, 0)])[0]
+        hi = encode_keys([(seq_id + 1, 0, 0)] if cam_id is None else [(seq_id, cam_id + 1, 0)])[0]
+        start, stop = np.searchsorted(self.sorted_codes, [lo, hi])
+        return np.sort(self.sorted_rows[start:stop])
+
+    def __contains__(self, key):
+        return bool(self.rows([key], missing='ignore')[0] >= 0)
+
+    def append(self, keys, **vectors):
+        """
+        Append rows: `keys` (M, 3) and one (M, D) array per modality, e.g.
+        store.append(keys, reid=reid, clip=clip). Keys must be new.
+        """
+        keys = np.asarray(keys, dtype=np.int64).reshape(-1, 3)
+        if set(vectors) != set(self.meta['dims']):
+            raise ValueError(f"Expected vectors for {sorted(self.meta['dims'])}, got {sorted(vectors)}")
+        codes = encode_keys(keys)
+        if len(np.unique(codes)) != len(codes) or (self.rows(keys, missing='ignore') >= 0).any():
+            raise ValueError("Duplicate keys: rows can only be appended once")
+
+        n = len(self)
+        dtype = self.dtype
+        with open(os.path.join(self.store_dir, 'keys.bin'), 'r+b') as f:
+            f.seek(n * 3 * 8)
+            f.write(np.ascontiguousarray(keys).tobytes())
+        for name, dim in self.meta['dims'].items():
+            block = np.asarray(vectors[name], dtype=np.float32).reshape(len(keys), dim)
+            if dtype == np.int8:
+                block, scales = quantize_int8(block)
+                with open(os.path.join(self.store_dir, f"{name}.scale.bin"), 'r+b') as f:
+                    f.seek(n * 4)
+                    f.write(scales.tobytes())
+            block = np.ascontiguousarray(block, dtype=dtype)
+            with open(os.path.join(self.store_dir, f"{name}.bin"), 'r+b') as f:
+                f.seek(n * dim * dtype.itemsize)
+                f.write(block.tobytes())
+
+        all_codes = np.concatenate([np.asarray(self.sorted_codes), codes])
+        all_rows = np.concatenate([np.asarray(self.sorted_rows), np.arange(n, n + len(keys))])
+        order = np.argsort(all_codes, kind='stable')
+        np.save(os.path.join(self.store_dir, 'sorted_codes.npy'), all_codes[order])
+        np.save(os.path.join(self.store_dir, 'sorted_rows.npy'), all_rows[order])
+
+        # Commit: readers only see rows up to n_rows
+        self.meta['n_rows'] = n + len(keys)
+        tmp_path = os.path.join(self.store_dir, 'meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.store_dir, 'meta.json'))
+        self._open()
+
+    def upsert(self, keys, **vectors):
+        """
+        Like `append`, but keys already in the store have their rows overwritten
+        in place; the new keys are appended.
+        """
+        keys = np.asarray(keys, dtype=np.int64).reshape(-1, 3)
+        if set(vectors) != set(self.meta['dims']):
+            raise ValueError(f"Expected vectors for {sorted(self.meta['dims'])}, got {sorted(vectors)}")
+        if len(np.unique(encode_keys(keys))) != len(keys):
+            raise ValueError("Duplicate keys: each key can only be given once")
+        rows = self.rows(keys, missing='ignore')
+        existing = rows >= 0
+        if existing.any():
+            n = len(self)
+            dtype = self.dtype
+            for name, dim in self.meta['dims'].items():
+                block = np.asarray(vectors[name], dtype=np.float32).reshape(len(keys), dim)[existing]
+                if dtype == np.int8:
+                    block, scales = quantize_int8(block)
+                    scale_map = np.memmap(os.path.join(self.store_dir, f"{name}.scale.bin"), dtype=np.float32,
+                                          mode='r+', shape=(n,))
+                    scale_map[rows[existing]] = scales
+                    scale_map.flush()
+                matrix = np.memmap(os.path.join(self.store_dir, f"{name}.bin"), dtype=dtype, mode='r+', shape=(n, dim))
+                matrix[rows[existing]] = block
+                matrix.flush()
+            self._open()
+        if not existing.all():
+            self.append(keys[~existing], **{
+                name: np.asarray(vectors[name], dtype=np.float32).reshape(len(keys), dim)[~existing]
+                for name, dim in self.meta['dims'].items()
+            })
+        return int(existing.sum())
+
+    def feature_dict(self, rows=None):
+        """
+        `{(seq_id, cam_id, obj_id): {'reid': ..., 'clip': ...}}` like the feature
+        pickles, with row views into the memory maps (no copy; int8 stores give
+        dequantized float32 copies).
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+        keys = [tuple(k) for k in np.asarray(self.keys)[rows].tolist()]
+        if self.scales is not None:
+            matrices = {name: self.take(name, np.asarray(rows)) for name in self.matrices}
+            rows = np.arange(len(keys))
+        else:
+            matrices = self.matrices
+        return {
+            key: {name: matrix[row] for name, matrix in matrices.items()}
+            for key, row in zip(keys, np.asarray(rows).tolist())
+        }
+
+
+def read_feature_pickle(path):
+    """
+    Compatibility reader for the old per-camera feature pickles.
+
+    Returns:
+        (keys (N, 3), {'reid': (N, 512), 'clip': (N, 1024)}) as float32
+    """
+    with open(path, 'rb') as f:
+        features = pickle.load(f)
+    keys = np.asarray([tuple(int(k) for k in key) for key in features], dtype=np.int64).reshape(-1, 3)
+    vectors = {
+        name: np.stack([feat[name] for feat in features.values()]).astype(np.float32) if features
+        else np.zeros((0, dim), dtype=np.float32)
+        for name, dim in MODALITIES.items()
+    }
+    return keys, vectors
+
+
+def convert_feature_dir(feature_dir='data/new_feature_objects', store_dir='data/embedding_store', dtype='float32'):
+    """Append every `seq_*/*.pkl` feature pickle under `feature_dir` to a new store."""
+    start = time.perf_counter()
+    store = EmbeddingStore.create(store_dir, dtype=dtype)
+    paths = sorted(glob.glob(os.path.join(feature_dir, 'seq_*', '*.pkl')))
+    for path in paths:
+        keys, vectors = read_feature_pickle(path)
+        if len(keys):
+            store.append(keys, **vectors)
+    print(f"Converted {len(paths)} files: {len(store)} tracks ({store.dtype.name}) "
+          f"in {time.perf_counter() - start:.2f}s -> {store_dir}")
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory-mapped per-track embedding store")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert = subparsers.add_parser('convert', help="convert feature pickles into a new store")
+    convert.add_argument('--feature-dir', default='data/new_feature_objects')
+    convert.add_argument('--store', default='data/embedding_store')
+    convert.add_argument('--dtype', choices=['float32', 'float16', 'int8'], default='float32')
+
+    info = subparsers.add_parser('info', help="print store statistics")
+    info.add_argument('--store', default='data/embedding_store')
+
+    args = parser.parse_args()
+    if args.command == 'convert':
+        convert_feature_dir(args.feature_dir, args.store, args.dtype)
+        return
+
+    start = time.perf_counter()
+    store = EmbeddingStore(args.store)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"Opened {args.store} in {elapsed:.1f} ms")
+    print(f"  {len(store)} tracks, {store.dtype.name}, dims {store.meta['dims']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from embedding_store import encode_keys
+
+# Tombstone file (.npz, no pickles):
+#   codes     sorted packed (seq_id, cam_id, obj_id) keys (see embedding_store.encode_keys)
+#   keys      (N, 3) the same keys, in code order
+#   reasons   (N,) rule that excluded each key, e.g. 'single_image'
+# Loaders keep every file as it is and drop excluded tracks when they read it.
+
+
+class ExclusionSet:
+    """
+    Persistent set of excluded tracks keyed by (seq_id, cam_id, obj_id).
+
+    Adding or removing keys only rewrites this small file; the metadata, feature
+    and crop trees are never copied.
+    """
+
+    def __init__(self, path='data/exclusions.npz'):
+        self.path = path
+        if os.path.exists(path):
+            with np.load(path) as data:
+                self.codes, self.keys, self.reasons = data['codes'], data['keys'], data['reasons']
+        else:
+            self.codes = np.zeros(0, dtype=np.int64)
+            self.keys = np.zeros((0, 3), dtype=np.int64)
+            self.reasons = np.zeros(0, dtype=str)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, key):
+        return bool(self.mask([key])[0])
+
+    def mask(self, keys):
+        """Boolean array, True for every excluded key of (N, 3) `keys`."""
+        codes = encode_keys(keys)
+        if not len(self.codes):
+            return np.zeros(len(codes), dtype=bool)
+        pos = np.minimum(np.searchsorted(self.codes, codes), len(self.codes) - 1)
+        return self.codes[pos] == codes
+
+    def filter(self, mapping):
+        """Copy of a {(seq_id, cam_id, obj_id): value} dict without the excluded tracks."""
+        if not len(self) or not mapping:
+            return dict(mapping)
+        keys = list(mapping)
+        excluded = self.mask(keys).tolist()
+        return {key: mapping[key] for key, drop in zip(keys, excluded) if not drop}
+
+    def add(self, keys, reason=''):
+        """Exclude `keys` and save; returns the number of newly excluded tracks."""
+        keys = np.asarray(keys, dtype=np.int64).reshape(-1, 3)
+        codes, first = np.unique(encode_keys(keys), return_index=True)
+        new = ~np.isin(codes, self.codes)
+        self._update(
+            np.concatenate([self.codes, codes[new]]),
+            np.concatenate([self.keys, keys[first][new]]),
+            np.concatenate([self.reasons, np.full(int(new.sum()), reason)]),
+        )
+        return int(new.sum())
+
+    def remove(self, keys):
+        """Include `keys` again and save; returns the number of restored tracks."""
+        keep = ~np.isin(self.codes, encode_keys(keys))
+        n_removed = int((~keep).sum())
+        self._update(self.codes[keep], self.keys[keep], self.reasons[keep])
+        return n_removed
+
+    def _update(self, codes, keys, reasons):
+        order = np.argsort(codes, kind='stable')
+        self.codes, self.keys, self.reasons = codes[order], keys[order], reasons[order]
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, codes=self.codes, keys=self.keys, reasons=self.reasons)
+        os.replace(tmp_path, self.path)
+
+    def counts(self):
+        """{reason: number of excluded tracks}"""
+        reasons, counts = np.unique(self.reasons, return_counts=True)
+        return dict(zip(reasons.tolist(), counts.tolist()))
+
+
+def load_exclusions(path):
+    """ExclusionSet at `path`, or None when no path is given (nothing excluded)."""
+    return ExclusionSet(path) if path is not None else None
+
+
+def keys_from_ids_json(ids_json):
+    """
+    (N, 3) keys from the `{"seq_000": {"camera_1": ["100001", ...]}}` layout
+    written by tools/select_crop.py.
+    """
+    keys = []
+    for seq_name, cams in ids_json.items():
+        seq_id = int(seq_name.split('_')[-1])
+        for cam_name, obj_ids in cams.items():
+            cam_id = int(cam_name.split('_')[-1])
+            keys.extend((seq_id, cam_id, int(obj_id)) for obj_id in obj_ids)
+    return np.asarray(keys, dtype=np.int64).reshape(-1, 3)
+
+
+def short_track_keys(detection_store, min_detections=2):
+    """Keys of the tracks with fewer than `min_detections` detections in a detection store."""
+    from detection_store import DetectionStore
+
+    store = DetectionStore(detection_store)
+    sizes = np.diff(np.asarray(store.track_offsets))
+    return np.asarray(store.track_keys)[sizes < min_detections]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Track exclusion (tombstone) set applied by the loaders")
+    parser.add_argument('--exclusions', default='data/exclusions.npz')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add_json = subparsers.add_parser('add-json', help="exclude the ids of a select_crop.py JSON file")
+    add_json.add_argument('ids_json')
+    add_json.add_argument('--reason', default='single_image')
+
+    add_short = subparsers.add_parser('add-short', help="exclude tracks with few detections")
+    add_short.add_argument('--detection-store', default='data/detection_store')
+    add_short.add_argument('--min-detections', type=int, default=2)
+    add_short.add_argument('--reason', default='short_track')
+
+    remove = subparsers.add_parser('remove', help="include tracks again")
+    remove.add_argument('keys', nargs='+', help="seq_id,cam_id,obj_id")
+
+    subparsers.add_parser('info', help="print the number of excluded tracks per reason")
+
+    args = parser.parse_args()
+    exclusions = ExclusionSet(args.exclusions)
+    if args.command == 'add-json':
+        with open(args.ids_json) as f:
+            n = exclusions.add(keys_from_ids_json(json.load(f)), args.reason)
+        print(f"Excluded {n} new tracks ({len(exclusions)} total) in {args.exclusions}")
+    elif args.command == 'add-short':
+        n = exclusions.add(short_track_keys(args.detection_store, args.min_detections), args.reason)
+        print(f"Excluded {n} new tracks ({len(exclusions)} total) in {args.exclusions}")
+    elif args.command == 'remove':
+        n = exclusions.remove([tuple(int(v) for v in key.split(',')) for key in args.keys])
+        print(f"Restored {n} tracks ({len(exclusions)} excluded) in {args.exclusions}")
+    else:
+        print(f"{args.exclusions}: {len(exclusions)} excluded tracks")
+        for reason, count in exclusions.counts().items():
+            print(f"  {reason or '(none)'}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import collections
+import glob
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from config import config
+from embedding_store import EmbeddingStore
+
+
+class FeatureDimensionError(ValueError):
+    """A well-formed feature line whose ReID or CLIP vector has the wrong dimension."""
+
+
+def parse_feature_line(line, reid_dim=None, clip_dim=None):
+    """
+    Parse one line of the legacy text feature format
+    `seq_id cam_id object_id [reid...] [clip...]` (any comma/space separators).
+
+    Returns:
+        ((seq_id, cam_id, object_id), reid, clip) with float32 vectors
+
+    Raises:
+        FeatureDimensionError: a vector does not have its configured dimension
+        ValueError: the line is malformed
+    """
+    reid_dim = config.reid_dim if reid_dim is None else reid_dim
+    clip_dim = config.clip_dim if clip_dim is None else clip_dim
+
+    parts = line.split('[')
+    if len(parts) != 3:
+        raise ValueError(f"expected 2 bracketed vectors, found {len(parts) - 1}")
+    header = parts[0].replace(',', ' ').split()
+    if len(header) < 3:
+        raise ValueError("expected seq_id cam_id object_id before the vectors")
+    try:
+        key = tuple(int(v) for v in header[:3])
+    except ValueError:
+        raise ValueError(f"non-integer key {header[:3]}") from None
+
+    with warnings.catch_warnings(record=True) as caught:
+        # Malformed numbers end parsing early with a DeprecationWarning
+        warnings.simplefilter('always', DeprecationWarning)
+        reid = np.fromstring(parts[1].split(']')[0], dtype=np.float32, sep=',')
+        clip = np.fromstring(parts[2].split(']')[0], dtype=np.float32, sep=',')
+    if any(issubclass(w.category, DeprecationWarning) for w in caught):
+        raise ValueError("malformed number in a vector")
+    if len(reid) != reid_dim or len(clip) != clip_dim:
+        raise FeatureDimensionError(f"reid {len(reid)} / clip {len(clip)} values, "
+                                    f"expected {reid_dim} / {clip_dim}")
+    return key, reid, clip
+
+
+def chunk_ranges(path, chunk_bytes=64 << 20):
+    """Split a file into byte ranges of about `chunk_bytes`; lines belong to the range they start in."""
+    size = os.path.getsize(path)
+    return [(start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes)] or [(0, 0)]
+
+
+def _parse_chunk(path, start, end, reid_dim, clip_dim):
+    keys, reid, clip = [], [], []
+    n_lines = n_malformed = n_wrong_dim = 0
+    with open(path, 'rb') as f:
+        f.seek(start)
+        if start > 0:
+            # The line running into this range belongs to the previous one
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            n_lines += 1
+            try:
+                key, vector_reid, vector_clip = parse_feature_line(line.decode(), reid_dim, clip_dim)
+            except FeatureDimensionError:
+                n_wrong_dim += 1
+                continue
+            except ValueError:
+                n_malformed += 1
+                continue
+            keys.append(key)
+            reid.append(vector_reid)
+            clip.append(vector_clip)
+
+    return (
+        np.asarray(keys, dtype=np.int64).reshape(-1, 3),
+        np.stack(reid) if reid else np.zeros((0, reid_dim), dtype=np.float32),
+        np.stack(clip) if clip else np.zeros((0, clip_dim), dtype=np.float32),
+        n_lines,
+        n_malformed,
+        n_wrong_dim,
+    )
+
+
+def _unique_new(store, keys):
+    """Mask of the first occurrence of every key of `keys` that is not in `store`."""
+    _, first = np.unique(keys, axis=0, return_index=True)
+    new = np.zeros(len(keys), dtype=bool)
+    new[first] = True
+    return new & (store.rows(keys, missing='ignore') < 0)
+
+
+def convert_feature_text(paths, store_dir='data/embedding_store', workers=None, chunk_mb=64, dtype='float32',
+                         append_mb=512):
+    """
+    Stream legacy text feature files into an embedding store (mmc/embedding_store.py).
+
+    Files are split into chunks parsed on a process pool, with at most 2 chunks
+    per worker in flight. Parsed rows are consumed in file order and appended in
+    batches of about `append_mb` of vectors, so the store's key index is rewritten
+    once per batch rather than once per chunk. Memory stays at about
+    2 * workers * chunk_mb of parsed chunks plus one batch.
+    Malformed lines and lines with a wrong ReID or CLIP dimension are skipped and
+    counted. A key seen again (in a later line or an existing store) is skipped
+    as a duplicate.
+    """
+    if os.path.exists(os.path.join(store_dir, 'meta.json')):
+        store = EmbeddingStore(store_dir)
+    else:
+        store = EmbeddingStore.create(store_dir, dtype=dtype)
+
+    start_time = time.perf_counter()
+    jobs = [(path, start, end) for path in paths for start, end in chunk_ranges(path, chunk_mb << 20)]
+    total_lines = total_malformed = total_wrong_dim = total_duplicates = 0
+    n_before = len(store)
+    row_bytes = 4 * (config.reid_dim + config.clip_dim)
+    batch = []
+
+    def flush():
+        nonlocal total_duplicates
+        if not batch:
+            return
+        keys, reid, clip = (np.concatenate(parts) for parts in zip(*batch))
+        batch.clear()
+        new = _unique_new(store, keys)
+        total_duplicates += int((~new).sum())
+        if new.any():
+            store.append(keys[new], reid=reid[new], clip=clip[new])
+
+    max_workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        pending = collections.deque()
+        jobs = iter(jobs)
+        while True:
+            while len(pending) < 2 * max_workers:
+                job = next(jobs, None)
+                if job is None:
+                    break
+                path, start, end = job
+                pending.append(pool.submit(_parse_chunk, path, start, end, config.reid_dim, config.clip_dim))
+            if not pending:
+                break
+
+            keys, reid, clip, n_lines, n_malformed, n_wrong_dim = pending.popleft().result()
+            total_lines += n_lines
+            total_malformed += n_malformed
+            total_wrong_dim += n_wrong_dim
+            batch.append((keys, reid, clip))
+            if sum(len(part[0]) for part in batch) * row_bytes >= append_mb << 20:
+                flush()
+        flush()
+
+    elapsed = time.perf_counter() - start_time
+    size_mb = sum(os.path.getsize(path) for path in paths) / (1 << 20)
+    print(f"Imported {len(store) - n_before} tracks from {total_lines} lines in {len(paths)} files "
+          f"({size_mb:.1f} MB in {elapsed:.2f}s, {size_mb / max(elapsed, 1e-9):.1f} MB/s) -> {store_dir}")
+    if total_malformed:
+        print(f"  Skipped {total_malformed} malformed lines")
+    if total_wrong_dim:
+        print(f"  Skipped {total_wrong_dim} lines with wrong vector dimensions "
+              f"(expected reid {config.reid_dim}, clip {config.clip_dim})")
+    if total_duplicates:
+        print(f"  Skipped {total_duplicates} duplicate keys")
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import legacy text feature files into an embedding store")
+    parser.add_argument('inputs', nargs='+', help="text feature files or directories searched for *.txt")
+    parser.add_argument('--store', default='data/embedding_store')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--chunk-mb', type=int, default=64)
+    parser.add_argument('--append-mb', type=int, default=512, help="vectors buffered per store append")
+    parser.add_argument('--dtype', choices=['float32', 'float16', 'int8'], default='float32')
+    args = parser.parse_args()
+
+    paths = []
+    for item in args.inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(glob.glob(os.path.join(item, '**', '*.txt'), recursive=True)))
+        else:
+            paths.append(item)
+    convert_feature_text(paths, args.store, args.workers, args.chunk_mb, args.dtype, args.append_mb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import glob
+import os
+import pickle
+
+import numpy as np
+
+
+def fuse_embeddings(reid_embs, clip_embs, w_reid=0.7, normalize=False):
+    """
+    Concatenate sqrt(w)·reid ⊕ sqrt(1-w)·clip, so that a single inner product
+    gives the fused score w·<reid> + (1-w)·<clip>.
+
+    Inputs are (N, D1) / (N, D2) or single vectors and should be L2-normalized
+    (`normalize` does it first); the fused vectors then have unit norm, so
+    cosine and dot product agree.
+    """
+    if normalize:
+        reid_embs, clip_embs = _normalize(reid_embs), _normalize(clip_embs)
+    return np.concatenate([
+        np.sqrt(w_reid) * np.asarray(reid_embs, dtype=np.float32),
+        np.sqrt(1.0 - w_reid) * np.asarray(clip_embs, dtype=np.float32),
+    ], axis=-1).astype(np.float32)
+
+
+def fused_similarity_matrix(fused):
+    """All-pairs fused similarity with one matrix product."""
+    return fused @ fused.T
+
+
+def _normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+def build_fused_store(feature_dir='data/new_feature_objects', output_path='data/fused_features.npz', w_reid=0.7):
+    """
+    Materialize one fused vector per track from the feature pickles
+    (`{(seq_id, cam_id, obj_id): {'reid': ..., 'clip': ...}}`).
+
+    Saves `keys` (N, 3), `fused` (N, D1 + D2) and `w_reid` to `output_path`.
+    """
+    keys, reid, clip = [], [], []
+    for path in sorted(glob.glob(os.path.join(feature_dir, 'seq_*', '*.pkl'))):
+        with open(path, 'rb') as f:
+            features = pickle.load(f)
+        for key, feat in features.items():
+            keys.append(tuple(int(k) for k in key))
+            reid.append(feat['reid'])
+            clip.append(feat['clip'])
+
+    if not keys:
+        raise FileNotFoundError(f"No feature pickles found in {feature_dir}")
+
+    fused = fuse_embeddings(np.stack(reid), np.stack(clip), w_reid, normalize=True)
+    np.savez(output_path, keys=np.asarray(keys, dtype=np.int64), fused=fused, w_reid=w_reid)
+    print(f"Saved {len(keys)} fused vectors ({fused.shape[1]}-d, w_reid={w_reid}) to {output_path}")
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the fused ReID/CLIP vector store")
+    parser.add_argument('--feature-dir', default='data/new_feature_objects')
+    parser.add_argument('--output', default='data/fused_features.npz')
+    parser.add_argument('--w-reid', type=float, default=0.7)
+    args = parser.parse_args()
+    build_fused_store(args.feature_dir, args.output, args.w_reid)
@@ -0,0 +1,174 @@
+import glob
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from crop_catalog import CropCatalog
+
+# copy:      independent copies (the original behaviour)
+# hardlink:  a new name for the same crop file, no extra disk; copies when linking fails
+#            (other filesystem) or the camera is packed
+# symlink:   links to the crop files; copies for packed cameras
+# manifest:  no files, only `output_dir/manifest.json` listing every gallery image, with
+#            crop paths relative to the manifest's folder (resolved by load_manifest)
+GALLERY_MODES = ('copy', 'hardlink', 'symlink', 'manifest')
+MANIFEST_FILE = 'manifest.json'
+
+
+def gallery_name(seq_id, cam_id, obj_id, img_file):
+    """Gallery file name of a `{obj_id}_{frame_id}.webp` crop."""
+    frame_id = img_file.split('_')[1].replace('.webp', '')
+    return f"seq_{seq_id:03d}_cam_{cam_id}_obj_{obj_id:05d}_frame_{frame_id}.webp"
+
+
+def place_crop(crops, img_file, dst_path, mode='copy'):
+    """Put one crop of a CameraCrops at `dst_path` as a copy, hardlink or symlink."""
+    if os.path.lexists(dst_path):
+        os.remove(dst_path)
+    if crops.packed or mode == 'copy':
+        crops.copy(img_file, dst_path)
+    elif mode == 'hardlink':
+        try:
+            os.link(crops.path(img_file), dst_path)
+        except OSError:
+            crops.copy(img_file, dst_path)
+    elif mode == 'symlink':
+        os.symlink(os.path.abspath(crops.path(img_file)), dst_path)
+    else:
+        raise ValueError(f"Unknown gallery mode: {mode}")
+
+
+def build_galleries(global_clusters, crops_base_dir='data/crops', output_dir='data/global_ids', global_ids=None,
+                    mode='copy', workers=8):
+    """
+    Write one `global_id_XXX` gallery per cluster of track keys (seq_id, cam_id, obj_id).
+
+    Each gallery that is written is rebuilt from scratch; empty clusters and, with
+    all `global_ids`, clusters past the last one lose their gallery, so
+    re-materializing after a threshold change leaves no stale images. File work
+    runs on `workers` threads.
+
+    Returns:
+        Number of gallery images
+    """
+    if mode not in GALLERY_MODES:
+        raise ValueError(f"Unknown gallery mode: {mode}")
+    os.makedirs(output_dir, exist_ok=True)
+    catalog = CropCatalog(crops_base_dir)
+
+    galleries, removed = {}, []
+    for global_id, track_keys in enumerate(global_clusters):
+        if global_ids is not None and global_id not in global_ids:
+            continue
+        if not track_keys:
+            # Retired IDs (see mmc/identity_index.py) have no gallery
+            removed.append(global_id)
+            continue
+        images = []
+        for seq_id, cam_id, obj_id in track_keys:
+            crops = catalog.camera(seq_id, cam_id)
+            if not crops.exists:
+                print(f"  Warning: Directory not found: {crops.crops_dir}")
+                continue
+            images.extend(
+                (crops, img_file, gallery_name(seq_id, cam_id, obj_id, img_file))
+                for _, img_file in crops.crops(obj_id)
+            )
+        galleries[global_id] = images
+        print(f"  Global ID {global_id:03d}: {len(track_keys)} tracks, {len(images)} images")
+
+    if global_ids is not None:
+        # Requested IDs past the last cluster no longer exist
+        removed.extend(global_id for global_id in global_ids if global_id >= len(global_clusters))
+
+    folders = {global_id: os.path.join(output_dir, f"global_id_{global_id:03d}") for global_id in galleries}
+    for global_id in removed:
+        shutil.rmtree(os.path.join(output_dir, f"global_id_{global_id:03d}"), ignore_errors=True)
+    if global_ids is None:
+        # Galleries of clusters that no longer exist
+        for folder in glob.glob(os.path.join(output_dir, 'global_id_*')):
+            suffix = os.path.basename(folder)[len('global_id_'):]
+            if suffix.isdigit() and int(suffix) >= len(global_clusters):
+                shutil.rmtree(folder, ignore_errors=True)
+
+    if mode == 'manifest':
+        manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+        manifest = {'global_ids': {}}
+        if global_ids is not None and os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if not manifest.get('relative_paths'):
+                # Older manifests hold paths relative to the working directory
+                for entries in manifest['global_ids'].values():
+                    for entry in entries:
+                        entry['path'] = os.path.relpath(entry['path'], output_dir)
+        manifest['relative_paths'] = True
+        manifest['crops_base_dir'] = os.path.relpath(crops_base_dir, output_dir)
+        for folder in folders.values():
+            # Folders of an earlier file-based run would disagree with the manifest
+            shutil.rmtree(folder, ignore_errors=True)
+        for global_id, images in galleries.items():
+            manifest['global_ids'][f"{global_id:03d}"] = [
+                dict(source, path=os.path.relpath(source['path'], output_dir), name=name)
+                for source, name in ((crops.source(img_file), name) for crops, img_file, name in images)
+            ]
+        manifest['global_ids'] = {
+            key: value for key, value in manifest['global_ids'].items()
+            if int(key) < len(global_clusters) and int(key) not in removed
+        }
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        return sum(len(images) for images in galleries.values())
+
+    def reset(folder):
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+
+    tasks = [
+        (crops, img_file, os.path.join(folders[global_id], name))
+        for global_id, images in galleries.items()
+        for crops, img_file, name in images
+    ]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(reset, folders.values()))
+        list(pool.map(lambda task: place_crop(*task, mode=mode), tasks))
+    return len(tasks)
+
+
+def changed_global_ids(previous_clusters, global_clusters):
+    """IDs whose set of track keys differs between two results, including IDs only in one of them."""
+    changed = set()
+    for global_id in range(max(len(previous_clusters), len(global_clusters))):
+        before = previous_clusters[global_id] if global_id < len(previous_clusters) else []
+        after = global_clusters[global_id] if global_id < len(global_clusters) else []
+        if set(map(tuple, before)) != set(map(tuple, after)):
+            changed.add(global_id)
+    return changed
+
+
+def load_manifest(output_dir='data/global_ids'):
+    """
+    {global_id: [{'name', 'path'[, 'offset', 'size']}]} of galleries written in
+    'manifest' mode, with every path resolved against `output_dir`.
+    """
+    with open(os.path.join(output_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    base_dir = output_dir if manifest.get('relative_paths') else ''
+    return {
+        int(key): [dict(entry, path=os.path.join(base_dir, entry['path'])) for entry in entries]
+        for key, entries in manifest['global_ids'].items()
+    }
+
+
+def read_gallery_image(entry, manifest_dir=''):
+    """
+    Encoded bytes of one manifest entry: as given by load_manifest, or raw from
+    the manifest file with `manifest_dir` its folder.
+    """
+    with open(os.path.join(manifest_dir, entry['path']), 'rb') as f:
+        if 'offset' not in entry:
+            return f.read()
+        f.seek(entry['offset'])
+        return f.read(entry['size'])
@@ -0,0 +1,187 @@
+import numpy as np
+
+from linkage import SeqCamConstraint, agglomerate_sparse
+
+
+class IdentityIndex:
+    """
+    Persistent state of the global matching: every node matched so far with its
+    embeddings, (seq_id, cam_id) and global ID, so that new sequences are matched
+    against the existing identities instead of reclustering everything.
+
+    Global IDs are never renumbered. When new nodes link two existing identities
+    they are merged into the lower ID and the other one is retired (see
+    `merged_into`); its position in `results()` is left empty.
+    """
+
+    def __init__(self, tau_same_seq=0.9, tau_diff_seq=0.9, w_reid=0.7):
+        self.tau_same_seq = float(tau_same_seq)
+        self.tau_diff_seq = float(tau_diff_seq)
+        self.w_reid = float(w_reid)
+
+        # Per node
+        self.reid = None
+        self.clip = None
+        self.identity = np.zeros(0, dtype=np.int64)
+        self.seq_cams = np.zeros((0, 2), dtype=np.int64)
+        self.track_keys = np.zeros((0, 3), dtype=np.int64)
+        self.track_offsets = np.zeros(1, dtype=np.int64)
+
+        self.next_id = 0
+        self.merged_into = {}
+        self.sequences = set()
+
+    @property
+    def n_nodes(self):
+        return len(self.identity)
+
+    @property
+    def n_identities(self):
+        return len(np.unique(self.identity))
+
+    def resolve(self, global_id):
+        """Current global ID of a possibly retired one."""
+        while global_id in self.merged_into:
+            global_id = self.merged_into[global_id]
+        return global_id
+
+    def identity_seq_cams(self, identities):
+        """(seq_id, cam_id) sets of the given identities."""
+        position = {gid: i for i, gid in enumerate(identities)}
+        groups = [set() for _ in identities]
+        for gid, (seq_id, cam_id) in zip(self.identity.tolist(), self.seq_cams.tolist()):
+            if gid in position:
+                groups[position[gid]].add((seq_id, cam_id))
+        return groups
+
+    def _edges(self, reid, clip, active):
+        """Candidate edges above the lower threshold: new-new and new-identity."""
+        w_clip = 1.0 - self.w_reid
+        n_old = len(active)
+
+        sim = self.w_reid * (reid @ reid.T) + w_clip * (clip @ clip.T)
+        floor = np.asarray(min(self.tau_same_seq, self.tau_diff_seq), dtype=sim.dtype)
+        i, j = np.nonzero(np.triu(sim > floor, k=1))
+        rows, cols, sims = [i + n_old], [j + n_old], [sim[i, j]]
+
+        if n_old:
+            # Node-level similarities to every indexed node; the sparse engine keeps the
+            # max per identity, i.e. the max linkage between a node and an identity
+            sim = self.w_reid * (reid @ self.reid.T) + w_clip * (clip @ self.clip.T)
+            i, j = np.nonzero(sim > floor)
+            rows.append(np.searchsorted(active, self.identity[j]))
+            cols.append(i + n_old)
+            sims.append(sim[i, j])
+
+        return np.concatenate(rows), np.concatenate(cols), np.concatenate(sims)
+
+    def ingest(self, nodes):
+        """
+        Match new nodes (see matching_seq.Node) against the index and add them.
+
+        The nodes and the existing identities are clustered together with the
+        global engine (same thresholds and (seq, cam) veto), existing identities
+        being pre-merged groups that are never compared with each other directly.
+
+        Returns:
+            Array with the global ID assigned to each node
+        """
+        if len(nodes) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        reid = np.stack([node.reid_average for node in nodes]).astype(np.float32)
+        clip = np.stack([node.clip_average for node in nodes]).astype(np.float32)
+        if self.reid is None:
+            self.reid = np.zeros((0, reid.shape[1]), dtype=np.float32)
+            self.clip = np.zeros((0, clip.shape[1]), dtype=np.float32)
+
+        active = np.unique(self.identity)
+        n_old = len(active)
+        rows, cols, sims = self._edges(reid, clip, active)
+
+        seq_cams = self.identity_seq_cams(active.tolist()) + [{(node.seq_id, node.cam_id)} for node in nodes]
+        constraint = SeqCamConstraint(seq_cams, self.tau_same_seq, self.tau_diff_seq)
+        clusters = agglomerate_sparse(n_old + len(nodes), rows, cols, sims, constraint)
+
+        node_ids = np.empty(len(nodes), dtype=np.int64)
+        n_created, n_extended, merged = 0, 0, []
+        for cluster in clusters:
+            old = sorted(int(active[i]) for i in cluster if i < n_old)
+            new = [i - n_old for i in cluster if i >= n_old]
+            if not new:
+                continue
+            if old:
+                global_id = old[0]
+                for retired in old[1:]:
+                    self.merged_into[retired] = global_id
+                    self.identity[self.identity == retired] = global_id
+                    merged.append((retired, global_id))
+                n_extended += 1
+            else:
+                global_id = self.next_id
+                self.next_id += 1
+                n_created += 1
+            node_ids[new] = global_id
+
+        self.reid = np.concatenate([self.reid, reid])
+        self.clip = np.concatenate([self.clip, clip])
+        self.identity = np.concatenate([self.identity, node_ids])
+        self.seq_cams = np.concatenate([self.seq_cams, [(node.seq_id, node.cam_id) for node in nodes]])
+        self.track_keys = np.concatenate([
+            self.track_keys,
+            np.asarray([key for node in nodes for key in node.track_keys], dtype=np.int64).reshape(-1, 3),
+        ])
+        self.track_offsets = np.concatenate([
+            self.track_offsets,
+            self.track_offsets[-1] + np.cumsum([len(node.track_keys) for node in nodes]),
+        ])
+        self.sequences |= {node.seq_id for node in nodes}
+
+        print(f"Ingested {len(nodes)} nodes: {n_created} new identities, {n_extended} existing identities extended, "
+              f"{len(merged)} identities merged")
+        for retired, global_id in merged:
+            print(f"  Global ID {retired} merged into {global_id}")
+        return node_ids
+
+    def results(self):
+        """
+        Track keys per global ID, in the `save_global_results` format with
+        position == global ID; retired IDs are empty lists.
+        """
+        keys = [tuple(key) for key in self.track_keys.tolist()]
+        offsets = self.track_offsets.tolist()
+        results = [[] for _ in range(self.next_id)]
+        for node, global_id in enumerate(self.identity.tolist()):
+            results[global_id].extend(keys[offsets[node]:offsets[node + 1]])
+        return results
+
+    def save(self, path):
+        np.savez(
+            path,
+            reid=self.reid if self.reid is not None else np.zeros((0, 0), dtype=np.float32),
+            clip=self.clip if self.clip is not None else np.zeros((0, 0), dtype=np.float32),
+            identity=self.identity,
+            seq_cams=self.seq_cams,
+            track_keys=self.track_keys,
+            track_offsets=self.track_offsets,
+            next_id=self.next_id,
+            merged_into=np.array(sorted(self.merged_into.items()), dtype=np.int64).reshape(-1, 2),
+            sequences=np.array(sorted(self.sequences), dtype=np.int64),
+            thresholds=np.array([self.tau_same_seq, self.tau_diff_seq, self.w_reid]),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(*data['thresholds'].tolist())
+            if data['identity'].size:
+                index.reid = data['reid']
+                index.clip = data['clip']
+            index.identity = data['identity']
+            index.seq_cams = data['seq_cams']
+            index.track_keys = data['track_keys']
+            index.track_offsets = data['track_offsets']
+            index.next_id = int(data['next_id'])
+            index.merged_into = {int(a): int(b) for a, b in data['merged_into'].tolist()}
+            index.sequences = set(data['sequences'].tolist())
+        return index
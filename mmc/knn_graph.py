@@ -0,0 +1,103 @@
+import numpy as np
+
+from fusion import fuse_embeddings
+from quantization import topk_quantized
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+
+def _topk_numpy(reid_embs, clip_embs, w_reid, k, block_size, fused=False):
+    n = len(reid_embs)
+    w_clip = 1.0 - w_reid
+    vectors = fuse_embeddings(reid_embs, clip_embs, w_reid) if fused else None
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        if fused:
+            sims = vectors[start:stop] @ vectors.T
+        else:
+            sims = w_reid * (reid_embs[start:stop] @ reid_embs.T) + w_clip * (clip_embs[start:stop] @ clip_embs.T)
+        sims[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+
+        if k < n - 1:
+            cols = np.argpartition(-sims, k, axis=1)[:, :k]
+        else:
+            cols = np.broadcast_to(np.arange(n), sims.shape)
+        yield start, cols, np.take_along_axis(sims, cols, axis=1)
+
+
+def _topk_faiss(reid_embs, clip_embs, w_reid, k, block_size, fused=True):
+    vectors = fuse_embeddings(reid_embs, clip_embs, w_reid)
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    for start in range(0, len(vectors), block_size):
+        sims, cols = index.search(vectors[start:start + block_size], k + 1)
+        yield start, cols, sims
+
+
+def knn_graph(reid_embs, clip_embs, w_reid=0.7, k=30, min_sim=None, block_size=1024, backend='auto', fused=False,
+              precision='float32', rescore_k=None):
+    """
+    Top-k neighbor graph over the fused ReID/CLIP similarity.
+
+    Rows are processed `block_size` at a time, so peak memory is
+    O(block_size * N + N * k) instead of O(N^2).
+
+    Args:
+        reid_embs, clip_embs: L2-normalized (N, D1) / (N, D2) embeddings
+        w_reid: weight of the ReID similarity
+        k: neighbors kept per item (the graph is then symmetrized)
+        min_sim: drop edges with similarity <= min_sim (e.g. the lowest threshold)
+        block_size: rows per matrix-multiplication block
+        backend: 'numpy', 'faiss' or 'auto' (faiss when installed)
+        fused: score with one product of the fused vectors (see mmc/fusion.py);
+            faiss always does
+        precision: 'float16' or 'int8' searches a low-precision copy (see
+            mmc/quantization.py) and rescores the `rescore_k` (default 2k) best
+            candidates per item exactly; numpy backend only
+
+    Returns:
+        (rows, cols, sims) with rows < cols, one entry per undirected edge
+    """
+    if backend == 'auto':
+        backend = 'faiss' if faiss is not None and precision == 'float32' else 'numpy'
+    if backend == 'faiss' and precision != 'float32':
+        raise ValueError("Low-precision search is only supported by the numpy backend")
+    if backend == 'faiss' and faiss is None:
+        raise ImportError("faiss is not installed")
+    if backend not in ('numpy', 'faiss'):
+        raise ValueError(f"Unknown kNN backend: {backend}")
+
+    n = len(reid_embs)
+    k = max(0, min(k, n - 1))
+    if k == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    if precision != 'float32':
+        results = topk_quantized(reid_embs, clip_embs, w_reid, k, block_size, fused, precision, rescore_k)
+    else:
+        search = _topk_faiss if backend == 'faiss' else _topk_numpy
+        results = search(reid_embs, clip_embs, w_reid, k, block_size, fused)
+    all_rows, all_cols, all_sims = [], [], []
+    for start, cols, sims in results:
+        rows = np.broadcast_to(np.arange(start, start + len(cols))[:, None], cols.shape)
+        keep = (cols >= 0) & (cols != rows) & np.isfinite(sims)
+        if min_sim is not None:
+            keep &= sims > min_sim
+        all_rows.append(rows[keep])
+        all_cols.append(cols[keep])
+        all_sims.append(sims[keep])
+
+    rows = np.concatenate(all_rows).astype(np.int64)
+    cols = np.concatenate(all_cols).astype(np.int64)
+    sims = np.concatenate(all_sims).astype(np.float32)
+
+    # Symmetrize: one entry per undirected edge, keeping the larger similarity
+    lo, hi = np.minimum(rows, cols), np.maximum(rows, cols)
+    order = np.lexsort((-sims, hi, lo))
+    lo, hi, sims = lo[order], hi[order], sims[order]
+    first = np.ones(len(lo), dtype=bool)
+    first[1:] = (lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1])
+    return lo[first], hi[first], sims[first]
@@ -0,0 +1,255 @@
+import heapq
+
+import numpy as np
+
+
+class TimeConstraint:
+    """
+    In-camera constraint: two clusters may merge only if every pair of their
+    tracklets is time compatible (intervals do not overlap).
+    """
+
+    def __init__(self, intervals, tau=0.75):
+        intervals = np.asarray(intervals, dtype=np.int64).reshape(-1, 2)
+        starts, ends = intervals[:, 0], intervals[:, 1]
+
+        # compatible[i, j] <=> (t_j_start > t_i_end) or (t_i_start > t_j_end)
+        self.compatible = (starts[None, :] > ends[:, None]) | (starts[:, None] > ends[None, :])
+        self.tau = tau
+
+    def allowed(self, a, others):
+        """Return (mask, thresholds) of cluster `a` against the clusters in `others`."""
+        return self.compatible[a, others], self.tau
+
+    def merge(self, a, b):
+        row = self.compatible[a] & self.compatible[b]
+        self.compatible[a, :] = row
+        self.compatible[:, a] = row
+
+
+class IntervalConstraint:
+    """
+    Same rule as `TimeConstraint` without the (N, N) mask: compatibility is checked
+    from the members' intervals, for the sparse engine on large populations.
+    """
+
+    def __init__(self, intervals, tau=0.75):
+        intervals = np.asarray(intervals, dtype=np.int64).reshape(-1, 2)
+        self.starts = [intervals[i:i + 1, 0] for i in range(len(intervals))]
+        self.ends = [intervals[i:i + 1, 1] for i in range(len(intervals))]
+        self.tau = tau
+
+    def _compatible(self, a, b):
+        s_a, e_a, s_b, e_b = self.starts[a], self.ends[a], self.starts[b], self.ends[b]
+        return bool(((s_b[None, :] > e_a[:, None]) | (s_a[:, None] > e_b[None, :])).all())
+
+    def allowed(self, a, others):
+        return np.array([self._compatible(a, b) for b in others], dtype=bool), self.tau
+
+    def merge(self, a, b):
+        self.starts[a] = np.concatenate([self.starts[a], self.starts[b]])
+        self.ends[a] = np.concatenate([self.ends[a], self.ends[b]])
+
+
+def _bitmasks(groups, n_bits):
+    """Pack lists of bit indices into an (N, W) uint64 bitmask array."""
+    n_words = max(1, (n_bits + 63) // 64)
+    masks = np.zeros((len(groups), n_words), dtype=np.uint64)
+    for row, bits in enumerate(groups):
+        for bit in bits:
+            masks[row, bit // 64] |= np.uint64(1) << np.uint64(bit % 64)
+    return masks
+
+
+class SeqCamConstraint:
+    """
+    Global constraint: clusters sharing a (seq_id, cam_id) pair are never merged,
+    and the threshold is `tau_same_seq` if they share a sequence, else `tau_diff_seq`.
+
+    `seq_cams` holds, for every item, the (seq_id, cam_id) pairs it covers
+    (a single pair for a node, several for a pre-merged group).
+    """
+
+    def __init__(self, seq_cams, tau_same_seq=0.9, tau_diff_seq=0.9):
+        seq_cams = [set(sc) for sc in seq_cams]
+        pair_bits = {p: i for i, p in enumerate(sorted(set().union(*seq_cams)))}
+        seq_bits = {s: i for i, s in enumerate(sorted({s for s, _ in pair_bits}))}
+
+        self.seq_cam_masks = _bitmasks([[pair_bits[p] for p in sc] for sc in seq_cams], len(pair_bits))
+        self.seq_masks = _bitmasks([[seq_bits[s] for s, _ in sc] for sc in seq_cams], len(seq_bits))
+        self.tau_same_seq = tau_same_seq
+        self.tau_diff_seq = tau_diff_seq
+
+    @classmethod
+    def from_nodes(cls, nodes, tau_same_seq=0.9, tau_diff_seq=0.9):
+        return cls([[(node.seq_id, node.cam_id)] for node in nodes], tau_same_seq, tau_diff_seq)
+
+    def allowed(self, a, others):
+        overlap = (self.seq_cam_masks[others] & self.seq_cam_masks[a]).any(axis=1)
+        same_seq = (self.seq_masks[others] & self.seq_masks[a]).any(axis=1)
+        return ~overlap, np.where(same_seq, self.tau_same_seq, self.tau_diff_seq)
+
+    def merge(self, a, b):
+        self.seq_cam_masks[a] |= self.seq_cam_masks[b]
+        self.seq_masks[a] |= self.seq_masks[b]
+
+
+def agglomerate(sim, constraint, history=None):
+    """
+    Constrained max-linkage agglomerative clustering driven by a priority queue.
+
+    Produces exactly the merges of the legacy "rescan every pair" loops: at each
+    step the eligible pair with the highest similarity is merged, ties broken by
+    the lowest (first, second) cluster position, and the merged cluster keeps the
+    position of the first one.
+
+    Args:
+        sim: (N, N) similarity matrix between items. Entries may be -inf for
+            pairs that must never be compared directly.
+        constraint: object exposing `allowed(a, others)` -> (mask, thresholds)
+            and `merge(a, b)`; see `TimeConstraint` and `SeqCamConstraint`.
+        history: optional list; every merge is appended as (a, b, sim).
+
+    Returns:
+        List of clusters (sets of item indices) in legacy order.
+    """
+    n = len(sim)
+    sim = np.array(sim, copy=True)
+    alive = np.ones(n, dtype=bool)
+    version = np.zeros(n, dtype=np.int64)
+    clusters = [{i} for i in range(n)]
+
+    heap = []
+    for a in range(n - 1):
+        others = np.arange(a + 1, n)
+        mask, threshold = constraint.allowed(a, others)
+        sims = sim[a, others]
+        keep = mask & (sims > np.asarray(threshold, dtype=sim.dtype))
+        heap.extend((-float(s), a, int(b), 0, 0) for b, s in zip(others[keep], sims[keep]))
+    heapq.heapify(heap)
+
+    while heap:
+        neg_sim, a, b, version_a, version_b = heapq.heappop(heap)
+        if not (alive[a] and alive[b]) or version[a] != version_a or version[b] != version_b:
+            continue
+
+        # Merge b into a (a < b keeps its position, like `clusters[i] |= clusters[j]`)
+        clusters[a] |= clusters[b]
+        alive[b] = False
+        version[a] += 1
+        if history is not None:
+            history.append((a, b, -neg_sim))
+
+        # Lance-Williams update for max linkage
+        row = np.maximum(sim[a], sim[b])
+        sim[a, :] = row
+        sim[:, a] = row
+        constraint.merge(a, b)
+
+        others = np.flatnonzero(alive)
+        others = others[others != a]
+        mask, threshold = constraint.allowed(a, others)
+        sims = sim[a, others]
+        keep = mask & (sims > np.asarray(threshold, dtype=sim.dtype))
+        for k, s in zip(others[keep], sims[keep]):
+            k = int(k)
+            i, j = (a, k) if a < k else (k, a)
+            heapq.heappush(heap, (-float(s), i, j, int(version[i]), int(version[j])))
+
+    return [clusters[i] for i in np.flatnonzero(alive)]
+
+
+def agglomerate_sparse(n, rows, cols, sims, constraint, history=None):
+    """
+    `agglomerate` over a sparse similarity graph of N items.
+
+    Only the given edges (rows[e], cols[e], sims[e]) are known; missing pairs count
+    as -inf. Cluster similarities are kept as per-cluster neighbor dicts, so memory
+    is O(N + E). With every edge above the lowest threshold present, the merges
+    are identical to the dense engine.
+    """
+    sims = np.asarray(sims)
+    neighbors = [{} for _ in range(n)]
+    for i, j, s in zip(np.asarray(rows).tolist(), np.asarray(cols).tolist(), np.asarray(sims).tolist()):
+        if i == j:
+            continue
+        if s > neighbors[i].get(j, -np.inf):
+            neighbors[i][j] = s
+            neighbors[j][i] = s
+
+    alive = np.ones(n, dtype=bool)
+    version = np.zeros(n, dtype=np.int64)
+    clusters = [{i} for i in range(n)]
+
+    def candidates(a, keys):
+        keys = np.fromiter(keys, dtype=np.int64, count=len(keys))
+        if len(keys) == 0:
+            return keys, np.zeros(0)
+        sims_a = np.array([neighbors[a][k] for k in keys.tolist()], dtype=sims.dtype)
+        mask, threshold = constraint.allowed(a, keys)
+        keep = mask & (sims_a > np.asarray(threshold, dtype=sims.dtype))
+        return keys[keep], sims_a[keep]
+
+    heap = []
+    for a in range(n):
+        later = [b for b in neighbors[a] if b > a]
+        for b, s in zip(*candidates(a, later)):
+            heap.append((-float(s), a, int(b), 0, 0))
+    heapq.heapify(heap)
+
+    while heap:
+        neg_sim, a, b, version_a, version_b = heapq.heappop(heap)
+        if not (alive[a] and alive[b]) or version[a] != version_a or version[b] != version_b:
+            continue
+
+        clusters[a] |= clusters[b]
+        alive[b] = False
+        version[a] += 1
+        if history is not None:
+            history.append((a, b, -neg_sim))
+
+        # Max-linkage update on the neighbor dicts
+        neighbors[a].pop(b, None)
+        for k, s in neighbors[b].items():
+            if k == a:
+                continue
+            del neighbors[k][b]
+            if s > neighbors[a].get(k, -np.inf):
+                neighbors[a][k] = s
+                neighbors[k][a] = s
+        neighbors[b] = {}
+        constraint.merge(a, b)
+
+        for k, s in zip(*candidates(a, list(neighbors[a]))):
+            k = int(k)
+            i, j = (a, k) if a < k else (k, a)
+            heapq.heappush(heap, (-float(s), i, j, int(version[i]), int(version[j])))
+
+    return [clusters[i] for i in np.flatnonzero(alive)]
+
+
+def connected_components(n, rows, cols):
+    """
+    Union-find over graph edges: single linkage without constraints, for the
+    case where no time/(seq, cam) constraint applies. Clusters are ordered by
+    their smallest item like the other engines.
+    """
+    parent = np.arange(n)
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for i, j in zip(np.asarray(rows).tolist(), np.asarray(cols).tolist()):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    clusters = {}
+    for i in range(n):
+        clusters.setdefault(find(i), set()).add(i)
+    return [clusters[root] for root in sorted(clusters)]
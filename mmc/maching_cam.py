@@ -1,7 +1,15 @@
 import numpy as np
 from itertools import combinations
 import pickle
-from data_loader import load_all_data
+from data_loader import load_all_data, load_metadata_store, load_features_store
+from exclusions import load_exclusions
+from crop_catalog import CameraCrops
+from detection_store import DetectionStore
+from linkage import TimeConstraint, IntervalConstraint, agglomerate, agglomerate_sparse, connected_components
+from knn_graph import knn_graph
+from fusion import fuse_embeddings, fused_similarity_matrix
+from merge_tree import MergeTree
+from quantization import PRECISIONS, similarity_candidates
 import json
 import os
 import glob
@@ -11,6 +19,9 @@ def compute_tracklet_intervals(all_metadatas):
     Returns:
         intervals_dict[(cam_id, object_id)] = (t_start, t_end)
     """
+    if isinstance(all_metadatas, DetectionStore):
+        return dict(zip(all_metadatas, map(tuple, all_metadatas.intervals().tolist())))
+
     intervals = {}
 
     for key, records in all_metadatas.items():
@@ -146,11 +157,91 @@ def agglomerative_with_time_constraint_weighted(
     return clusters
 
 
+def weighted_similarity_matrix(reid_embs, clip_embs, w_reid=0.7, fused=False):
+    """
+    All-pairs version of `weighted_similarity`. With `fused`, computed as one
+    product of the pre-fused vectors (see mmc/fusion.py), equal up to float32 rounding.
+    """
+    if fused:
+        return fused_similarity_matrix(fuse_embeddings(reid_embs, clip_embs, w_reid))
+    w_clip = 1.0 - w_reid
+    return w_reid * (reid_embs @ reid_embs.T) + w_clip * (clip_embs @ clip_embs.T)
+
+
+def agglomerative_with_time_constraint_heap(
+        reid_embs,
+        clip_embs,
+        intervals,
+        tau=0.75,
+        w_reid=0.7,
+        history=None,
+        fused=False,
+        precision='float32'
+):
+    """
+    Same clusters as `agglomerative_with_time_constraint_weighted`, but the similarity
+    matrix and the time-compatibility mask are computed once with NumPy and the
+    candidate merges are kept in a priority queue. Results can only differ on exact
+    ties that float32 rounding of the matrix product resolves differently.
+    With a lower `precision`, the pairs above `tau` are found on float16 / int8 codes,
+    rescored exactly and clustered sparsely, with the same merges (mmc/quantization.py).
+    """
+    if precision != 'float32':
+        rows, cols, sims = similarity_candidates(reid_embs, clip_embs, w_reid, precision, min_sim=tau, fused=fused)
+        constraint = IntervalConstraint(intervals, tau=tau)
+        return agglomerate_sparse(len(reid_embs), rows, cols, sims, constraint, history=history)
+
+    sim = weighted_similarity_matrix(reid_embs, clip_embs, w_reid, fused=fused)
+    constraint = TimeConstraint(intervals, tau=tau)
+    return agglomerate(sim, constraint, history=history)
+
+
+def agglomerative_with_time_constraint_knn(
+        reid_embs,
+        clip_embs,
+        intervals,
+        tau=0.75,
+        w_reid=0.7,
+        k=30,
+        time_constraint=True,
+        history=None,
+        fused=False,
+        precision='float32'
+):
+    """
+    Sparse variant for large tracklet populations: clusters only the edges of a
+    top-k neighbor graph with similarity above `tau`, in O(N·k) memory. Matches
+    the heap engine whenever every pair above `tau` is among the k neighbors.
+    Without `time_constraint`, clusters are the graph's connected components.
+    With a lower `precision`, neighbors are searched in float16 / int8 and rescored exactly.
+    """
+    rows, cols, sims = knn_graph(reid_embs, clip_embs, w_reid, k=k, min_sim=tau, fused=fused, precision=precision)
+    if not time_constraint:
+        return connected_components(len(reid_embs), rows, cols)
+
+    constraint = IntervalConstraint(intervals, tau=tau)
+    return agglomerate_sparse(len(reid_embs), rows, cols, sims, constraint, history=history)
+
+
+CLUSTERING_ENGINES = {
+    'legacy': agglomerative_with_time_constraint_weighted,
+    'heap': agglomerative_with_time_constraint_heap,
+    'knn': agglomerative_with_time_constraint_knn,
+}
+
+
 def match_tracklets_weighted(
         all_metadatas,
         all_features,
         tau=0.75,
-        w_reid=0.7
+        w_reid=0.7,
+        engine='heap',
+        knn_k=30,
+        tree_path=None,
+        tree_floor=0.5,
+        fused=False,
+        precision='float32',
+        time_constraint=True
 ):
     """
     Main function to perform tracklet matching with time constraints.
@@ -160,22 +251,73 @@ def match_tracklets_weighted(
         all_features: dict mapping (cam_id, object_id) to feature dict
         tau: similarity threshold for merging clusters
         w_reid: weight for ReID embeddings (0-1)
+        engine: clustering engine, one of CLUSTERING_ENGINES ('legacy', 'heap' or 'knn')
+        knn_k: neighbors per tracklet for the 'knn' engine
+        tree_path: if set, cluster down to `tree_floor`, save the merge tree there
+            (see mmc/merge_tree.py) and cut it at `tau`
+        fused: score pairs with the pre-fused ReID/CLIP vectors ('heap' and 'knn')
+        precision: 'float32', 'float16' or 'int8' similarity scan ('heap' and 'knn',
+            see mmc/quantization.py)
+        time_constraint: False drops the time-overlap rule and clusters the kNN
+            graph's connected components ('knn' only)
 
     Returns:
         List of clusters, each cluster is a set of indices
     """
+    if engine not in CLUSTERING_ENGINES:
+        raise ValueError(f"Unknown clustering engine: {engine}")
+
     reid_embs, clip_embs, intervals, tracklet_keys = build_clustering_input_weighted(
         all_metadatas,
         all_features
     )
 
-    clusters = agglomerative_with_time_constraint_weighted(
-        reid_embs,
-        clip_embs,
-        intervals,
-        tau=tau,
-        w_reid=w_reid
-    )
+    engine_kwargs = {'k': knn_k} if engine == 'knn' else {}
+    if fused:
+        if engine == 'legacy':
+            raise ValueError("Fused vectors are not supported by the legacy engine")
+        engine_kwargs['fused'] = True
+    if precision != 'float32':
+        if engine == 'legacy':
+            raise ValueError("Low precision is not supported by the legacy engine")
+        engine_kwargs['precision'] = precision
+    if not time_constraint:
+        if engine != 'knn':
+            raise ValueError("Clustering without the time constraint needs the knn engine")
+        engine_kwargs['time_constraint'] = False
+    if tree_path is not None:
+        if engine == 'legacy':
+            raise ValueError("Merge trees are not supported by the legacy engine")
+        if not time_constraint:
+            raise ValueError("Merge trees are not recorded without the time constraint")
+        if tree_floor > tau:
+            raise ValueError("tree_floor must not exceed tau")
+
+        history = []
+        CLUSTERING_ENGINES[engine](
+            reid_embs,
+            clip_embs,
+            intervals,
+            tau=tree_floor,
+            w_reid=w_reid,
+            history=history,
+            **engine_kwargs
+        )
+        tree = MergeTree.from_history(
+            'camera', history, [[key] for key in tracklet_keys], [key[0] for key in tracklet_keys],
+            floor=tree_floor, w_reid=w_reid
+        )
+        tree.save(tree_path)
+        clusters = tree.cut(tau=tau)
+    else:
+        clusters = CLUSTERING_ENGINES[engine](
+            reid_embs,
+            clip_embs,
+            intervals,
+            tau=tau,
+            w_reid=w_reid,
+            **engine_kwargs
+        )
 
     # Map clusters back to tracklet keys
     result = []
@@ -201,7 +343,8 @@ def organize_images_by_cluster(clusters, crops_dir, output_dir):
         crops_dir: Path to crops directory (e.g., "data/crops/seq_000/camera_2")
         output_dir: Path to output directory (e.g., "data/cluster")
     """
-    import shutil
+    # Index the camera's crops once instead of listing the folder per tracklet
+    crops = CameraCrops(crops_dir)
 
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
@@ -217,28 +360,137 @@ def organize_images_by_cluster(clusters, crops_dir, output_dir):
         img_count = 0
         # Copy images from each tracklet in cluster
         for seq_id, cam_id, obj_id in tracklet_ids:
-            # Search for images matching object_id pattern in crops_dir
-            for img_file in os.listdir(crops_dir):
-                if img_file.endswith('.webp') and str(obj_id) in img_file:
-                    src = os.path.join(crops_dir, img_file)
-                    # Rename to avoid conflicts
-                    new_name = f"cam{cam_id}_obj{obj_id}_{img_file}"
-                    dst = os.path.join(cluster_folder, new_name)
-                    shutil.copy2(src, dst)
-                    img_count += 1
+            for _, img_file in crops.crops(obj_id):
+                # Rename to avoid conflicts
+                new_name = f"cam{cam_id}_obj{obj_id}_{img_file}"
+                crops.copy(img_file, os.path.join(cluster_folder, new_name))
+                img_count += 1
 
         print(f"  - Cluster person_{cluster_idx + 1:03d}: {len(tracklet_ids)} tracklets, {img_count} images")
 
     print(f"\nDone! Organized {len(clusters)} clusters in {output_dir}")
 
 
+CAMERAS = ['camera_1', 'camera_2', 'camera_3', 'camera_4', 'camera_5', 'camera_6', 'camera_7']
+
+
+def match_camera(
+        seq,
+        cam,
+        crops_dir='data/crops',
+        feature_dir='data/new_feature_objects',
+        meatadata_dir='data/new_metadata_objects',
+        output_dir='data/cluster',
+        tau=0.875,
+        w_reid=0.7,
+        engine='heap',
+        knn_k=30,
+        record_tree=False,
+        tree_floor=0.5,
+        fused=False,
+        detection_store=None,
+        embedding_store=None,
+        exclusions=None,
+        results_dir=None,
+        precision='float32',
+        time_constraint=True
+):
+    """
+    Match, save and organize images for one (seq, cam).
+    Results (and the merge tree) go to `results_dir`, default `output_dir`.
+
+    Returns:
+        Number of clusters found, or None if an input file is missing
+    """
+    results_dir = results_dir or output_dir
+
+    # Load data
+    metadata_path = os.path.join(meatadata_dir, seq, f"{seq}_{cam}.txt")
+    feature_path = os.path.join(feature_dir, seq, f"{seq}_{cam}.pkl")
+
+    if detection_store is not None:
+        seq_id, cam_id = int(seq.split('_')[-1]), int(cam.split('_')[-1])
+        try:
+            metadata_path = load_metadata_store(detection_store, seq_id, cam_id)
+        except KeyError:
+            print(f"Metadata not found in {detection_store}: {seq}/{cam}")
+            return None
+
+    if embedding_store is not None:
+        seq_id, cam_id = int(seq.split('_')[-1]), int(cam.split('_')[-1])
+        feature_path = load_features_store(embedding_store, seq_id, cam_id)
+        if not feature_path:
+            print(f"Features not found in {embedding_store}: {seq}/{cam}")
+            return None
+
+    #check files exist
+    if not isinstance(metadata_path, DetectionStore) and not os.path.exists(metadata_path):
+        print(f"Metadata file not found: {metadata_path}")
+        return None
+    if not isinstance(feature_path, dict) and not os.path.exists(feature_path):
+        print(f"Feature file not found: {feature_path}")
+        return None
+
+    all_metadatas, all_features = load_all_data([
+        (metadata_path,
+         feature_path)
+    ], exclusions=load_exclusions(exclusions))
+    if not all_features:
+        print(f"No tracks to match (all excluded?): {seq}/{cam}")
+        return None
+
+    # Perform matching
+    clusters = match_tracklets_weighted(
+        all_metadatas,
+        all_features,
+        tau=tau,
+        w_reid=w_reid,
+        engine=engine,
+        knn_k=knn_k,
+        tree_path=os.path.join(results_dir, f"{seq}_{cam}_tree.npz") if record_tree else None,
+        tree_floor=tree_floor,
+        fused=fused,
+        precision=precision,
+        time_constraint=time_constraint
+    )
+
+    # Save results
+    os.makedirs(results_dir, exist_ok=True)
+    output_path = os.path.join(results_dir, f"{seq}_{cam}_results.pkl")
+    save_results(clusters, output_path)
+
+    print(f"Found {len(clusters)} unique objects in {seq}")
+    print(f"Results saved to {output_path}")
+    # Organize images by cluster
+    crops_seq_dir = os.path.join(crops_dir, seq, cam)
+    output_seq_dir = os.path.join(output_dir, seq, cam)
+    organize_images_by_cluster(clusters, crops_seq_dir, output_seq_dir)
+
+    return len(clusters)
+
+
+def list_sequences(meatadata_dir):
+    seqs = glob.glob(os.path.join(meatadata_dir, 'seq_*/'))
+    return sorted([os.path.basename(os.path.normpath(s)) for s in seqs])
+
+
 def run_matching(
         crops_dir='data/crops',
         feature_dir = 'data/new_feature_objects',
         meatadata_dir = 'data/new_metadata_objects',
         output_dir='data/cluster',
         tau=0.875,
-        w_reid=0.7
+        w_reid=0.7,
+        engine='heap',
+        knn_k=30,
+        record_tree=False,
+        tree_floor=0.5,
+        fused=False,
+        detection_store=None,
+        embedding_store=None,
+        exclusions=None,
+        precision='float32',
+        time_constraint=True
 ):
     """
     Run the complete matching pipeline and organize images.
@@ -249,59 +501,138 @@ def run_matching(
         output_path: path to save matching results
         tau: similarity threshold
         w_reid: weight for ReID features
+        engine: clustering engine ('legacy', 'heap' or 'knn')
+        knn_k: neighbors per tracklet for the 'knn' engine
+        record_tree: also save each camera's merge tree, recorded down to
+            `tree_floor`, as `{seq}_{cam}_tree.npz` next to the results
+        fused: score pairs with the pre-fused ReID/CLIP vectors
+        detection_store: read the metadata from this detection store
+            (mmc/detection_store.py) instead of the text files
+        embedding_store: read the features from this embedding store
+            (mmc/embedding_store.py) instead of the pickles
+        exclusions: path of an exclusion set (mmc/exclusions.py); its tracks
+            are skipped
+        precision: 'float32', 'float16' or 'int8' similarity scan (mmc/quantization.py)
+        time_constraint: False clusters the kNN graph's connected components,
+            without the time-overlap rule ('knn' only)
     """
     os.makedirs(output_dir, exist_ok=True)
 
-    seqs = glob.glob(os.path.join(meatadata_dir, 'seq_*/'))
-    print(seqs)
-    seqs_name = sorted([os.path.basename(os.path.normpath(s)) for s in seqs])
-
+    seqs_name = list_sequences(meatadata_dir)
     print(seqs_name)
-    cameras = ['camera_1', 'camera_2', 'camera_3', 'camera_4', 'camera_5', 'camera_6', 'camera_7']
     for seq in seqs_name:
         print(f"Processing {seq}...")
-        for cam in cameras:
+        for cam in CAMERAS:
             print(f"Processing {cam}...")
-            # Load data
-            metadata_path = os.path.join(meatadata_dir, seq, f"{seq}_{cam}.txt")
-            feature_path = os.path.join(feature_dir, seq, f"{seq}_{cam}.pkl")
-    # Save results
-    # save_results(clusters, output_path)
+            match_camera(
+                seq, cam, crops_dir, feature_dir, meatadata_dir, output_dir,
+                tau=tau, w_reid=w_reid, engine=engine, knn_k=knn_k,
+                record_tree=record_tree, tree_floor=tree_floor, fused=fused,
+                detection_store=detection_store, embedding_store=embedding_store, exclusions=exclusions,
+                precision=precision, time_constraint=time_constraint
+            )
 
-            #check files exist
-            if not os.path.exists(metadata_path):
-                print(f"Metadata file not found: {metadata_path}")
-                continue
-            if not os.path.exists(feature_path):
-                print(f"Feature file not found: {feature_path}")
-                continue
 
-    # # Organize images by cluster
-    # organize_images_by_cluster(clusters, crops_dir, output_dir)
+def _job_size(seq, cam, feature_dir, meatadata_dir):
+    paths = [
+        os.path.join(meatadata_dir, seq, f"{seq}_{cam}.txt"),
+        os.path.join(feature_dir, seq, f"{seq}_{cam}.pkl"),
+    ]
+    return sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+
+
+def _run_matching_job(seq, cam, log_path, kwargs):
+    """Worker entry point: run one (seq, cam) with its output captured in its own log."""
+    import contextlib
+    import time
+    import traceback
+
+    start = time.perf_counter()
+    record = {'seq': seq, 'cam': cam, 'log': log_path}
+    with open(log_path, 'w') as log, contextlib.redirect_stdout(log):
+        try:
+            n_clusters = match_camera(seq, cam, **kwargs)
+            record['status'] = 'skipped' if n_clusters is None else 'ok'
+            record['n_clusters'] = n_clusters
+        except Exception as e:
+            traceback.print_exc(file=log)
+            record['status'] = 'failed'
+            record['error'] = f"{type(e).__name__}: {e}"
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def run_matching_parallel(
+        crops_dir='data/crops',
+        feature_dir='data/new_feature_objects',
+        meatadata_dir='data/new_metadata_objects',
+        output_dir='data/cluster',
+        tau=0.875,
+        w_reid=0.7,
+        engine='heap',
+        knn_k=30,
+        record_tree=False,
+        tree_floor=0.5,
+        fused=False,
+        detection_store=None,
+        embedding_store=None,
+        exclusions=None,
+        precision='float32',
+        time_constraint=True,
+        workers=None
+):
+    """
+    `run_matching` with every (seq, cam) as an independent job on a process pool.
 
-            all_metadatas, all_features = load_all_data([
-                (metadata_path,
-                 feature_path)
-            ])
-
-            # Perform matching
-            clusters = match_tracklets_weighted(
-                all_metadatas,
-                all_features,
-                tau=tau,
-                w_reid=w_reid
-            )
+    Jobs are scheduled largest input first; each writes its own results, image
+    folders and log (`output_dir/logs/{seq}_{cam}.log`). A per-job summary with
+    timings is written to `output_dir/matching_summary.json`, also when workers
+    crash: their jobs are recorded as failed.
 
-            # Save results
-            output_path = os.path.join(output_dir, f"{seq}_{cam}_results.pkl")
-            save_results(clusters, output_path)
+    Returns:
+        List of job records (status is 'ok', 'skipped' or 'failed')
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    log_dir = os.path.join(output_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
 
-            print(f"Found {len(clusters)} unique objects in {seq}")
-            print(f"Results saved to {output_path}")
-            # Organize images by cluster
-            crops_seq_dir = os.path.join(crops_dir, seq, cam)
-            output_seq_dir = os.path.join(output_dir, seq, cam)
-            organize_images_by_cluster(clusters, crops_seq_dir, output_seq_dir)
+    kwargs = dict(
+        crops_dir=crops_dir, feature_dir=feature_dir, meatadata_dir=meatadata_dir, output_dir=output_dir,
+        tau=tau, w_reid=w_reid, engine=engine, knn_k=knn_k, record_tree=record_tree, tree_floor=tree_floor,
+        fused=fused, detection_store=detection_store, embedding_store=embedding_store, exclusions=exclusions,
+        precision=precision, time_constraint=time_constraint
+    )
+    jobs = [(seq, cam) for seq in list_sequences(meatadata_dir) for cam in CAMERAS]
+    jobs.sort(key=lambda job: _job_size(*job, feature_dir, meatadata_dir), reverse=True)
+    print(f"Running {len(jobs)} jobs on {workers or os.cpu_count()} workers...")
+
+    summary = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_run_matching_job, seq, cam, os.path.join(log_dir, f"{seq}_{cam}.log"), kwargs): (seq, cam)
+            for seq, cam in jobs
+        }
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+            except Exception as e:
+                # The worker itself died (e.g. BrokenProcessPool after an OOM kill)
+                seq, cam = futures[future]
+                record = {'seq': seq, 'cam': cam, 'log': os.path.join(log_dir, f"{seq}_{cam}.log"),
+                          'status': 'failed', 'error': f"{type(e).__name__}: {e}", 'seconds': 0.0}
+            summary.append(record)
+            print(f"  [{len(summary)}/{len(jobs)}] {record['seq']}/{record['cam']}: "
+                  f"{record['status']} in {record['seconds']:.2f}s")
+
+    summary.sort(key=lambda r: (r['seq'], r['cam']))
+    summary_path = os.path.join(output_dir, 'matching_summary.json')
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    failed = [r for r in summary if r['status'] == 'failed']
+    print(f"Done: {len(summary) - len(failed)} succeeded, {len(failed)} failed. Summary saved to {summary_path}")
+    return summary
 
 
 # -------------------------------------------------------------------
@@ -332,13 +663,49 @@ def run_matching(
 
 
 if __name__ == "__main__":
-    clusters = run_matching(
-        crops_dir='data/crops',
-        output_dir='new_clusters',
-        feature_dir='data/new_feature_objects',
-        meatadata_dir='data/new_metadata_objects',
-        tau=0.875,
-        w_reid=0.7
-    )
-    print(clusters)
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="In-camera tracklet matching")
+    parser.add_argument('--workers', type=int, default=1, help="parallel (seq, cam) jobs; 1 runs serially")
+    parser.add_argument('--exclusions', help="exclusion set of tracks to skip (see mmc/exclusions.py)")
+    parser.add_argument('--precision', choices=PRECISIONS, default='float32',
+                        help="similarity scan precision (see mmc/quantization.py)")
+    parser.add_argument('--engine', choices=list(CLUSTERING_ENGINES), default='heap')
+    parser.add_argument('--knn-k', type=int, default=30, help="neighbors per tracklet for the knn engine")
+    parser.add_argument('--no-time-constraint', dest='time_constraint', action='store_false',
+                        help="knn engine only: cluster the graph's connected components, ignoring time overlap")
+    args = parser.parse_args()
+
+    if args.workers == 1:
+        run_matching(
+            crops_dir='data/crops',
+            output_dir='new_clusters',
+            feature_dir='data/new_feature_objects',
+            meatadata_dir='data/new_metadata_objects',
+            tau=0.875,
+            w_reid=0.7,
+            engine=args.engine,
+            knn_k=args.knn_k,
+            exclusions=args.exclusions,
+            precision=args.precision,
+            time_constraint=args.time_constraint
+        )
+    else:
+        summary = run_matching_parallel(
+            crops_dir='data/crops',
+            output_dir='new_clusters',
+            feature_dir='data/new_feature_objects',
+            meatadata_dir='data/new_metadata_objects',
+            tau=0.875,
+            w_reid=0.7,
+            engine=args.engine,
+            knn_k=args.knn_k,
+            exclusions=args.exclusions,
+            precision=args.precision,
+            time_constraint=args.time_constraint,
+            workers=args.workers
+        )
+        if any(r['status'] == 'failed' for r in summary):
+            sys.exit(1)
 
@@ -2,9 +2,19 @@ import numpy as np
 import os
 import glob
 import pickle
-import shutil
 from itertools import combinations
 from pathlib import Path
+from linkage import SeqCamConstraint, agglomerate, agglomerate_sparse
+from blocking import candidate_mask, edge_candidates
+from knn_graph import knn_graph
+from fusion import fuse_embeddings, fused_similarity_matrix
+from merge_tree import MergeTree
+from identity_index import IdentityIndex
+from data_loader import load_metadata_file
+from detection_store import DetectionStore
+from gallery import GALLERY_MODES, build_galleries, changed_global_ids
+from node_matrix import load_node_matrix
+from quantization import PRECISIONS, similarity_candidates
 
 
 class Node:
@@ -15,6 +25,7 @@ class Node:
         self.track_keys = []  # List of (seq_id, cam_id, obj_id)
         self.reid_average = None
         self.clip_average = None
+        self.interval = None  # (frame_start, frame_end) over all tracks
 
     def compute_averages(self, all_features):
         reid_vecs = []
@@ -126,6 +137,104 @@ def agglomerative_clustering_global(nodes, tau_same_seq=0.9, tau_diff_seq=0.9, w
     print(f"Clustering complete: {len(clusters)} global IDs found")
     return clusters
 
+
+def node_embeddings(nodes):
+    """Stack the node averages into (N, D1) ReID and (N, D2) CLIP matrices."""
+    reid = np.stack([node.reid_average for node in nodes])
+    clip = np.stack([node.clip_average for node in nodes])
+    return reid, clip
+
+
+def node_similarity_matrix(nodes, w_reid=0.7, fused=False):
+    """All-pairs version of `weighted_similarity_nodes`, optionally from the pre-fused vectors."""
+    w_clip = 1.0 - w_reid
+    reid, clip = node_embeddings(nodes)
+    if fused:
+        return fused_similarity_matrix(fuse_embeddings(reid, clip, w_reid))
+    return w_reid * (reid @ reid.T) + w_clip * (clip @ clip.T)
+
+
+def agglomerative_clustering_global_heap(nodes, tau_same_seq=0.9, tau_diff_seq=0.9, w_reid=0.7, candidates=None,
+                                         history=None, fused=False, precision='float32'):
+    """
+    Same merges as `agglomerative_clustering_global`, driven by a priority queue.
+    The node similarity matrix is computed once and updated with max linkage after
+    each merge; (seq, cam) and seq sets are kept as per-cluster bitmasks so the
+    overlap veto and the dynamic threshold are vectorized.
+
+    `candidates` is an optional (N, N) boolean mask from blocking; node pairs
+    outside it are never scored or merged directly. Merges are appended to
+    `history` as (a, b, sim) when given. With `fused`, similarities come from
+    one product of the pre-fused vectors (mmc/fusion.py). With a lower `precision`,
+    the pairs above the lower threshold are found on float16 / int8 codes, rescored
+    exactly and clustered sparsely, with the same merges (mmc/quantization.py).
+    """
+    print(f"Starting clustering with {len(nodes)} initial clusters...")
+
+    constraint = SeqCamConstraint.from_nodes(nodes, tau_same_seq, tau_diff_seq)
+    if history is None:
+        history = []
+    if precision != 'float32':
+        reid, clip = node_embeddings(nodes)
+        rows, cols, sims = similarity_candidates(reid, clip, w_reid, precision,
+                                                 min_sim=min(tau_same_seq, tau_diff_seq), fused=fused)
+        if candidates is not None:
+            keep = candidates[rows, cols]
+            rows, cols, sims = rows[keep], cols[keep], sims[keep]
+        clusters = agglomerate_sparse(len(nodes), rows, cols, sims, constraint, history=history)
+    else:
+        sim = node_similarity_matrix(nodes, w_reid, fused=fused)
+        if candidates is not None:
+            sim[~candidates] = -np.inf
+        clusters = agglomerate(sim, constraint, history=history)
+
+    print(f"  {len(history)} merges")
+    print(f"Clustering complete: {len(clusters)} global IDs found")
+    return clusters
+
+
+def agglomerative_clustering_global_knn(nodes, tau_same_seq=0.9, tau_diff_seq=0.9, w_reid=0.7, k=30, blocking=False,
+                                        history=None, fused=False, precision='float32'):
+    """
+    Sparse variant of `agglomerative_clustering_global_heap` for large node sets:
+    only the edges of a top-k neighbor graph above the lower threshold are
+    clustered, in O(N·k) memory. With `blocking`, edges are filtered by the camera
+    graph and transit windows (requires `node.interval`, see compute_node_intervals).
+    With a lower `precision`, neighbors are searched in float16 / int8 and rescored exactly.
+    """
+    print(f"Starting clustering with {len(nodes)} initial clusters...")
+
+    reid, clip = node_embeddings(nodes)
+    rows, cols, sims = knn_graph(reid, clip, w_reid, k=k, min_sim=min(tau_same_seq, tau_diff_seq), fused=fused,
+                                 precision=precision)
+    print(f"  kNN graph: {len(rows)} edges (k={k})")
+
+    if blocking:
+        keep, report = edge_candidates(
+            rows, cols,
+            [node.seq_id for node in nodes],
+            [node.cam_id for node in nodes],
+            [node.interval for node in nodes],
+        )
+        print(report.summary())
+        rows, cols, sims = rows[keep], cols[keep], sims[keep]
+
+    constraint = SeqCamConstraint.from_nodes(nodes, tau_same_seq, tau_diff_seq)
+    if history is None:
+        history = []
+    clusters = agglomerate_sparse(len(nodes), rows, cols, sims, constraint, history=history)
+
+    print(f"  {len(history)} merges")
+    print(f"Clustering complete: {len(clusters)} global IDs found")
+    return clusters
+
+
+GLOBAL_CLUSTERING_ENGINES = {
+    'legacy': agglomerative_clustering_global,
+    'heap': agglomerative_clustering_global_heap,
+    'knn': agglomerative_clustering_global_knn,
+}
+
 def save_global_results(clusters, nodes, output_path):
     """Save global clustering results."""
     results = []
@@ -144,7 +253,8 @@ def save_global_results(clusters, nodes, output_path):
     return results
 
 
-def organize_global_images(global_clusters, crops_base_dir='data/crops', output_dir='data/global_ids'):
+def organize_global_images(global_clusters, crops_base_dir='data/crops', output_dir='data/global_ids',
+                           global_ids=None, mode='copy', workers=8):
     """
     Organize images by global ID across all sequences and cameras.
 
@@ -152,123 +262,156 @@ def organize_global_images(global_clusters, crops_base_dir='data/crops', output_
         global_clusters: List of lists, each containing track_keys (seq_id, cam_id, obj_id)
         crops_base_dir: Base directory containing crops organized by seq/camera
         output_dir: Output directory for global_ids
+        global_ids: only organize these global IDs (default: all)
+        mode: 'copy', 'hardlink', 'symlink' or 'manifest' (see mmc/gallery.py)
+        workers: threads for the file work
     """
-    os.makedirs(output_dir, exist_ok=True)
-
     print(f"\nOrganizing images into global IDs...")
     print(f"Source: {crops_base_dir}")
-    print(f"Destination: {output_dir}")
-
-    total_images_copied = 0
-
-    for global_id, track_keys in enumerate(global_clusters):
-        # Create folder for this global ID
-        global_folder = os.path.join(output_dir, f"global_id_{global_id:03d}")
-        os.makedirs(global_folder, exist_ok=True)
-
-        images_in_cluster = 0
-
-        # Process each track in the cluster
-        for seq_id, cam_id, obj_id in track_keys:
-            # Construct path to crops for this sequence/camera
-            seq_folder = f"seq_{seq_id:03d}"
-            cam_folder = f"camera_{cam_id}"
-            crops_dir = os.path.join(crops_base_dir, seq_folder, cam_folder)
-
-            if not os.path.exists(crops_dir):
-                print(f"  Warning: Directory not found: {crops_dir}")
-                continue
-
-            # Find all images for this object
-            # Format: {cam_id*100000 + obj_id}_{frame_id}.webp
-            obj_prefix = f"{obj_id}_"
+    print(f"Destination: {output_dir} ({mode})")
 
-            for img_file in os.listdir(crops_dir):
-                if img_file.startswith(obj_prefix) and img_file.endswith('.webp'):
-                    src_path = os.path.join(crops_dir, img_file)
+    total_images = build_galleries(global_clusters, crops_base_dir, output_dir, global_ids, mode, workers)
 
-                    # Create descriptive filename
-                    frame_id = img_file.split('_')[1].replace('.webp', '')
-                    new_filename = f"seq_{seq_id:03d}_cam_{cam_id}_obj_{obj_id:05d}_frame_{frame_id}.webp"
-                    dst_path = os.path.join(global_folder, new_filename)
+    print(f"\nTotal: {len(global_clusters)} global IDs, {total_images} images ({mode})")
 
-                    # Copy image
-                    shutil.copy2(src_path, dst_path)
-                    images_in_cluster += 1
 
-        total_images_copied += images_in_cluster
-        print(f"  Global ID {global_id:03d}: {len(track_keys)} tracks, {images_in_cluster} images")
-
-    print(f"\nTotal: {len(global_clusters)} global IDs, {total_images_copied} images copied")
-
-
-def load_nodes_from_clusters():
-    """Load all nodes from single-camera clustering results."""
-    clusters_dir = 'new_clusters'
+def list_cluster_sequences(clusters_dir='new_clusters'):
+    """Sequence ids with single-camera clustering results."""
     seqs = sorted(glob.glob(os.path.join(clusters_dir, 'seq_*/')))
-    cameras = ['camera_1', 'camera_2', 'camera_3', 'camera_4', 'camera_5', 'camera_6', 'camera_7']
+    return [int(os.path.basename(os.path.normpath(seq)).split('_')[-1]) for seq in seqs]
 
-    nodes = []
-    node_id = 0
 
+def load_nodes_from_clusters(seq_ids=None, embedding_store=None, exclusions=None, cache_dir='new_clusters/node_cache'):
+    """
+    Load nodes from single-camera clustering results (all sequences, or only `seq_ids`).
+    Features come from the pickles, or from `embedding_store` (mmc/embedding_store.py).
+    Tracks of the `exclusions` set (mmc/exclusions.py) are left out. The node averages
+    come from the node matrix (mmc/node_matrix.py), cached in `cache_dir` (None: no cache).
+    """
     print("Loading nodes from single-camera clusters...")
+    matrix = load_node_matrix(seq_ids, embedding_store, exclusions, cache_dir=cache_dir)
 
-    for seq in seqs:
-        seq_name = os.path.basename(os.path.normpath(seq))
-        seq_id = int(seq_name.split('_')[-1])
-
-        for cam in cameras:
-            cam_id = int(cam.split('_')[-1])
-
-            cluster_file = f'{clusters_dir}/results/{seq_name}_{cam}_results.pkl'
-            if not os.path.exists(cluster_file):
-                continue
-
-            feature_file_path = os.path.join('data', 'new_feature_objects', seq_name, f"{seq_name}_{cam}.pkl")
-            if not os.path.exists(feature_file_path):
-                continue
-
-            # Load clusters and features
-            with open(cluster_file, "rb") as f:
-                clusters = pickle.load(f)
-
-            with open(feature_file_path, "rb") as f:
-                all_features = pickle.load(f)
-
-            # Create node for each cluster
-            for cluster in clusters:
-                node = Node()
-                node.id = node_id
-                node.seq_id = seq_id
-                node.cam_id = cam_id
-                node.track_keys = cluster
-                node.compute_averages(all_features)
-                nodes.append(node)
-                node_id += 1
-
-        print(f"  {seq_name}: {node_id} nodes loaded")
+    track_keys = [tuple(key) for key in matrix['track_keys'].tolist()]
+    offsets = matrix['track_offsets'].tolist()
+    node_seq, node_cam = matrix['node_seq'].tolist(), matrix['node_cam'].tolist()
 
+    nodes = []
+    for node_id in range(len(node_seq)):
+        node = Node()
+        node.id = node_id
+        node.seq_id = node_seq[node_id]
+        node.cam_id = node_cam[node_id]
+        node.track_keys = track_keys[offsets[node_id]:offsets[node_id + 1]]
+        node.reid_average = matrix['node_reid'][node_id]
+        node.clip_average = matrix['node_clip'][node_id]
+        nodes.append(node)
+
+    for seq_id, count in zip(*np.unique(matrix['node_seq'], return_counts=True)):
+        print(f"  seq_{seq_id:03d}: {count} nodes")
     print(f"Total nodes loaded: {len(nodes)}")
     return nodes
 
 
+def compute_node_intervals(nodes, metadata_dir='data/new_metadata_objects', detection_store=None):
+    """
+    Set `node.interval` to the (first, last) frame covered by the node's tracks,
+    read from the metadata text files, or from `detection_store` (mmc/detection_store.py) when given.
+    """
+    by_file = {}
+    for node in nodes:
+        by_file.setdefault((node.seq_id, node.cam_id), []).append(node)
+    store = DetectionStore(detection_store) if detection_store is not None else None
+
+    for (seq_id, cam_id), file_nodes in by_file.items():
+        if store is not None:
+            try:
+                view = store.camera(seq_id, cam_id)
+            except KeyError:
+                track_intervals = {}
+            else:
+                track_intervals = dict(zip(map(tuple, view.keys_array().tolist()), view.intervals().tolist()))
+        else:
+            seq_name = f"seq_{seq_id:03d}"
+            metadata_path = os.path.join(metadata_dir, seq_name, f"{seq_name}_camera_{cam_id}.txt")
+            metadata = load_metadata_file(metadata_path) if os.path.exists(metadata_path) else {}
+            track_intervals = {key: (min(d['frame_id'] for d in records), max(d['frame_id'] for d in records))
+                               for key, records in metadata.items() if records}
+
+        for node in file_nodes:
+            spans = [track_intervals[key] for key in map(tuple, node.track_keys) if key in track_intervals]
+            # Unknown extent: an empty interval keeps the pair as a candidate
+            node.interval = (min(s[0] for s in spans), max(s[1] for s in spans)) if spans else (0, -1)
+
+
+def block_node_pairs(nodes, metadata_dir='data/new_metadata_objects', detection_store=None):
+    """Candidate mask over node pairs from the camera graph and transit windows."""
+    compute_node_intervals(nodes, metadata_dir, detection_store)
+    mask, report = candidate_mask(
+        [node.seq_id for node in nodes],
+        [node.cam_id for node in nodes],
+        [node.interval for node in nodes],
+    )
+    print(report.summary())
+    return mask, report
+
+
 def run_global_matching(
         tau_same_seq=0.875,
         tau_diff_seq=0.92,
         w_reid=0.7,
         crops_base_dir='data/crops',
         output_dir='data/global_ids',
-        results_file='global_matching_results.pkl'
+        results_file='global_matching_results.pkl',
+        engine='heap',
+        blocking=False,
+        metadata_dir='data/new_metadata_objects',
+        detection_store=None,
+        knn_k=30,
+        tree_file=None,
+        tree_floor=0.5,
+        fused=False,
+        embedding_store=None,
+        exclusions=None,
+        gallery_mode='copy',
+        only_changed_galleries=False,
+        precision='float32'
 ):
     """
     Main function to run global matching across all sequences and cameras.
+
+    `engine` selects the clustering implementation ('legacy', 'heap' or 'knn',
+    the latter keeping `knn_k` neighbors per node).
+    With `blocking`, node pairs that the camera topology and transit windows rule
+    out (see mmc/blocking.py) are never compared; not supported by 'legacy'.
+    Blocking reads the track intervals from `metadata_dir`, or from `detection_store`
+    (mmc/detection_store.py) when given.
+    With `tree_file`, the merge tree down to `tree_floor` is also saved so the
+    thresholds can be re-cut later with mmc/merge_tree.py.
+    With `fused`, node similarities use the pre-fused ReID/CLIP vectors.
+    `precision` ('float32', 'float16' or 'int8') selects the similarity scan (mmc/quantization.py).
+    With `embedding_store`, node features are read from that store instead of the pickles.
+    With `exclusions`, the tracks of that exclusion set (mmc/exclusions.py) are left out.
+    `gallery_mode` selects how the per-ID image galleries are written (see mmc/gallery.py).
+    With `only_changed_galleries`, only the galleries of global IDs whose tracks differ
+    from the previous `results_file` are rewritten.
     """
+    if engine not in GLOBAL_CLUSTERING_ENGINES:
+        raise ValueError(f"Unknown clustering engine: {engine}")
+    if blocking and engine == 'legacy':
+        raise ValueError("Blocking is not supported by the legacy engine")
+    if tree_file is not None and engine == 'legacy':
+        raise ValueError("Merge trees are not supported by the legacy engine")
+    if fused and engine == 'legacy':
+        raise ValueError("Fused vectors are not supported by the legacy engine")
+    if precision != 'float32' and engine == 'legacy':
+        raise ValueError("Low precision is not supported by the legacy engine")
+
     print("=" * 80)
     print("GLOBAL MULTI-CAMERA MULTI-SEQUENCE MATCHING")
     print("=" * 80)
 
     # Step 1: Load all nodes
-    nodes = load_nodes_from_clusters()
+    nodes = load_nodes_from_clusters(embedding_store=embedding_store, exclusions=exclusions)
 
     if len(nodes) == 0:
         print("No nodes found! Please run single-camera matching first.")
@@ -279,17 +422,53 @@ def run_global_matching(
     print(f"  - Different sequence threshold: {tau_diff_seq}")
     print(f"  - ReID weight: {w_reid}")
     print(f"  - CLIP weight: {1.0 - w_reid}")
+    print(f"  - Engine: {engine}")
+    print(f"  - Blocking: {blocking}")
+    print(f"  - Precision: {precision}")
 
     # Step 2: Perform global clustering
     print("\n" + "=" * 80)
     print("STEP 1: Global Clustering")
     print("=" * 80)
-    global_clusters = agglomerative_clustering_global(
-        nodes,
-        tau_same_seq=tau_same_seq,
-        tau_diff_seq=tau_diff_seq,
-        w_reid=w_reid
-    )
+    engine_kwargs = {'fused': True} if fused else {}
+    if precision != 'float32':
+        engine_kwargs['precision'] = precision
+    if engine == 'knn':
+        engine_kwargs['k'] = knn_k
+        if blocking:
+            compute_node_intervals(nodes, metadata_dir, detection_store)
+            engine_kwargs['blocking'] = True
+    elif blocking:
+        engine_kwargs['candidates'], _ = block_node_pairs(nodes, metadata_dir, detection_store)
+
+    if tree_file is not None:
+        history = []
+        GLOBAL_CLUSTERING_ENGINES[engine](
+            nodes,
+            tau_same_seq=tree_floor,
+            tau_diff_seq=tree_floor,
+            w_reid=w_reid,
+            history=history,
+            **engine_kwargs
+        )
+        tree = MergeTree.from_history(
+            'global', history, [node.track_keys for node in nodes], [node.seq_id for node in nodes],
+            floor=tree_floor, w_reid=w_reid
+        )
+        tree.save(tree_file)
+        print(f"Merge tree saved to {tree_file}")
+
+    if tree_file is not None and tau_same_seq == tau_diff_seq:
+        # Single threshold: the cut is exact
+        global_clusters = tree.cut(tau=tau_same_seq)
+    else:
+        global_clusters = GLOBAL_CLUSTERING_ENGINES[engine](
+            nodes,
+            tau_same_seq=tau_same_seq,
+            tau_diff_seq=tau_diff_seq,
+            w_reid=w_reid,
+            **engine_kwargs
+        )
 
     # Step 3: Convert clusters to track_keys format
     print("\n" + "=" * 80)
@@ -306,13 +485,22 @@ def run_global_matching(
     print("\n" + "=" * 80)
     print("STEP 3: Saving Results")
     print("=" * 80)
+    previous_results = None
+    if only_changed_galleries and os.path.exists(results_file) and os.path.isdir(output_dir):
+        with open(results_file, 'rb') as f:
+            previous_results = pickle.load(f)
     save_global_results(global_clusters, nodes, results_file)
 
     # Step 5: Organize images
     print("\n" + "=" * 80)
     print("STEP 4: Organizing Images")
     print("=" * 80)
-    organize_global_images(global_track_clusters, crops_base_dir, output_dir)
+    global_ids = None
+    if previous_results is not None:
+        global_ids = changed_global_ids(previous_results, global_track_clusters)
+        print(f"{len(global_ids)} global IDs changed since the previous results")
+    organize_global_images(global_track_clusters, crops_base_dir, output_dir, global_ids=global_ids,
+                           mode=gallery_mode)
 
     print("\n" + "=" * 80)
     print("GLOBAL MATCHING COMPLETE!")
@@ -328,12 +516,118 @@ def run_global_matching(
 
     return global_track_clusters
 
-if __name__ == "__main__":
-    global_clusters = run_global_matching(
-        tau_same_seq=0.9,
-        tau_diff_seq=0.95,
-        w_reid=0.75,
+def run_incremental_global_matching(
+        tau_same_seq=0.875,
+        tau_diff_seq=0.92,
+        w_reid=0.7,
         crops_base_dir='data/crops',
-        output_dir='data/global_ids_2',
-        results_file='global_matching_results_2.pkl'
-    )
+        output_dir='data/global_ids',
+        results_file='global_matching_results.pkl',
+        index_file='global_identity_index.npz',
+        embedding_store=None,
+        exclusions=None,
+        gallery_mode='copy'
+):
+    """
+    Global matching of the sequences not yet in the identity index (see
+    mmc/identity_index.py) against the identities already found.
+
+    Existing global IDs are kept; only the new nodes are compared and only the
+    identities they touch are re-organized. The first run (no index yet) gives
+    the same clusters as `run_global_matching` with the heap engine.
+    Tracks excluded later (mmc/exclusions.py) stay in the identities already indexed.
+    """
+    print("=" * 80)
+    print("INCREMENTAL GLOBAL MATCHING")
+    print("=" * 80)
+
+    if os.path.exists(index_file):
+        index = IdentityIndex.load(index_file)
+        if (index.tau_same_seq, index.tau_diff_seq, index.w_reid) != (tau_same_seq, tau_diff_seq, w_reid):
+            raise ValueError(
+                f"{index_file} was built with tau_same_seq={index.tau_same_seq}, "
+                f"tau_diff_seq={index.tau_diff_seq}, w_reid={index.w_reid}; rebuild it to change them"
+            )
+        print(f"Loaded {index_file}: {index.n_nodes} nodes, {index.n_identities} identities, "
+              f"{len(index.sequences)} sequences")
+    else:
+        index = IdentityIndex(tau_same_seq, tau_diff_seq, w_reid)
+        print(f"No index at {index_file}, starting a new one")
+
+    new_seqs = [seq_id for seq_id in list_cluster_sequences() if seq_id not in index.sequences]
+    if not new_seqs:
+        print("No new sequences to match.")
+        return index.results()
+    print(f"New sequences: {new_seqs}")
+
+    nodes = load_nodes_from_clusters(seq_ids=set(new_seqs), embedding_store=embedding_store, exclusions=exclusions)
+    retired_before = set(index.merged_into)
+    node_ids = index.ingest(nodes)
+    index.save(index_file)
+    print(f"Index saved to {index_file}")
+
+    results = index.results()
+    with open(results_file, 'wb') as f:
+        pickle.dump(results, f)
+    print(f"Results saved to {results_file}")
+
+    # Only identities that received new tracks, or were retired by a merge, changed on disk
+    retired = set(index.merged_into) - retired_before
+    organize_global_images(results, crops_base_dir, output_dir, global_ids=set(node_ids.tolist()) | retired,
+                           mode=gallery_mode)
+
+    print(f"Found {index.n_identities} global identities")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Global multi-camera multi-sequence matching")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only match sequences missing from the identity index, keeping global IDs")
+    parser.add_argument('--index-file', default='global_identity_index.npz')
+    parser.add_argument('--exclusions', help="exclusion set of tracks to leave out (see mmc/exclusions.py)")
+    parser.add_argument('--gallery-mode', choices=GALLERY_MODES, default='copy',
+                        help="how images are put into the global ID galleries")
+    parser.add_argument('--precision', choices=PRECISIONS, default='float32',
+                        help="similarity scan precision (see mmc/quantization.py)")
+    parser.add_argument('--engine', choices=list(GLOBAL_CLUSTERING_ENGINES), default='heap')
+    parser.add_argument('--blocking', action='store_true',
+                        help="only compare node pairs allowed by the camera graph and transit windows "
+                             "(see mmc/blocking.py); prints the pruning report")
+    parser.add_argument('--detection-store',
+                        help="read the track intervals for blocking from this store (see mmc/detection_store.py)")
+    args = parser.parse_args()
+    if args.incremental and (args.engine != 'heap' or args.blocking or args.detection_store):
+        parser.error("--engine, --blocking and --detection-store only apply to a full run, not --incremental")
+    if args.incremental and args.precision != 'float32':
+        parser.error("--precision is not supported with --incremental (the identity index scores in float32)")
+
+    if args.incremental:
+        global_clusters = run_incremental_global_matching(
+            tau_same_seq=0.9,
+            tau_diff_seq=0.95,
+            w_reid=0.75,
+            crops_base_dir='data/crops',
+            output_dir='data/global_ids_2',
+            results_file='global_matching_results_2.pkl',
+            index_file=args.index_file,
+            exclusions=args.exclusions,
+            gallery_mode=args.gallery_mode
+        )
+    else:
+        global_clusters = run_global_matching(
+            tau_same_seq=0.9,
+            tau_diff_seq=0.95,
+            w_reid=0.75,
+            crops_base_dir='data/crops',
+            output_dir='data/global_ids_2',
+            results_file='global_matching_results_2.pkl',
+            engine=args.engine,
+            blocking=args.blocking,
+            detection_store=args.detection_store,
+            exclusions=args.exclusions,
+            gallery_mode=args.gallery_mode,
+            precision=args.precision
+        )
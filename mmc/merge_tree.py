@@ -0,0 +1,159 @@
+import argparse
+import pickle
+import time
+
+import numpy as np
+
+
+class MergeTree:
+    """
+    Merge history (dendrogram) of a matching stage, recorded once at a low `floor`
+    threshold with the constraint vetoes applied and cut later at any threshold
+    >= floor without re-clustering.
+
+    Merge similarities of constrained max linkage never increase, so with a single
+    threshold the cut is exactly the result of clustering at that threshold
+    (in-camera `tau`, or global with tau_same_seq == tau_diff_seq). With two global
+    thresholds the cut is conservative: each merge is checked against its own
+    threshold, and a rejected merge freezes its subtree.
+    """
+
+    def __init__(self, stage, merges, sims, item_keys, item_offsets, item_seq_ids, floor, w_reid):
+        self.stage = stage  # 'camera' or 'global'
+        self.merges = np.asarray(merges, dtype=np.int64).reshape(-1, 2)
+        self.sims = np.asarray(sims, dtype=np.float32)
+        self.item_keys = np.asarray(item_keys, dtype=np.int64).reshape(-1, 3)
+        self.item_offsets = np.asarray(item_offsets, dtype=np.int64)
+        self.item_seq_ids = np.asarray(item_seq_ids, dtype=np.int64)
+        self.floor = float(floor)
+        self.w_reid = float(w_reid)
+
+    @property
+    def n_items(self):
+        return len(self.item_offsets) - 1
+
+    @classmethod
+    def from_history(cls, stage, history, item_track_keys, item_seq_ids, floor, w_reid):
+        """Build a tree from an engine `history` [(a, b, sim), ...] and per-item track keys."""
+        offsets = np.concatenate([[0], np.cumsum([len(keys) for keys in item_track_keys])])
+        keys = [tuple(key) for keys in item_track_keys for key in keys]
+        merges = [(a, b) for a, b, _ in history]
+        sims = [s for _, _, s in history]
+        return cls(stage, merges, sims, keys, offsets, item_seq_ids, floor, w_reid)
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            stage=self.stage,
+            merges=self.merges.astype(np.int32),
+            sims=self.sims,
+            item_keys=self.item_keys,
+            item_offsets=self.item_offsets,
+            item_seq_ids=self.item_seq_ids,
+            floor=self.floor,
+            w_reid=self.w_reid,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                str(data['stage']), data['merges'], data['sims'], data['item_keys'],
+                data['item_offsets'], data['item_seq_ids'], float(data['floor']), float(data['w_reid']),
+            )
+
+    def cut(self, tau=None, tau_same_seq=None, tau_diff_seq=None):
+        """
+        Clusters (sets of item indices, legacy order) at the given threshold(s).
+        Use `tau` for the camera stage, `tau_same_seq`/`tau_diff_seq` (or `tau`
+        for both) for the global stage.
+        """
+        if tau_same_seq is None:
+            tau_same_seq = tau
+        if tau_diff_seq is None:
+            tau_diff_seq = tau
+        if tau_same_seq is None or tau_diff_seq is None:
+            raise ValueError("A threshold is required to cut the tree")
+        if min(tau_same_seq, tau_diff_seq) < self.floor:
+            raise ValueError(f"Cannot cut below the recorded floor {self.floor}")
+
+        thresholds = np.array([tau_diff_seq, tau_same_seq], dtype=self.sims.dtype)
+        clusters = [{i} for i in range(self.n_items)]
+        seqs = [{s} for s in self.item_seq_ids.tolist()]
+        alive = np.ones(self.n_items, dtype=bool)
+        frozen = np.zeros(self.n_items, dtype=bool)
+
+        for (a, b), sim in zip(self.merges.tolist(), self.sims):
+            if frozen[a] or frozen[b]:
+                frozen[a] = True
+                continue
+            same_seq = not seqs[a].isdisjoint(seqs[b])
+            if not sim > thresholds[int(same_seq)]:
+                frozen[a] = True
+                continue
+            clusters[a] |= clusters[b]
+            seqs[a] |= seqs[b]
+            alive[b] = False
+
+        return [clusters[i] for i in np.flatnonzero(alive)]
+
+    def cluster_keys(self, clusters):
+        """
+        Map item clusters to lists of (seq_id, cam_id, obj_id) track keys, i.e. the
+        pickle format of `save_results` (camera) and `save_global_results` (global).
+        """
+        keys = [tuple(key) for key in self.item_keys.tolist()]
+        offsets = self.item_offsets.tolist()
+        return [
+            [key for item in cluster for key in keys[offsets[item]:offsets[item + 1]]]
+            for cluster in clusters
+        ]
+
+    def save_cut(self, output_path, **thresholds):
+        results = self.cluster_keys(self.cut(**thresholds))
+        with open(output_path, 'wb') as f:
+            pickle.dump(results, f)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Inspect or cut a recorded matching merge tree",
+        epilog="example: python mmc/merge_tree.py cut --tree new_clusters/seq_000_camera_1_tree.npz "
+               "--tau 0.9 --output seq_000_camera_1_results.pkl",
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    info = subparsers.add_parser('info', help="print tree statistics")
+    info.add_argument('--tree', required=True)
+
+    cut = subparsers.add_parser('cut', help="cut the tree and write a results pickle")
+    cut.add_argument('--tree', required=True)
+    cut.add_argument('--tau', type=float)
+    cut.add_argument('--tau-same-seq', type=float)
+    cut.add_argument('--tau-diff-seq', type=float)
+    cut.add_argument('--output', required=True)
+
+    args = parser.parse_args()
+    tree = MergeTree.load(args.tree)
+
+    if args.command == 'info':
+        print(f"Stage: {tree.stage}")
+        print(f"Items: {tree.n_items}, tracks: {len(tree.item_keys)}, merges: {len(tree.merges)}")
+        print(f"Floor: {tree.floor}, ReID weight: {tree.w_reid}")
+        if len(tree.sims):
+            print(f"Merge similarity range: {tree.sims.min():.4f} - {tree.sims.max():.4f}")
+        return
+
+    if args.tau_same_seq is not None and args.tau_diff_seq is not None and args.tau_same_seq != args.tau_diff_seq:
+        print("Warning: two different thresholds give a conservative cut, rerun the matching for exact results")
+
+    start = time.perf_counter()
+    results = tree.save_cut(args.output, tau=args.tau, tau_same_seq=args.tau_same_seq, tau_diff_seq=args.tau_diff_seq)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"Found {len(results)} clusters in {elapsed:.1f} ms")
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+
+from embedding_store import EmbeddingStore, encode_keys, read_feature_pickle
+from exclusions import load_exclusions
+
+# Node matrix (one .npz per set of inputs, `{cache_dir}/nodes_{key}.npz`):
+#   node_reid, node_clip   (N, D) L2-normalized mean embedding of each node's tracks
+#   node_seq, node_cam     (N,) sequence and camera of each node
+#   track_keys             (T, 3) (seq_id, cam_id, obj_id) of every track, grouped by node
+#   track_offsets          (N + 1,) tracks of node i are track_keys[offsets[i]:offsets[i + 1]]
+# A node is one single-camera cluster (new_clusters/results/seq_xxx_camera_y_results.pkl).
+# The cache key hashes the path, size and mtime of every input file plus the options,
+# so any rewritten cluster or feature file, store or exclusion set gives a new matrix.
+NODE_MATRIX_VERSION = 1
+CAMERAS = ('camera_1', 'camera_2', 'camera_3', 'camera_4', 'camera_5', 'camera_6', 'camera_7')
+
+
+def segment_mean(vectors, offsets):
+    """L2-normalized mean of each row segment [offsets[i], offsets[i + 1]) of `vectors`."""
+    vectors = np.asarray(vectors)
+    if len(offsets) < 2:
+        return np.zeros((0, vectors.shape[1]), dtype=vectors.dtype)
+    sums = np.add.reduceat(vectors.astype(np.float64), offsets[:-1], axis=0)
+    sums /= np.linalg.norm(sums, axis=1, keepdims=True)
+    return sums.astype(vectors.dtype)
+
+
+def node_inputs(clusters_dir='new_clusters', feature_dir='data/new_feature_objects', seq_ids=None,
+                embedding_store=None):
+    """[(seq_id, cam_id, cluster_file, feature_file)] of every camera with clusters and features."""
+    inputs = []
+    for seq_name in sorted(os.listdir(clusters_dir)):
+        seq_path = os.path.join(clusters_dir, seq_name)
+        if not seq_name.startswith('seq_') or not os.path.isdir(seq_path):
+            continue
+        seq_id = int(seq_name.split('_')[-1])
+        if seq_ids is not None and seq_id not in seq_ids:
+            continue
+        for cam in CAMERAS:
+            cluster_file = os.path.join(clusters_dir, 'results', f'{seq_name}_{cam}_results.pkl')
+            feature_file = os.path.join(feature_dir, seq_name, f"{seq_name}_{cam}.pkl")
+            if not os.path.exists(cluster_file):
+                continue
+            if embedding_store is None and not os.path.exists(feature_file):
+                continue
+            inputs.append((seq_id, int(cam.split('_')[-1]), cluster_file, feature_file))
+    return inputs
+
+
+def node_cache_key(inputs, embedding_store=None, exclusions=None):
+    """Hash of the input files (path, size, mtime) and options of a node matrix."""
+    files = [cluster_file for _, _, cluster_file, _ in inputs]
+    if embedding_store is None:
+        files += [feature_file for _, _, _, feature_file in inputs]
+    else:
+        files += [os.path.join(embedding_store, name) for name in sorted(os.listdir(embedding_store))]
+    if exclusions is not None and os.path.exists(exclusions):
+        files.append(exclusions)
+
+    h = hashlib.sha1(json.dumps([NODE_MATRIX_VERSION, embedding_store, exclusions]).encode())
+    for path in files:
+        stat = os.stat(path)
+        h.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return h.hexdigest()[:16]
+
+
+def _lookup_rows(sorted_codes, sorted_rows, keys):
+    codes = encode_keys(keys)
+    pos = np.minimum(np.searchsorted(sorted_codes, codes), max(len(sorted_codes) - 1, 0))
+    if not len(sorted_codes) or not np.array_equal(sorted_codes[pos], codes):
+        raise KeyError("Cluster tracks missing from the feature file")
+    return sorted_rows[pos]
+
+
+def build_node_matrix(inputs, embedding_store=None, exclusions=None):
+    """
+    Node matrix (see the layout above) of the cameras in `inputs`, with one
+    vectorized segment mean per camera instead of a Python mean per node.
+    """
+    store = EmbeddingStore(embedding_store) if embedding_store is not None else None
+    excluded = load_exclusions(exclusions)
+
+    reid, clip, node_seq, node_cam, track_keys, sizes = [], [], [], [], [], []
+    for seq_id, cam_id, cluster_file, feature_file in inputs:
+        with open(cluster_file, "rb") as f:
+            clusters = [cluster for cluster in pickle.load(f) if len(cluster)]
+        keys = np.asarray([key for cluster in clusters for key in cluster], dtype=np.int64).reshape(-1, 3)
+        counts = np.asarray([len(cluster) for cluster in clusters], dtype=np.int64)
+        if excluded is not None and len(excluded) and len(keys):
+            keep = ~excluded.mask(keys)
+            counts = np.add.reduceat(keep.astype(np.int64), np.cumsum(counts) - counts)
+            keys = keys[keep]
+            counts = counts[counts > 0]
+        if not len(counts):
+            continue
+
+        if store is not None:
+            rows = store.rows(keys)
+            reid_rows, clip_rows = store.take('reid', rows), store.take('clip', rows)
+        else:
+            file_keys, vectors = read_feature_pickle(feature_file)
+            codes = encode_keys(file_keys)
+            order = np.argsort(codes, kind='stable')
+            rows = _lookup_rows(codes[order], order, keys)
+            reid_rows, clip_rows = vectors['reid'][rows], vectors['clip'][rows]
+
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        reid.append(segment_mean(reid_rows, offsets))
+        clip.append(segment_mean(clip_rows, offsets))
+        node_seq.append(np.full(len(counts), seq_id, dtype=np.int32))
+        node_cam.append(np.full(len(counts), cam_id, dtype=np.int32))
+        track_keys.append(keys)
+        sizes.append(counts)
+
+    if not sizes:
+        dims = store.meta['dims'] if store is not None else {'reid': 0, 'clip': 0}
+        return {
+            'node_reid': np.zeros((0, dims['reid']), dtype=np.float32),
+            'node_clip': np.zeros((0, dims['clip']), dtype=np.float32),
+            'node_seq': np.zeros(0, dtype=np.int32),
+            'node_cam': np.zeros(0, dtype=np.int32),
+            'track_keys': np.zeros((0, 3), dtype=np.int64),
+            'track_offsets': np.zeros(1, dtype=np.int64),
+        }
+    return {
+        'node_reid': np.ascontiguousarray(np.concatenate(reid)),
+        'node_clip': np.ascontiguousarray(np.concatenate(clip)),
+        'node_seq': np.concatenate(node_seq),
+        'node_cam': np.concatenate(node_cam),
+        'track_keys': np.concatenate(track_keys),
+        'track_offsets': np.concatenate([[0], np.cumsum(np.concatenate(sizes))]).astype(np.int64),
+    }
+
+
+def load_node_matrix(seq_ids=None, embedding_store=None, exclusions=None, clusters_dir='new_clusters',
+                     feature_dir='data/new_feature_objects', cache_dir='new_clusters/node_cache'):
+    """
+    Node matrix of the single-camera clusters, read from `cache_dir` when the
+    inputs are unchanged and built (then cached) otherwise. cache_dir=None
+    always builds.
+    """
+    inputs = node_inputs(clusters_dir, feature_dir, seq_ids, embedding_store)
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, f"nodes_{node_cache_key(inputs, embedding_store, exclusions)}.npz")
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as data:
+                matrix = {name: data[name] for name in data.files}
+            print(f"Node matrix from cache: {cache_path}")
+            return matrix
+
+    matrix = build_node_matrix(inputs, embedding_store, exclusions)
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path + '.tmp', 'wb') as f:
+            np.savez(f, **matrix)
+        os.replace(cache_path + '.tmp', cache_path)
+    return matrix
@@ -0,0 +1,409 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from crop_catalog import CameraCrops
+from exclusions import ExclusionSet
+from gallery import GALLERY_MODES
+from maching_cam import CAMERAS, _run_matching_job, list_sequences
+from matching_seq import organize_global_images, run_global_matching
+
+# Stage 1 as a DAG; every stage reads the outputs of the stages before it:
+#   exclusions  per (seq, cam)  crops                     -> 'single_image' keys of the camera in the exclusion set
+#   cluster     per (seq, cam)  metadata, features,       -> new_clusters/results/{seq}_{cam}_results.pkl,
+#                               crops, excluded keys         new_clusters/{seq}/{cam}/ image folders
+#   global      site            cluster results,          -> global results file, global ID galleries
+#                               features, exclusions         (only the IDs that changed are rewritten)
+#   upload      site            global results, metadata, -> Qdrant collection (database/upload_data.py)
+#                               features, exclusions
+# The tracking notebook's metadata, feature and crop files are the sources.
+# State file (JSON): for every stage and partition, the digest of its inputs and its
+# outputs when it last succeeded, plus a (size, mtime) -> sha1 cache of file contents.
+# A partition runs again when its input digest changed or one of its outputs is gone.
+PIPELINE_STATE_VERSION = 1
+STAGES = ('exclusions', 'cluster', 'global', 'upload')
+SITE = 'site'
+SINGLE_IMAGE = 'single_image'
+
+# Stage 2 reads these fixed locations (see matching_seq.load_nodes_from_clusters)
+CLUSTERS_DIR = 'new_clusters'
+FEATURE_DIR = 'data/new_feature_objects'
+
+# Same settings as the maching_cam.py / matching_seq.py CLIs
+CLUSTER_PARAMS = dict(tau=0.875, w_reid=0.7, engine='heap', precision='float32')
+GLOBAL_PARAMS = dict(tau_same_seq=0.9, tau_diff_seq=0.95, w_reid=0.75, engine='heap', precision='float32')
+
+
+def digest(value):
+    """Hash of a JSON-serializable value."""
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+def hash_file(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Fingerprints:
+    """
+    File fingerprints: the sha1 of the content ('content') or the size and mtime
+    ('mtime'). Content hashes are cached by (size, mtime) in `cache`, so a file is
+    only read again after it was written; touching a file without changing it
+    does not make its consumers run again.
+    """
+
+    def __init__(self, mode='content', cache=None):
+        if mode not in ('content', 'mtime'):
+            raise ValueError(f"Unknown fingerprint mode: {mode}")
+        self.mode = mode
+        self.cache = cache if cache is not None else {}
+
+    def file(self, path):
+        """Fingerprint of a file, None if it does not exist."""
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        if self.mode == 'mtime':
+            return f"{stat.st_size}:{stat.st_mtime_ns}"
+        key = os.path.abspath(path)
+        cached = self.cache.get(key)
+        if cached is None or cached[:2] != [stat.st_size, stat.st_mtime_ns]:
+            cached = [stat.st_size, stat.st_mtime_ns, hash_file(path)]
+            self.cache[key] = cached
+        return cached[2]
+
+
+class Pipeline:
+    """
+    Stage 1 orchestrator: runs the stages in order and, inside each stage, only
+    the (seq, cam) partitions whose inputs changed since their last success.
+    Cluster partitions run in parallel on `workers` processes.
+    """
+
+    def __init__(self, state_path='data/pipeline_state.json', fingerprint='content', workers=None,
+                 crops_dir='data/crops', metadata_dir='data/new_metadata_objects',
+                 exclusions='data/exclusions.npz', min_crops=2, global_output_dir='data/global_ids_2',
+                 results_file='global_matching_results_2.pkl', gallery_mode='copy',
+                 collection_name='person_retrieval', force=False, dry_run=False):
+        self.state_path = state_path
+        self.workers = workers
+        self.crops_dir = crops_dir
+        self.metadata_dir = metadata_dir
+        self.exclusions = exclusions
+        self.min_crops = min_crops
+        self.global_output_dir = global_output_dir
+        self.results_file = results_file
+        self.gallery_mode = gallery_mode
+        self.collection_name = collection_name
+        self.force = force
+        self.dry_run = dry_run
+
+        self.state = {'version': PIPELINE_STATE_VERSION, 'files': {}, 'stages': {}}
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+            if state.get('version') == PIPELINE_STATE_VERSION:
+                self.state = state
+        self.fingerprints = Fingerprints(fingerprint, self.state['files'])
+
+    def save(self):
+        if self.dry_run:
+            return
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.state_path + '.tmp', 'w') as f:
+            json.dump(self.state, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    # ----- partitions and paths -----
+
+    def metadata_path(self, seq, cam):
+        return os.path.join(self.metadata_dir, seq, f"{seq}_{cam}.txt")
+
+    def feature_path(self, seq, cam):
+        return os.path.join(FEATURE_DIR, seq, f"{seq}_{cam}.pkl")
+
+    def results_path(self, seq, cam):
+        return os.path.join(CLUSTERS_DIR, 'results', f"{seq}_{cam}_results.pkl")
+
+    def partitions(self):
+        """(seq, cam) with metadata or features, plus those that ran before (their inputs may be gone)."""
+        parts = set()
+        for seq in set(list_sequences(self.metadata_dir)) | set(list_sequences(FEATURE_DIR)):
+            for cam in CAMERAS:
+                if os.path.exists(self.metadata_path(seq, cam)) or os.path.exists(self.feature_path(seq, cam)):
+                    parts.add((seq, cam))
+        for stage in ('exclusions', 'cluster'):
+            parts.update(tuple(p.split('/')) for p in self.state['stages'].get(stage, {}))
+        return sorted(parts)
+
+    def camera_crops(self, seq, cam):
+        return CameraCrops(os.path.join(self.crops_dir, seq, cam))
+
+    def crops_digest(self, crops):
+        return digest(sorted([obj_id, [name for _, name in crops.crops(obj_id)]] for obj_id in crops.index))
+
+    def excluded_objects(self, exclusions, seq, cam, reason=None):
+        seq_id, cam_id = int(seq.split('_')[-1]), int(cam.split('_')[-1])
+        mask = (exclusions.keys[:, 0] == seq_id) & (exclusions.keys[:, 1] == cam_id)
+        if reason is not None:
+            mask &= exclusions.reasons == reason
+        return sorted(exclusions.keys[mask, 2].tolist())
+
+    # ----- bookkeeping -----
+
+    def outdated(self, stage, partition, inputs):
+        record = self.state['stages'].get(stage, {}).get(partition)
+        if self.force or record is None or record['inputs'] != inputs:
+            return True
+        return any(not os.path.exists(path) for path in record['outputs'])
+
+    def done(self, stage, partition, inputs, outputs, **extra):
+        self.state['stages'].setdefault(stage, {})[partition] = dict(
+            inputs=inputs, outputs=[path for path in outputs if os.path.exists(path)],
+            finished=time.strftime('%Y-%m-%d %H:%M:%S'), **extra
+        )
+        self.save()
+
+    # ----- stages -----
+
+    def run_exclusions(self):
+        """Keep the 'single_image' keys (fewer than `min_crops` crops) of every camera in the exclusion set."""
+        exclusions = ExclusionSet(self.exclusions)
+        changed = []
+        for seq, cam in self.partitions():
+            counts = sorted(self.camera_crops(seq, cam).counts().items())
+            inputs = digest([counts, self.min_crops])
+            partition = f"{seq}/{cam}"
+            if not self.outdated('exclusions', partition, inputs):
+                continue
+            changed.append(partition)
+            if self.dry_run:
+                continue
+
+            seq_id, cam_id = int(seq.split('_')[-1]), int(cam.split('_')[-1])
+            single = {obj_id for obj_id, count in counts if count < self.min_crops}
+            before = set(self.excluded_objects(exclusions, seq, cam, SINGLE_IMAGE))
+            if before - single:
+                exclusions.remove([(seq_id, cam_id, obj_id) for obj_id in sorted(before - single)])
+            if single - before:
+                exclusions.add([(seq_id, cam_id, obj_id) for obj_id in sorted(single - before)], SINGLE_IMAGE)
+            print(f"  {partition}: {len(single)} single-image tracks excluded")
+            self.done('exclusions', partition, inputs, [self.exclusions])
+        return changed, []
+
+    def cluster_inputs(self, seq, cam, exclusions):
+        return digest([
+            self.fingerprints.file(self.metadata_path(seq, cam)),
+            self.fingerprints.file(self.feature_path(seq, cam)),
+            self.crops_digest(self.camera_crops(seq, cam)),
+            self.excluded_objects(exclusions, seq, cam),
+            CLUSTER_PARAMS,
+        ])
+
+    def run_cluster(self):
+        """Single-camera matching of the changed (seq, cam) partitions, in parallel."""
+        exclusions = ExclusionSet(self.exclusions)
+        jobs = {}
+        for seq, cam in self.partitions():
+            inputs = self.cluster_inputs(seq, cam, exclusions)
+            if self.outdated('cluster', f"{seq}/{cam}", inputs):
+                jobs[(seq, cam)] = inputs
+        if self.dry_run or not jobs:
+            return [f"{seq}/{cam}" for seq, cam in jobs], []
+
+        log_dir = os.path.join(CLUSTERS_DIR, 'logs')
+        os.makedirs(log_dir, exist_ok=True)
+        kwargs = dict(
+            crops_dir=self.crops_dir, feature_dir=FEATURE_DIR, meatadata_dir=self.metadata_dir,
+            output_dir=CLUSTERS_DIR, results_dir=os.path.join(CLUSTERS_DIR, 'results'),
+            exclusions=self.exclusions if os.path.exists(self.exclusions) else None, **CLUSTER_PARAMS
+        )
+        for seq, cam in jobs:
+            # Outputs of the previous run; stale results must not reach the global stage
+            shutil.rmtree(os.path.join(CLUSTERS_DIR, seq, cam), ignore_errors=True)
+            if os.path.exists(self.results_path(seq, cam)):
+                os.remove(self.results_path(seq, cam))
+
+        changed, failed = [], []
+
+        def finish(record):
+            seq, cam = record['seq'], record['cam']
+            partition = f"{seq}/{cam}"
+            print(f"  {partition}: {record['status']} in {record['seconds']:.2f}s")
+            if record['status'] == 'failed':
+                failed.append(partition)
+                return
+            changed.append(partition)
+            self.done('cluster', partition, jobs[(seq, cam)],
+                      [self.results_path(seq, cam), os.path.join(CLUSTERS_DIR, seq, cam)],
+                      n_clusters=record['n_clusters'])
+
+        args = [(seq, cam, os.path.join(log_dir, f"{seq}_{cam}.log"), kwargs) for seq, cam in jobs]
+        if self.workers == 1:
+            for job in args:
+                finish(_run_matching_job(*job))
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(_run_matching_job, *job): job for job in args}
+                for future in as_completed(futures):
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        # The worker itself died (e.g. BrokenProcessPool after an OOM kill)
+                        seq, cam, log_path, _ = futures[future]
+                        record = {'seq': seq, 'cam': cam, 'log': log_path, 'status': 'failed',
+                                  'error': f"{type(e).__name__}: {e}", 'seconds': 0.0}
+                    finish(record)
+        return changed, failed
+
+    def site_files(self):
+        """Fingerprints of the per-camera files the site-wide stages read."""
+        files = {}
+        for seq, cam in self.partitions():
+            for path in (self.metadata_path(seq, cam), self.feature_path(seq, cam), self.results_path(seq, cam)):
+                fingerprint = self.fingerprints.file(path)
+                if fingerprint is not None:
+                    files[path] = fingerprint
+        files[self.exclusions] = self.fingerprints.file(self.exclusions)
+        return files
+
+    def run_global(self):
+        """Global matching; only the galleries of global IDs whose tracks or crops changed are rewritten."""
+        settings = dict(GLOBAL_PARAMS, gallery_mode=self.gallery_mode, output_dir=self.global_output_dir)
+        crops = {f"{seq}/{cam}": self.crops_digest(self.camera_crops(seq, cam)) for seq, cam in self.partitions()}
+        inputs = digest([self.site_files(), crops, settings])
+        if not self.outdated('global', SITE, inputs):
+            return [], []
+        if self.dry_run:
+            return [SITE], []
+
+        record = self.state['stages'].get('global', {}).get(SITE)
+        same_settings = record is not None and record.get('settings') == digest(settings) and not self.force
+        exclusions = self.exclusions if os.path.exists(self.exclusions) else None
+        global_clusters = run_global_matching(
+            crops_base_dir=self.crops_dir,
+            output_dir=self.global_output_dir,
+            results_file=self.results_file,
+            exclusions=exclusions,
+            gallery_mode=self.gallery_mode,
+            only_changed_galleries=same_settings,
+            **GLOBAL_PARAMS
+        )
+        if global_clusters is None:
+            return [], [SITE]
+
+        if same_settings:
+            # Same tracks but new crop files: refresh the galleries holding those cameras
+            cameras = {
+                (int(p.split('/')[0].split('_')[-1]), int(p.split('/')[1].split('_')[-1]))
+                for p, value in crops.items() if record.get('crops', {}).get(p) != value
+            }
+            global_ids = {
+                global_id for global_id, tracks in enumerate(global_clusters)
+                if any((seq_id, cam_id) in cameras for seq_id, cam_id, _ in tracks)
+            }
+            if global_ids:
+                organize_global_images(global_clusters, self.crops_dir, self.global_output_dir,
+                                       global_ids=global_ids, mode=self.gallery_mode)
+
+        self.done('global', SITE, inputs, [self.results_file, self.global_output_dir],
+                  settings=digest(settings), crops=crops)
+        return [SITE], []
+
+    def run_upload(self):
+        """Re-create the Qdrant collection from the global results (needs qdrant_client)."""
+        inputs = digest([self.site_files(), self.fingerprints.file(self.results_file), self.collection_name])
+        if not self.outdated('upload', SITE, inputs):
+            return [], []
+        if self.dry_run:
+            return [SITE], []
+
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database"))
+        from upload_data import run_upload
+
+        run_upload(
+            self.results_file, feature_root=FEATURE_DIR, metadata_root=self.metadata_dir,
+            exclusions=self.exclusions if os.path.exists(self.exclusions) else None,
+            collection_name=self.collection_name
+        )
+        self.done('upload', SITE, inputs, [])
+        return [SITE], []
+
+    def run(self, stages=STAGES[:3]):
+        """
+        Run `stages` in DAG order.
+
+        Returns:
+            {stage: (partitions run, partitions failed)}; a failure stops the later stages
+        """
+        report = {}
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            start = time.perf_counter()
+            print(f"[{stage}]")
+            changed, failed = getattr(self, f"run_{stage}")()
+            report[stage] = (changed, failed)
+            verb = 'outdated' if self.dry_run else 'ran'
+            print(f"[{stage}] {len(changed)} partitions {verb}, {len(failed)} failed "
+                  f"in {time.perf_counter() - start:.2f}s")
+            if failed:
+                print(f"[{stage}] failed: {', '.join(failed)}; later stages not run")
+                break
+            if self.dry_run and changed:
+                # Later fingerprints depend on outputs that would be rewritten
+                print(f"  later stages depend on these outputs and are not checked in a dry run")
+                break
+        self.save()
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stage 1 pipeline: re-run only what changed")
+    parser.add_argument('--stages', default='exclusions,cluster,global',
+                        help=f"comma-separated stages to run, of {','.join(STAGES)}")
+    parser.add_argument('--state', default='data/pipeline_state.json')
+    parser.add_argument('--fingerprint', choices=('content', 'mtime'), default='content',
+                        help="detect changed files by content hash or by size and mtime")
+    parser.add_argument('--workers', type=int, default=None, help="parallel cluster partitions (default: all cores)")
+    parser.add_argument('--crops-dir', default='data/crops')
+    parser.add_argument('--metadata-dir', default='data/new_metadata_objects')
+    parser.add_argument('--exclusions', default='data/exclusions.npz')
+    parser.add_argument('--min-crops', type=int, default=2,
+                        help="tracks with fewer crops are excluded as 'single_image'")
+    parser.add_argument('--global-output-dir', default='data/global_ids_2')
+    parser.add_argument('--results-file', default='global_matching_results_2.pkl')
+    parser.add_argument('--gallery-mode', choices=GALLERY_MODES, default='copy')
+    parser.add_argument('--collection', default='person_retrieval')
+    parser.add_argument('--force', action='store_true', help="run every partition of the selected stages")
+    parser.add_argument('--dry-run', action='store_true', help="only list the partitions that would run")
+    args = parser.parse_args()
+
+    stages = args.stages.split(',')
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+
+    pipeline = Pipeline(
+        state_path=args.state, fingerprint=args.fingerprint, workers=args.workers, crops_dir=args.crops_dir,
+        metadata_dir=args.metadata_dir, exclusions=args.exclusions, min_crops=args.min_crops,
+        global_output_dir=args.global_output_dir, results_file=args.results_file,
+        gallery_mode=args.gallery_mode, collection_name=args.collection, force=args.force, dry_run=args.dry_run
+    )
+    report = pipeline.run(stages)
+    if any(failed for _, failed in report.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+import argparse
+import time
+
+import numpy as np
+
+# Embeddings can be scanned in lower precision:
+#   float32   the vectors as they are
+#   float16   half-precision codes
+#   int8      codes in [-127, 127] with one float32 scale per vector (x ≈ codes * scale)
+# Only the codes, scales and per-vector norms are kept. Products are taken tile by tile
+# on the codes, upcast to float32 for the tile only (numpy has no fast float16 / int8
+# GEMM; int8 tile products are exact in float32), and int8 tiles are scaled afterwards
+# by the outer product of the scales. Every vector also keeps the norm of its
+# quantization error, which bounds the error of any dot product it takes part in, so
+# candidates above a threshold are found without misses and then rescored exactly
+# from the source rows, fetching only the candidates.
+PRECISIONS = ('float32', 'float16', 'int8')
+_EPS = 1e-5
+
+
+def quantize_int8(vectors):
+    """Symmetric per-vector int8 quantization: (codes (N, D) int8, scales (N,) float32), x ≈ codes * scale."""
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    scales = np.abs(vectors).max(axis=1) / 127.0 if vectors.size else np.zeros(len(vectors), dtype=np.float32)
+    scales[scales == 0] = 1.0
+    return np.rint(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+class FusedRows:
+    """Row view of the fused vectors (mmc/fusion.py), fused on access instead of materialized."""
+
+    def __init__(self, reid_embs, clip_embs, w_reid=0.7):
+        self.reid_embs, self.clip_embs, self.w_reid = reid_embs, clip_embs, w_reid
+
+    def __len__(self):
+        return len(self.reid_embs)
+
+    def __getitem__(self, index):
+        from fusion import fuse_embeddings
+
+        return fuse_embeddings(self.reid_embs[index], self.clip_embs[index], self.w_reid)
+
+
+class QuantizedMatrix:
+    """
+    (N, D) embeddings held as `precision` codes, with per-row norms and quantization
+    error norms. `vectors` is any row-indexable source (array, memmap, FusedRows);
+    it is read `chunk_size` rows at a time and not kept.
+    """
+
+    def __init__(self, vectors, precision='int8', chunk_size=8192):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}")
+        self.precision = precision
+        codes, scales, norms, errors = [], [], [], []
+        for start in range(0, len(vectors), chunk_size):
+            block = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+            if precision == 'int8':
+                block_codes, block_scales = quantize_int8(block)
+                approx = block_codes.astype(np.float32) * block_scales[:, None]
+                scales.append(block_scales)
+            else:
+                block_codes = block.astype(precision)
+                approx = block_codes.astype(np.float32)
+            codes.append(block_codes)
+            norms.append(np.linalg.norm(block, axis=1))
+            errors.append(np.linalg.norm(approx - block, axis=1))
+        dim = codes[0].shape[1] if codes else 0
+        self.codes = np.concatenate(codes) if codes else np.zeros((0, dim), dtype=precision)
+        self.scales = (np.concatenate(scales) if scales else np.zeros(0, dtype=np.float32)) \
+            if precision == 'int8' else None
+        self.norms = np.concatenate(norms) if norms else np.zeros(0, dtype=np.float32)
+        self.errors = np.concatenate(errors) if errors else np.zeros(0, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def rows(self, index):
+        """float32 vectors of `index` (a slice or row indices)."""
+        if self.scales is None:
+            return self.codes[index].astype(np.float32)
+        return self.codes[index].astype(np.float32) * self.scales[index, None]
+
+    def product(self, rows, cols):
+        """Approximate (rows, cols) dot products from the codes; int8 tiles are scaled after the product."""
+        tile = self.codes[rows].astype(np.float32) @ self.codes[cols].astype(np.float32).T
+        if self.scales is not None:
+            tile *= self.scales[rows][:, None]
+            tile *= self.scales[cols][None, :]
+        return tile
+
+
+def quantize_embeddings(reid_embs, clip_embs, w_reid=0.7, precision='int8', fused=False):
+    """
+    Low-precision scan copy as [(QuantizedMatrix, weight)]: the fused vectors
+    (mmc/fusion.py) with weight 1, or ReID and CLIP with w_reid and 1 - w_reid.
+    """
+    if fused:
+        return [(QuantizedMatrix(FusedRows(reid_embs, clip_embs, w_reid), precision), 1.0)]
+    return [(QuantizedMatrix(reid_embs, precision), w_reid), (QuantizedMatrix(clip_embs, precision), 1.0 - w_reid)]
+
+
+def approximate_tile(scan, rows, cols):
+    """
+    Approximate similarities of `rows` x `cols` (slices or indices) from a scan
+    copy, and an upper bound of their absolute error.
+    """
+    sims, bound = None, None
+    for matrix, weight in scan:
+        na, nb = matrix.norms[rows][:, None], matrix.norms[cols][None, :]
+        ea, eb = matrix.errors[rows][:, None], matrix.errors[cols][None, :]
+        # |a'b' - ab| <= |e_a||b| + |a||e_b| + |e_a||e_b|
+        tile = weight * matrix.product(rows, cols)
+        err = weight * (ea * nb + na * eb + ea * eb)
+        sims = tile if sims is None else sims + tile
+        bound = err if bound is None else bound + err
+    return sims, bound + _EPS
+
+
+def exact_pair_similarity(reid_embs, clip_embs, rows, cols, w_reid=0.7, chunk_size=8192):
+    """
+    w·<reid_i, reid_j> + (1-w)·<clip_i, clip_j> for the pairs (rows[k], cols[k]).
+    Only the distinct rows of each chunk are fetched from the sources, so
+    memory-mapped or store-backed matrices are read for the candidates alone.
+    """
+    rows, cols = np.asarray(rows).reshape(-1), np.asarray(cols).reshape(-1)
+    sims = np.empty(len(rows), dtype=np.float32)
+    for start in range(0, len(rows), chunk_size):
+        r, c = rows[start:start + chunk_size], cols[start:start + chunk_size]
+        ids, inverse = np.unique(np.concatenate([r, c]), return_inverse=True)
+        ri, ci = inverse[:len(r)], inverse[len(r):]
+        reid = np.asarray(reid_embs[ids], dtype=np.float32)
+        clip = np.asarray(clip_embs[ids], dtype=np.float32)
+        sims[start:start + chunk_size] = (
+            w_reid * np.einsum('ij,ij->i', reid[ri], reid[ci])
+            + (1.0 - w_reid) * np.einsum('ij,ij->i', clip[ri], clip[ci])
+        )
+    return sims
+
+
+def similarity_candidates(reid_embs, clip_embs, w_reid=0.7, precision='int8', min_sim=0.0, fused=False,
+                          block_size=1024):
+    """
+    Pairs whose weighted similarity is above `min_sim`, scanned in `precision`:
+    every pair whose approximation plus error bound can exceed `min_sim` is
+    rescored exactly, so no pair above it is missed and none below it is kept.
+    Clustering that only merges pairs above `min_sim` (`agglomerate_sparse`)
+    therefore merges exactly as on the float32 matrix.
+
+    Returns:
+        (rows, cols, sims) with rows < cols and exact similarities
+    """
+    n = len(reid_embs)
+    scan = quantize_embeddings(reid_embs, clip_embs, w_reid, precision, fused)
+    all_rows, all_cols, all_sims = [], [], []
+    n_rescored = 0
+    for start in range(0, n, block_size):
+        rows = slice(start, min(start + block_size, n))
+        for col_start in range(start, n, block_size):
+            cols = slice(col_start, min(col_start + block_size, n))
+            approx, bound = approximate_tile(scan, rows, cols)
+            candidate = approx + bound > min_sim
+            if col_start == start:
+                candidate &= np.triu(np.ones(candidate.shape, dtype=bool), 1)
+            r, c = np.nonzero(candidate)
+            r, c = r + rows.start, c + cols.start
+            sims = exact_pair_similarity(reid_embs, clip_embs, r, c, w_reid)
+            keep = sims > min_sim
+            all_rows.append(r[keep])
+            all_cols.append(c[keep])
+            all_sims.append(sims[keep])
+            n_rescored += len(r)
+    print(f"  {precision} similarity: {n_rescored} of {n * (n - 1) // 2} pairs rescored exactly")
+    if not all_rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    return (np.concatenate(all_rows).astype(np.int64), np.concatenate(all_cols).astype(np.int64),
+            np.concatenate(all_sims))
+
+
+def topk_quantized(reid_embs, clip_embs, w_reid, k, block_size, fused=False, precision='int8', rescore_k=None):
+    """
+    `knn_graph` search on a low-precision scan copy: each row block is scored
+    against the codes one column tile at a time, the `rescore_k` (default 2k)
+    best approximate neighbors per row are rescored exactly and the k best kept.
+    """
+    n = len(reid_embs)
+    scan = quantize_embeddings(reid_embs, clip_embs, w_reid, precision, fused)
+    m = max(k, min(rescore_k or 2 * k, n - 1))
+    for start in range(0, n, block_size):
+        rows = slice(start, min(start + block_size, n))
+        approx = np.empty((rows.stop - start, n), dtype=np.float32)
+        for col_start in range(0, n, block_size):
+            cols = slice(col_start, min(col_start + block_size, n))
+            approx[:, cols] = approximate_tile(scan, rows, cols)[0]
+        approx[np.arange(rows.stop - start), np.arange(start, rows.stop)] = -np.inf
+
+        cols = np.argpartition(-approx, m - 1, axis=1)[:, :m] if m < n - 1 else \
+            np.broadcast_to(np.arange(n), approx.shape)
+        row_ids = np.broadcast_to(np.arange(start, rows.stop)[:, None], cols.shape)
+        sims = exact_pair_similarity(reid_embs, clip_embs, row_ids, cols, w_reid).reshape(cols.shape)
+        sims[cols == row_ids] = -np.inf
+        if k < cols.shape[1]:
+            best = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            cols, sims = np.take_along_axis(cols, best, axis=1), np.take_along_axis(sims, best, axis=1)
+        yield start, cols, sims
+
+
+def scan_bytes(n, dims, precision):
+    """Bytes of the scan copy of n vectors with the given dimensions."""
+    width = {'float32': 4, 'float16': 2, 'int8': 1}[precision]
+    return n * sum(dims) * width + (n * 4 * len(dims) if precision == 'int8' else 0)
+
+
+def pair_agreement(labels_a, labels_b):
+    """
+    (pairs together in both, pairs together in a, pairs together in b) for two
+    clusterings given as label arrays over the same items.
+    """
+    def together(*labels):
+        _, counts = np.unique(np.stack(labels, axis=1), axis=0, return_counts=True)
+        return int((counts * (counts - 1) // 2).sum())
+
+    return together(labels_a, labels_b), together(labels_a), together(labels_b)
+
+
+def cluster_labels(clusters, n):
+    labels = np.full(n, -1, dtype=np.int64)
+    for label, cluster in enumerate(clusters):
+        labels[list(cluster)] = label
+    return labels
+
+
+def precision_report(nodes, precisions=('float16', 'int8'), tau_same_seq=0.9, tau_diff_seq=0.95, w_reid=0.75,
+                     k=30, fused=False):
+    """
+    Compare global matching in each precision against float32: scan memory,
+    kNN edge recall, similarity error and the heap / kNN engine clusters.
+
+    Returns:
+        List of result rows (dicts)
+    """
+    from knn_graph import knn_graph
+    from matching_seq import (agglomerative_clustering_global_heap, agglomerative_clustering_global_knn,
+                              node_embeddings)
+
+    reid, clip = node_embeddings(nodes)
+    n = len(nodes)
+    min_sim = min(tau_same_seq, tau_diff_seq)
+    engines = {'heap': agglomerative_clustering_global_heap, 'knn': agglomerative_clustering_global_knn}
+    kwargs = dict(tau_same_seq=tau_same_seq, tau_diff_seq=tau_diff_seq, w_reid=w_reid, fused=fused)
+
+    reference = {name: cluster_labels(engine(nodes, **kwargs), n) for name, engine in engines.items()}
+    rows0, cols0, _ = knn_graph(reid, clip, w_reid, k=k, min_sim=min_sim, backend='numpy', fused=fused)
+    edges0 = set(zip(rows0.tolist(), cols0.tolist()))
+
+    report = []
+    for precision in precisions:
+        start = time.perf_counter()
+        rows, cols, sims = knn_graph(reid, clip, w_reid, k=k, min_sim=min_sim, backend='numpy', fused=fused,
+                                     precision=precision)
+        knn_seconds = time.perf_counter() - start
+        edges = set(zip(rows.tolist(), cols.tolist()))
+
+        scan = quantize_embeddings(reid, clip, w_reid, precision, fused)
+        max_error, bound_sum = 0.0, 0.0
+        for start in range(0, n, 1024):
+            rows = slice(start, min(start + 1024, n))
+            approx, bound = approximate_tile(scan, rows, slice(0, n))
+            exact = w_reid * (reid[rows] @ reid.T) + (1.0 - w_reid) * (clip[rows] @ clip.T)
+            max_error = max(max_error, float(np.abs(approx - exact).max()))
+            bound_sum += float(bound.sum())
+
+        row = {
+            'precision': precision,
+            'scan_mb': scan_bytes(n, (reid.shape[1], clip.shape[1]), precision) / 1e6,
+            'float32_mb': scan_bytes(n, (reid.shape[1], clip.shape[1]), 'float32') / 1e6,
+            'max_sim_error': max_error,
+            'mean_error_bound': bound_sum / (n * n),
+            'knn_recall': len(edges & edges0) / max(len(edges0), 1),
+            'knn_seconds': knn_seconds,
+        }
+        for name, engine in engines.items():
+            labels = cluster_labels(engine(nodes, precision=precision, **kwargs), n)
+            both, ref_pairs, new_pairs = pair_agreement(reference[name], labels)
+            row[f'{name}_clusters'] = f"{len(np.unique(labels))}/{len(np.unique(reference[name]))}"
+            row[f'{name}_identical'] = both == ref_pairs == new_pairs
+            row[f'{name}_pair_recall'] = both / max(ref_pairs, 1)
+            row[f'{name}_pair_precision'] = both / max(new_pairs, 1)
+        report.append(row)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Low-precision global matching report against float32")
+    parser.add_argument('--precision', nargs='+', choices=PRECISIONS[1:], default=['float16', 'int8'])
+    parser.add_argument('--tau-same-seq', type=float, default=0.9)
+    parser.add_argument('--tau-diff-seq', type=float, default=0.95)
+    parser.add_argument('--w-reid', type=float, default=0.75)
+    parser.add_argument('--k', type=int, default=30, help="neighbors per node for the kNN engine")
+    parser.add_argument('--fused', action='store_true')
+    parser.add_argument('--embedding-store', help="read node features from this store instead of the pickles")
+    parser.add_argument('--exclusions', help="exclusion set of tracks to leave out (see mmc/exclusions.py)")
+    args = parser.parse_args()
+
+    from matching_seq import load_nodes_from_clusters
+
+    nodes = load_nodes_from_clusters(embedding_store=args.embedding_store, exclusions=args.exclusions)
+    report = precision_report(nodes, args.precision, args.tau_same_seq, args.tau_diff_seq, args.w_reid, args.k,
+                              args.fused)
+
+    print(f"\n{len(nodes)} nodes, thresholds {args.tau_same_seq}/{args.tau_diff_seq}, w_reid {args.w_reid}")
+    for row in report:
+        print(f"{row['precision']:>8}: scan {row['scan_mb']:.2f} MB (float32 {row['float32_mb']:.2f} MB), "
+              f"max sim error {row['max_sim_error']:.5f} (mean bound {row['mean_error_bound']:.5f})")
+        print(f"          kNN edge recall {row['knn_recall']:.4f} in {row['knn_seconds']:.2f}s")
+        for name in ('heap', 'knn'):
+            print(f"          {name}: clusters {row[f'{name}_clusters']}, identical {row[f'{name}_identical']}, "
+                  f"pair recall {row[f'{name}_pair_recall']:.4f}, precision {row[f'{name}_pair_precision']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+import argparse
+import glob
+import json
+import os
+import pickle
+import socket
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from knn_graph import knn_graph
+from linkage import SeqCamConstraint, agglomerate_sparse
+from matching_seq import agglomerative_clustering_global_heap, list_cluster_sequences, load_nodes_from_clusters
+
+# Layout of the shared work directory:
+#   plan.json           shards (lists of seq ids) and matching parameters
+#   shard_{i}.lock      claimed by a worker (host, pid and a unique token inside)
+#   shard_{i}.lock.{token}.takeover  a dead worker's lock was taken over (one worker only)
+#   shard_{i}.npz       shard result: member nodes and their shard-level cluster labels
+PLAN_FILE = 'plan.json'
+
+
+def shard_path(work_dir, shard_id, ext='npz'):
+    return os.path.join(work_dir, f"shard_{shard_id:04d}.{ext}")
+
+
+def plan_shards(work_dir, seqs_per_shard=1, tau_same_seq=0.875, tau_diff_seq=0.92, w_reid=0.7, seq_ids=None,
+                exclusions=None):
+    """
+    Split the sequences with single-camera results into shards of `seqs_per_shard`
+    consecutive sequences and write the plan to `work_dir`. Results and claims
+    of a previous plan in the same directory are removed. Workers leave out the
+    tracks of the `exclusions` set (mmc/exclusions.py), so it must be readable
+    at the same path on every worker.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(work_dir, 'shard_*')):
+        os.remove(path)
+    if seq_ids is None:
+        seq_ids = list_cluster_sequences()
+    seq_ids = sorted(seq_ids)
+
+    plan = {
+        'shards': [seq_ids[i:i + seqs_per_shard] for i in range(0, len(seq_ids), seqs_per_shard)],
+        'tau_same_seq': tau_same_seq,
+        'tau_diff_seq': tau_diff_seq,
+        'w_reid': w_reid,
+        'exclusions': exclusions,
+    }
+    with open(os.path.join(work_dir, PLAN_FILE), 'w') as f:
+        json.dump(plan, f, indent=2)
+    print(f"Planned {len(plan['shards'])} shards over {len(seq_ids)} sequences in {work_dir}")
+    return plan
+
+
+def load_plan(work_dir):
+    with open(os.path.join(work_dir, PLAN_FILE)) as f:
+        return json.load(f)
+
+
+def _read_lock(lock_path):
+    """(host, pid, token) of the worker holding a lock, None if there is no readable lock."""
+    try:
+        with open(lock_path) as f:
+            fields = f.read().split()
+        host, pid = fields[0], int(fields[1])
+    except (FileNotFoundError, IndexError, ValueError):
+        return None
+    # Locks without a token (older workers) are identified by host and pid
+    return host, pid, fields[2] if len(fields) > 2 else f"{host}-{pid}"
+
+
+def _dead_owner(lock_path, stale_after=None):
+    """
+    (host, pid, token) of the worker holding a lock if it is gone: a pid on this
+    host that no longer runs, or (other hosts, whose pids cannot be checked) a
+    lock older than `stale_after` seconds. None while the owner may be alive.
+    """
+    try:
+        owner = _read_lock(lock_path)
+        age = time.time() - os.path.getmtime(lock_path)
+    except FileNotFoundError:
+        return None
+    if owner is None:
+        return None
+    host, pid, _ = owner
+    if host == socket.gethostname():
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return owner
+        except PermissionError:
+            return None
+        return None
+    return owner if stale_after is not None and age > stale_after else None
+
+
+def _claim(work_dir, shard_id, stale_after=None):
+    """
+    Atomically claim a shard; False if another live worker already has it.
+
+    The lock is written to a file of its own and hard-linked to `shard_{i}.lock`,
+    which only succeeds if there is no lock yet. Locks of dead workers (see
+    `_dead_owner`) are taken over by one worker only: the one that creates the
+    `.takeover` marker of that lock's token removes it, so a lock written after
+    the dead one is never removed by a worker that saw the dead one.
+    """
+    lock_path = shard_path(work_dir, shard_id, 'lock')
+    token = uuid.uuid4().hex
+    own_path = f"{lock_path}.{token}"
+    with open(own_path, 'w') as f:
+        f.write(f"{socket.gethostname()} {os.getpid()} {token}\n")
+    try:
+        for _ in range(2):
+            try:
+                os.link(own_path, lock_path)
+                return True
+            except FileExistsError:
+                owner = _dead_owner(lock_path, stale_after)
+                if owner is None:
+                    return False
+                try:
+                    os.close(os.open(f"{lock_path}.{owner[2]}.takeover", os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                except FileExistsError:
+                    # Another worker is taking this lock over
+                    return False
+                os.remove(lock_path)
+                print(f"Shard {shard_id}: taking over the lock of a dead worker")
+        return False
+    finally:
+        os.remove(own_path)
+
+
+def cluster_shard(work_dir, shard_id, plan):
+    """First pass: cluster the nodes of one shard and save them with their labels."""
+    nodes = load_nodes_from_clusters(seq_ids=set(plan['shards'][shard_id]), exclusions=plan.get('exclusions'))
+    clusters = agglomerative_clustering_global_heap(
+        nodes, plan['tau_same_seq'], plan['tau_diff_seq'], plan['w_reid']
+    ) if nodes else []
+
+    path = save_shard(work_dir, shard_id, nodes, clusters)
+    print(f"Shard {shard_id}: {len(nodes)} nodes -> {len(clusters)} clusters, saved to {path}")
+    return path
+
+
+def save_shard(work_dir, shard_id, nodes, clusters):
+    """Save the nodes of a shard with the label of their shard-level cluster."""
+    labels = np.empty(len(nodes), dtype=np.int64)
+    for label, cluster in enumerate(clusters):
+        labels[list(cluster)] = label
+
+    # Write next to the final name and rename, so readers never see a partial file
+    path = shard_path(work_dir, shard_id)
+    tmp_path = path + f".{os.getpid()}.tmp.npz"
+    np.savez(
+        tmp_path,
+        reid=np.stack([node.reid_average for node in nodes]).astype(np.float32) if nodes else np.zeros((0, 0)),
+        clip=np.stack([node.clip_average for node in nodes]).astype(np.float32) if nodes else np.zeros((0, 0)),
+        seq_cams=np.array([(node.seq_id, node.cam_id) for node in nodes], dtype=np.int64).reshape(-1, 2),
+        labels=labels,
+        track_keys=np.array([key for node in nodes for key in node.track_keys], dtype=np.int64).reshape(-1, 3),
+        track_offsets=np.concatenate([[0], np.cumsum([len(node.track_keys) for node in nodes])]).astype(np.int64),
+    )
+    os.replace(tmp_path, path)
+    return path
+
+
+def run_worker(work_dir, stale_after=None):
+    """
+    Process unclaimed shards of the plan until none is left. Several workers, on
+    this machine or others sharing `work_dir`, can run at the same time. A shard
+    that fails releases its lock; locks of dead workers are taken over, those of
+    other hosts once older than `stale_after` seconds.
+    """
+    plan = load_plan(work_dir)
+    done = []
+    for shard_id in range(len(plan['shards'])):
+        if os.path.exists(shard_path(work_dir, shard_id)) or not _claim(work_dir, shard_id, stale_after):
+            continue
+        try:
+            cluster_shard(work_dir, shard_id, plan)
+        except BaseException:
+            os.remove(shard_path(work_dir, shard_id, 'lock'))
+            raise
+        done.append(shard_id)
+    return done
+
+
+def merge_shards(work_dir, knn_k=30):
+    """
+    Second pass: merge the shard-level clusters across shards.
+
+    Every shard cluster is a pre-merged group; groups of different shards are
+    linked by the max similarity of their nodes (from a kNN graph over all nodes,
+    `knn_k` neighbors each) under the same thresholds and (seq, cam) veto.
+    Groups of the same shard are never merged again.
+
+    Returns:
+        Global clusters as lists of track keys (the `save_global_results` format)
+    """
+    plan = load_plan(work_dir)
+    missing = [i for i in range(len(plan['shards'])) if not os.path.exists(shard_path(work_dir, i))]
+    if missing:
+        raise FileNotFoundError(f"Shards not finished yet: {missing}")
+
+    reid, clip, seq_cams, groups, node_shards, keys = [], [], [], [], [], []
+    n_groups = 0
+    for shard_id in range(len(plan['shards'])):
+        with np.load(shard_path(work_dir, shard_id)) as data:
+            if not len(data['labels']):
+                continue
+            reid.append(data['reid'])
+            clip.append(data['clip'])
+            seq_cams.extend(map(tuple, data['seq_cams'].tolist()))
+            groups.append(data['labels'] + n_groups)
+            node_shards.append(np.full(len(data['labels']), shard_id))
+            offsets = data['track_offsets'].tolist()
+            track_keys = [tuple(key) for key in data['track_keys'].tolist()]
+            keys.extend(track_keys[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1))
+            n_groups = int(groups[-1].max()) + 1
+
+    if not groups:
+        return []
+    reid, clip = np.concatenate(reid), np.concatenate(clip)
+    groups, node_shards = np.concatenate(groups), np.concatenate(node_shards)
+
+    tau_same_seq, tau_diff_seq = plan['tau_same_seq'], plan['tau_diff_seq']
+    rows, cols, sims = knn_graph(reid, clip, plan['w_reid'], k=knn_k, min_sim=min(tau_same_seq, tau_diff_seq))
+    cross = node_shards[rows] != node_shards[cols]
+    print(f"Merging {n_groups} shard clusters from {len(plan['shards'])} shards "
+          f"({int(cross.sum())} cross-shard edges)")
+
+    group_seq_cams = [set() for _ in range(n_groups)]
+    for group, seq_cam in zip(groups.tolist(), seq_cams):
+        group_seq_cams[group].add(seq_cam)
+    constraint = SeqCamConstraint(group_seq_cams, tau_same_seq, tau_diff_seq)
+    clusters = agglomerate_sparse(n_groups, groups[rows[cross]], groups[cols[cross]], sims[cross], constraint)
+
+    group_keys = [[] for _ in range(n_groups)]
+    for group, node_keys in zip(groups.tolist(), keys):
+        group_keys[group].extend(node_keys)
+    results = [[key for group in sorted(cluster) for key in group_keys[group]] for cluster in clusters]
+    print(f"Found {len(results)} global identities")
+    return results
+
+
+def run_sharded_global_matching(
+        work_dir='data/global_shards',
+        seqs_per_shard=1,
+        workers=None,
+        tau_same_seq=0.875,
+        tau_diff_seq=0.92,
+        w_reid=0.7,
+        knn_k=30,
+        results_file='global_matching_results.pkl',
+        seq_ids=None,
+        exclusions=None
+):
+    """Plan, cluster the shards on a local process pool, merge and save the results."""
+    plan = plan_shards(work_dir, seqs_per_shard, tau_same_seq, tau_diff_seq, w_reid, seq_ids, exclusions)
+    workers = min(workers or os.cpu_count(), len(plan['shards'])) or 1
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(run_worker, work_dir) for _ in range(workers)]:
+            future.result()
+    print(f"Shards clustered in {time.perf_counter() - start:.2f}s on {workers} workers")
+
+    results = merge_shards(work_dir, knn_k)
+    with open(results_file, 'wb') as f:
+        pickle.dump(results, f)
+    print(f"Results saved to {results_file}")
+    return results
+
+
+def compare_clusterings(results, reference):
+    """
+    Agreement of two clusterings of the same track keys: identical clusters and
+    pairwise precision/recall of `results` against `reference`.
+    """
+    def labels(clusters):
+        return {tuple(key): i for i, cluster in enumerate(clusters) for key in cluster}
+
+    labels_a, labels_b = labels(results), labels(reference)
+    if labels_a.keys() != labels_b.keys():
+        raise ValueError("The clusterings do not cover the same track keys")
+
+    def n_pairs(counts):
+        counts = np.asarray(list(counts), dtype=np.int64)
+        return int((counts * (counts - 1) // 2).sum())
+
+    joint = {}
+    for key, a in labels_a.items():
+        joint[(a, labels_b[key])] = joint.get((a, labels_b[key]), 0) + 1
+    both = n_pairs(joint.values())
+    pairs_a = n_pairs(np.bincount(list(labels_a.values())))
+    pairs_b = n_pairs(np.bincount(list(labels_b.values())))
+
+    as_sets = lambda clusters: {frozenset(map(tuple, cluster)) for cluster in clusters}
+    identical = len(as_sets(results) & as_sets(reference))
+    return {
+        'clusters': len(results),
+        'reference_clusters': len(reference),
+        'identical_clusters': identical,
+        'pair_precision': both / pairs_a if pairs_a else 1.0,
+        'pair_recall': both / pairs_b if pairs_b else 1.0,
+        'exact': identical == len(results) == len(reference),
+    }
+
+
+def check_against_single_shot(seq_ids=None, seqs_per_shard=1, workers=None, tau_same_seq=0.875, tau_diff_seq=0.92,
+                              w_reid=0.7, knn_k=None, exclusions=None):
+    """
+    Run the sharded pipeline and a single-shot heap run on the same (small) input
+    and report their agreement. The default `knn_k` keeps every edge, so any
+    difference comes from the sharding itself.
+    """
+    if seq_ids is None:
+        seq_ids = list_cluster_sequences()[:3]
+    nodes = load_nodes_from_clusters(seq_ids=set(seq_ids), exclusions=exclusions)
+    clusters = agglomerative_clustering_global_heap(nodes, tau_same_seq, tau_diff_seq, w_reid)
+    reference = [[key for i in cluster for key in nodes[i].track_keys] for cluster in clusters]
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = run_sharded_global_matching(
+            os.path.join(work_dir, 'shards'), seqs_per_shard, workers, tau_same_seq, tau_diff_seq, w_reid,
+            knn_k if knn_k is not None else len(nodes), os.path.join(work_dir, 'results.pkl'), seq_ids,
+            exclusions
+        )
+
+    report = compare_clusterings(results, reference)
+    print(f"\nSharded vs single-shot on sequences {seq_ids}:")
+    print(f"  Clusters: {report['clusters']} vs {report['reference_clusters']} "
+          f"({report['identical_clusters']} identical)")
+    print(f"  Pairwise precision: {report['pair_precision']:.4f}, recall: {report['pair_recall']:.4f}")
+    print(f"  Exact match: {report['exact']}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sharded global matching: shards of sequences are clustered independently "
+                    "(local processes or workers on other machines sharing --work-dir), then merged",
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_thresholds(p):
+        p.add_argument('--tau-same-seq', type=float, default=0.875)
+        p.add_argument('--tau-diff-seq', type=float, default=0.92)
+        p.add_argument('--w-reid', type=float, default=0.7)
+        p.add_argument('--seqs-per-shard', type=int, default=1)
+        p.add_argument('--seqs', type=int, nargs='*', help="sequence ids (default: all)")
+        p.add_argument('--exclusions', help="exclusion set of tracks to leave out (see mmc/exclusions.py)")
+
+    plan = subparsers.add_parser('plan', help="write the shard plan to the work dir")
+    plan.add_argument('--work-dir', required=True)
+    add_thresholds(plan)
+
+    worker = subparsers.add_parser('worker', help="cluster unclaimed shards of the plan")
+    worker.add_argument('--work-dir', required=True)
+    worker.add_argument('--stale-after', type=float,
+                        help="take over locks of other hosts older than this many seconds")
+
+    merge = subparsers.add_parser('merge', help="merge finished shards and save the results")
+    merge.add_argument('--work-dir', required=True)
+    merge.add_argument('--knn-k', type=int, default=30)
+    merge.add_argument('--output', default='global_matching_results.pkl')
+
+    run = subparsers.add_parser('run', help="plan, cluster on a local process pool and merge")
+    run.add_argument('--work-dir', required=True)
+    run.add_argument('--workers', type=int)
+    run.add_argument('--knn-k', type=int, default=30)
+    run.add_argument('--output', default='global_matching_results.pkl')
+    add_thresholds(run)
+
+    check = subparsers.add_parser('check', help="compare the sharded and single-shot results on a few sequences")
+    check.add_argument('--workers', type=int)
+    check.add_argument('--knn-k', type=int)
+    add_thresholds(check)
+
+    args = parser.parse_args()
+    if args.command == 'plan':
+        plan_shards(args.work_dir, args.seqs_per_shard, args.tau_same_seq, args.tau_diff_seq, args.w_reid, args.seqs,
+                    args.exclusions)
+    elif args.command == 'worker':
+        done = run_worker(args.work_dir, args.stale_after)
+        print(f"Worker finished {len(done)} shards: {done}")
+    elif args.command == 'merge':
+        results = merge_shards(args.work_dir, args.knn_k)
+        with open(args.output, 'wb') as f:
+            pickle.dump(results, f)
+        print(f"Results saved to {args.output}")
+    elif args.command == 'run':
+        run_sharded_global_matching(
+            args.work_dir, args.seqs_per_shard, args.workers, args.tau_same_seq, args.tau_diff_seq, args.w_reid,
+            args.knn_k, args.output, args.seqs, args.exclusions
+        )
+    else:
+        check_against_single_shot(
+            args.seqs, args.seqs_per_shard, args.workers, args.tau_same_seq, args.tau_diff_seq, args.w_reid,
+            args.knn_k, args.exclusions
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+import argparse
+import csv
+import glob
+import itertools
+import json
+import os
+import pickle
+import tempfile
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from data_loader import load_all_data, load_metadata_file
+from linkage import TimeConstraint, SeqCamConstraint, agglomerate
+from maching_cam import build_clustering_input_weighted
+from matching_seq import load_nodes_from_clusters, node_embeddings
+from merge_tree import MergeTree
+
+CAMERAS = ['camera_1', 'camera_2', 'camera_3', 'camera_4', 'camera_5', 'camera_6', 'camera_7']
+
+
+############################################
+# IDENTITY LABELS + METRICS
+############################################
+
+def _annotation_bbox(obj):
+    """Annotation box as [x1, y1, x2, y2] from the common layouts."""
+    for key in ("bbox", "box", "xyxy"):
+        if key in obj and obj[key] is not None and len(obj[key]) == 4:
+            return [float(v) for v in obj[key]]
+    for keys in (("x1", "y1", "x2", "y2"), ("xmin", "ymin", "xmax", "ymax"), ("left", "top", "right", "bottom")):
+        if all(k in obj for k in keys):
+            return [float(obj[k]) for k in keys]
+    if all(k in obj for k in ("x", "y", "w", "h")):
+        return [float(obj["x"]), float(obj["y"]), float(obj["x"]) + float(obj["w"]), float(obj["y"]) + float(obj["h"])]
+    return None
+
+
+def _iou(box, boxes):
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def build_track_labels(annotation_dir='data/annotations', metadata_dir='data/new_metadata_objects', iou_threshold=0.5):
+    """
+    Ground-truth identity per track: every detection is matched to the annotated
+    box with the highest IoU in the same frame, and the track takes the majority id.
+
+    Annotations follow tools/temporal_filter_time.py: annotation_dir/seq_xxx/camera_<id>_*.json,
+    each mapping a frame number to a list of objects with an `id` and a box.
+
+    Returns:
+        {(seq_id, cam_id, obj_id): gt_id}
+    """
+    labels = {}
+    for seq_dir in sorted(os.listdir(annotation_dir)):
+        seq_path = os.path.join(annotation_dir, seq_dir)
+        if not os.path.isdir(seq_path):
+            continue
+
+        for file_name in sorted(os.listdir(seq_path)):
+            if not file_name.endswith('.json'):
+                continue
+            cam_id = file_name.split('_')[1]
+            metadata_path = os.path.join(metadata_dir, seq_dir, f"{seq_dir}_camera_{cam_id}.txt")
+            if not os.path.exists(metadata_path):
+                continue
+
+            with open(os.path.join(seq_path, file_name), 'r') as f:
+                annotations = json.load(f)
+            frames = {}
+            for frame_str, objects in annotations.items():
+                boxes = [(obj['id'], _annotation_bbox(obj)) for obj in objects]
+                boxes = [(gt_id, box) for gt_id, box in boxes if box is not None]
+                if boxes:
+                    frames[int(frame_str)] = ([gt_id for gt_id, _ in boxes], np.array([box for _, box in boxes]))
+
+            for key, records in load_metadata_file(metadata_path).items():
+                votes = Counter()
+                for record in records:
+                    if record['frame_id'] not in frames:
+                        continue
+                    gt_ids, boxes = frames[record['frame_id']]
+                    ious = _iou(record['bbox'], boxes)
+                    best = int(np.argmax(ious))
+                    if ious[best] >= iou_threshold:
+                        votes[gt_ids[best]] += 1
+                if votes:
+                    labels[key] = votes.most_common(1)[0][0]
+
+    print(f"Labelled {len(labels)} tracks from {annotation_dir}")
+    return labels
+
+
+def pair_counts(clusters, labels):
+    """
+    Pairwise counts over labelled tracks: (true positive pairs, predicted pairs,
+    ground-truth pairs). Counts are additive over independent partitions.
+    """
+    true_pairs = predicted_pairs = 0
+    gt_sizes = Counter()
+    for cluster in clusters:
+        ids = [labels[tuple(key)] for key in cluster if tuple(key) in labels]
+        predicted_pairs += len(ids) * (len(ids) - 1) // 2
+        true_pairs += sum(c * (c - 1) // 2 for c in Counter(ids).values())
+        gt_sizes.update(ids)
+    gt_pairs = sum(c * (c - 1) // 2 for c in gt_sizes.values())
+    return true_pairs, predicted_pairs, gt_pairs
+
+
+def pair_metrics(true_pairs, predicted_pairs, gt_pairs):
+    precision = true_pairs / predicted_pairs if predicted_pairs else 1.0
+    recall = true_pairs / gt_pairs if gt_pairs else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'pair_precision': precision, 'pair_recall': recall, 'pair_f1': f1}
+
+
+############################################
+# WORKERS (shared similarity matrices)
+############################################
+
+_SHARED = {}
+
+
+def _init_worker(shared_dir, labels):
+    _SHARED['dir'] = shared_dir
+    _SHARED['labels'] = labels
+    _SHARED['arrays'] = {}
+
+
+def _shared(name):
+    """Memory-mapped array written by the parent; pages are shared between workers."""
+    arrays = _SHARED['arrays']
+    if name not in arrays:
+        arrays[name] = np.load(os.path.join(_SHARED['dir'], f"{name}.npy"), mmap_mode='r')
+    return arrays[name]
+
+
+def _load_meta(name):
+    with open(os.path.join(_SHARED['dir'], f"{name}.pkl"), 'rb') as f:
+        return pickle.load(f)
+
+
+def _camera_task(job, w_reid, taus):
+    """Cluster one camera once down to min(taus) and cut the merge tree at every tau."""
+    reid_sim, clip_sim = _shared(f"{job}_reid_sim"), _shared(f"{job}_clip_sim")
+    intervals = _shared(f"{job}_intervals")
+    tracklet_keys = _load_meta(f"{job}_keys")
+
+    sim = w_reid * reid_sim + (1.0 - w_reid) * clip_sim
+    history = []
+    agglomerate(sim, TimeConstraint(intervals, tau=min(taus)), history=history)
+    tree = MergeTree.from_history(
+        'camera', history, [[key] for key in tracklet_keys], [key[0] for key in tracklet_keys],
+        floor=min(taus), w_reid=w_reid
+    )
+
+    labels = _SHARED['labels']
+    results = {}
+    for tau in taus:
+        clusters = tree.cluster_keys(tree.cut(tau=tau))
+        results[tau] = (len(clusters),) + (pair_counts(clusters, labels) if labels else (0, 0, 0))
+    return results
+
+
+def _global_task(w_reid, tau_same_seq, tau_diff_seq):
+    reid_sim, clip_sim = _shared("node_reid_sim"), _shared("node_clip_sim")
+    meta = _load_meta("nodes")
+
+    sim = w_reid * reid_sim + (1.0 - w_reid) * clip_sim
+    constraint = SeqCamConstraint(meta['seq_cams'], tau_same_seq, tau_diff_seq)
+    clusters = agglomerate(sim, constraint)
+    clusters = [[key for idx in cluster for key in meta['track_keys'][idx]] for cluster in clusters]
+
+    labels = _SHARED['labels']
+    return (len(clusters),) + (pair_counts(clusters, labels) if labels else (0, 0, 0))
+
+
+############################################
+# SWEEPS
+############################################
+
+def _row(base, n_clusters, counts, labels):
+    row = dict(base, n_clusters=n_clusters)
+    if labels:
+        row.update(pair_metrics(*counts))
+    return row
+
+
+def sweep_camera(w_reids, taus, feature_dir='data/new_feature_objects', metadata_dir='data/new_metadata_objects',
+                 labels=None, workers=None):
+    """
+    In-camera sweep over w_reid x tau. Features are read once, per-modality
+    similarity matrices are shared with the workers through memory-mapped files,
+    and each (camera, w_reid) is clustered once: every tau is a cut of its merge tree.
+    """
+    taus = sorted(taus)
+    with tempfile.TemporaryDirectory(prefix='sweep_') as shared_dir:
+        jobs = []
+        for seq in sorted(os.path.basename(os.path.normpath(s)) for s in glob.glob(os.path.join(metadata_dir, 'seq_*/'))):
+            for cam in CAMERAS:
+                metadata_path = os.path.join(metadata_dir, seq, f"{seq}_{cam}.txt")
+                feature_path = os.path.join(feature_dir, seq, f"{seq}_{cam}.pkl")
+                if not (os.path.exists(metadata_path) and os.path.exists(feature_path)):
+                    continue
+                all_metadatas, all_features = load_all_data([(metadata_path, feature_path)])
+                if not all_features:
+                    continue
+
+                reid, clip, intervals, tracklet_keys = build_clustering_input_weighted(all_metadatas, all_features)
+                job = len(jobs)
+                np.save(os.path.join(shared_dir, f"{job}_reid_sim.npy"), reid @ reid.T)
+                np.save(os.path.join(shared_dir, f"{job}_clip_sim.npy"), clip @ clip.T)
+                np.save(os.path.join(shared_dir, f"{job}_intervals.npy"), np.asarray(intervals, dtype=np.int64))
+                with open(os.path.join(shared_dir, f"{job}_keys.pkl"), 'wb') as f:
+                    pickle.dump(tracklet_keys, f)
+                jobs.append(job)
+
+        print(f"Loaded {len(jobs)} cameras, {len(w_reids)} x {len(taus)} grid points")
+
+        totals = defaultdict(lambda: np.zeros(4, dtype=np.int64))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared_dir, labels)) as pool:
+            futures = {(w, job): pool.submit(_camera_task, job, w, taus) for w in w_reids for job in jobs}
+            for (w, _), future in futures.items():
+                for tau, counts in future.result().items():
+                    totals[(w, tau)] += np.asarray(counts)
+
+    return [
+        _row({'w_reid': w, 'tau': tau}, int(t[0]), t[1:].tolist(), labels)
+        for (w, tau), t in sorted(totals.items())
+    ]
+
+
+def sweep_global(w_reids, taus_same_seq, taus_diff_seq, labels=None, workers=None):
+    """Global sweep over w_reid x tau_same_seq x tau_diff_seq on a process pool."""
+    nodes = load_nodes_from_clusters()
+    reid, clip = node_embeddings(nodes)
+    grid = list(itertools.product(w_reids, taus_same_seq, taus_diff_seq))
+
+    with tempfile.TemporaryDirectory(prefix='sweep_') as shared_dir:
+        np.save(os.path.join(shared_dir, "node_reid_sim.npy"), reid @ reid.T)
+        np.save(os.path.join(shared_dir, "node_clip_sim.npy"), clip @ clip.T)
+        with open(os.path.join(shared_dir, "nodes.pkl"), 'wb') as f:
+            pickle.dump({
+                'seq_cams': [[(node.seq_id, node.cam_id)] for node in nodes],
+                'track_keys': [node.track_keys for node in nodes],
+            }, f)
+
+        print(f"Loaded {len(nodes)} nodes, {len(grid)} grid points")
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared_dir, labels)) as pool:
+            results = list(pool.map(_global_task, *zip(*grid)))
+
+    return [
+        _row({'w_reid': w, 'tau_same_seq': ts, 'tau_diff_seq': td}, result[0], result[1:], labels)
+        for (w, ts, td), result in zip(grid, results)
+    ]
+
+
+def write_table(rows, output_path=None):
+    if not rows:
+        print("No results")
+        return
+    columns = list(rows[0].keys())
+    print(" | ".join(f"{c:>14}" for c in columns))
+    for row in rows:
+        print(" | ".join(f"{row[c]:>14.4f}" if isinstance(row[c], float) else f"{row[c]:>14}" for c in columns))
+
+    if output_path:
+        with open(output_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Results saved to {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel hyper-parameter sweep for the matching stages")
+    parser.add_argument('stage', choices=['camera', 'global'])
+    parser.add_argument('--w-reid', type=float, nargs='+', default=[0.7])
+    parser.add_argument('--tau', type=float, nargs='+', default=[0.875], help="in-camera thresholds")
+    parser.add_argument('--tau-same-seq', type=float, nargs='+', default=[0.875])
+    parser.add_argument('--tau-diff-seq', type=float, nargs='+', default=[0.92])
+    parser.add_argument('--feature-dir', default='data/new_feature_objects')
+    parser.add_argument('--metadata-dir', default='data/new_metadata_objects')
+    parser.add_argument('--labels', help="pickle of {(seq_id, cam_id, obj_id): gt_id}")
+    parser.add_argument('--annotations', help="annotation directory to derive labels from")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', help="CSV file for the result table")
+    args = parser.parse_args()
+
+    labels = None
+    if args.labels:
+        with open(args.labels, 'rb') as f:
+            labels = pickle.load(f)
+    elif args.annotations:
+        labels = build_track_labels(args.annotations, args.metadata_dir)
+
+    start = time.perf_counter()
+    if args.stage == 'camera':
+        rows = sweep_camera(args.w_reid, args.tau, args.feature_dir, args.metadata_dir, labels, args.workers)
+    else:
+        rows = sweep_global(args.w_reid, args.tau_same_seq, args.tau_diff_seq, labels, args.workers)
+    print(f"Sweep finished in {time.perf_counter() - start:.1f}s")
+    write_table(rows, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import argparse
+import base64
+import json
+import struct
+import time
+import zlib
+from collections.abc import Mapping
+
+import numpy as np
+
+# Encoded track (bytes):
+#   header   version, int width, n detections, n frame runs, n keyframes (little endian)
+#   body     zlib of one int array, column by column:
+#              run starts  (first absolute, then gap after the previous run)
+#              run lengths (runs of consecutive frames)
+#              keyframe index gaps (the first keyframe is detection 0)
+#              keyframe boxes x1, y1, x2, y2 (first absolute, then deltas)
+# Boxes between keyframes are linearly interpolated over the frame id and rounded;
+# keyframes are chosen so that no coordinate is off by more than `tolerance` pixels
+# (tolerance=0 is lossless for integral boxes).
+CODEC_VERSION = 1
+_HEADER = struct.Struct('<BBIII')
+_WIDTHS = {1: np.int8, 2: np.int16, 4: np.int32, 8: np.int64}
+
+
+def _interpolate(frames, key_frames, key_boxes):
+    return np.rint(np.stack([np.interp(frames, key_frames, key_boxes[:, c]) for c in range(4)], axis=1))
+
+
+def select_keyframes(frames, boxes, tolerance=0):
+    """
+    Indices of the detections to keep so that interpolating the others is within
+    `tolerance` pixels (Douglas-Peucker split on the worst detection).
+    """
+    n = len(frames)
+    if n <= 2:
+        return np.arange(n)
+    if np.any(np.diff(frames) <= 0):
+        # Repeated frame ids cannot be interpolated over
+        return np.arange(n)
+    if tolerance <= 0 and np.issubdtype(boxes.dtype, np.integer):
+        # Lossless: drop exactly the detections collinear with both neighbours (equal slopes)
+        df, db = np.diff(frames), np.diff(boxes, axis=0)
+        bend = np.any(db[1:] * df[:-1, None] != db[:-1] * df[1:, None], axis=1)
+        return np.flatnonzero(np.concatenate([[True], bend, [True]]))
+
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        approx = _interpolate(frames[i:j + 1], frames[[i, j]], boxes[[i, j]])
+        error = np.abs(approx - boxes[i:j + 1]).max(axis=1)
+        worst = int(error.argmax())
+        if error[worst] > tolerance:
+            k = i + worst
+            keep[k] = True
+            stack.extend([(i, k), (k, j)])
+    return np.flatnonzero(keep)
+
+
+def encode_track(frames, bboxes, tolerance=0):
+    """Encode a track's frame ids (N,) and boxes (N, 4) into bytes; boxes are rounded to pixels."""
+    frames = np.asarray(frames, dtype=np.int64).reshape(-1)
+    boxes = np.rint(np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)).astype(np.int64)
+    order = np.argsort(frames, kind='stable')
+    frames, boxes = frames[order], boxes[order]
+    n = len(frames)
+
+    if n:
+        breaks = np.flatnonzero(np.diff(frames) != 1) + 1
+        starts = np.concatenate([[0], breaks])
+        lengths = np.diff(np.concatenate([starts, [n]]))
+        run_starts = frames[starts]
+        run_gaps = np.concatenate([run_starts[:1], run_starts[1:] - (run_starts[:-1] + lengths[:-1])])
+        keys = select_keyframes(frames, boxes, tolerance)
+        key_gaps = np.diff(keys)
+        key_deltas = np.diff(boxes[keys], axis=0, prepend=np.zeros((1, 4), dtype=np.int64))
+    else:
+        run_gaps = lengths = keys = key_gaps = np.zeros(0, dtype=np.int64)
+        key_deltas = np.zeros((0, 4), dtype=np.int64)
+
+    values = np.concatenate([run_gaps, lengths, key_gaps, key_deltas.T.reshape(-1)])
+    width = next(w for w, dt in _WIDTHS.items()
+                 if not len(values) or (values.min() >= np.iinfo(dt).min and values.max() <= np.iinfo(dt).max))
+    body = zlib.compress(values.astype(_WIDTHS[width]).tobytes(), 9)
+    return _HEADER.pack(CODEC_VERSION, width, n, len(lengths), len(keys)) + body
+
+
+def decode_track(data):
+    """Decode bytes from `encode_track` into frame ids (N,) and int boxes (N, 4)."""
+    version, width, n, n_runs, n_keys = _HEADER.unpack_from(data)
+    if version != CODEC_VERSION:
+        raise ValueError(f"Unsupported track codec version {version}")
+    values = np.frombuffer(zlib.decompress(data[_HEADER.size:]), dtype=_WIDTHS[width]).astype(np.int64)
+    run_gaps, lengths = values[:n_runs], values[n_runs:2 * n_runs]
+    key_gaps = values[2 * n_runs:2 * n_runs + max(n_keys - 1, 0)]
+    key_boxes = np.cumsum(values[2 * n_runs + max(n_keys - 1, 0):].reshape(4, n_keys).T, axis=0)
+
+    # Frames: every run counts up from its start
+    run_starts = np.cumsum(run_gaps + np.concatenate([[0], lengths[:-1]]))
+    run_offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    frames = np.repeat(run_starts - run_offsets, lengths) + np.arange(n)
+
+    if n_keys == n:
+        return frames, key_boxes
+    keys = np.concatenate([[0], np.cumsum(key_gaps)])
+    return frames, _interpolate(frames, frames[keys], key_boxes).astype(np.int64)
+
+
+def encode_track_text(frames, bboxes, tolerance=0):
+    """`encode_track` as an ASCII (base64) string for JSON payloads and API responses."""
+    return base64.b64encode(encode_track(frames, bboxes, tolerance)).decode('ascii')
+
+
+def decode_track_text(text):
+    return decode_track(base64.b64decode(text))
+
+
+def encode_records(records, tolerance=0):
+    """Encode a `[{'frame_id', 'bbox'}, ...]` detection list as text."""
+    frames = [d['frame_id'] for d in records]
+    bboxes = np.asarray([d['bbox'] for d in records], dtype=np.float64).reshape(-1, 4)
+    return encode_track_text(frames, bboxes, tolerance)
+
+
+def decode_records(text):
+    """`[{'frame_id', 'bbox'}, ...]` detection list from `encode_records` text."""
+    frames, boxes = decode_track_text(text)
+    return [{'frame_id': frame, 'bbox': bbox} for frame, bbox in zip(frames.tolist(), boxes.tolist())]
+
+
+class EncodedTracks(Mapping):
+    """
+    On-disk file of encoded tracks, read as {(seq_id, cam_id, obj_id): [{'frame_id', 'bbox'}, ...]}
+    like `load_metadata_file`; `frames(key)` / `bboxes(key)` give arrays.
+    """
+
+    def __init__(self, path='data/detections_encoded.npz'):
+        with np.load(path) as data:
+            self.track_keys = data['track_keys']
+            self.offsets = data['offsets']
+            self.blob = data['blob'].tobytes()
+            self.tolerance = int(data['tolerance'])
+        self._index = {tuple(key): i for i, key in enumerate(self.track_keys.tolist())}
+
+    def decode(self, key):
+        i = self._index[tuple(int(k) for k in key)]
+        return decode_track(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+    def frames(self, key):
+        return self.decode(key)[0]
+
+    def bboxes(self, key):
+        return self.decode(key)[1]
+
+    def __getitem__(self, key):
+        frames, boxes = self.decode(key)
+        return [{'frame_id': frame, 'bbox': bbox} for frame, bbox in zip(frames.tolist(), boxes.tolist())]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
+def encode_detection_store(store_dir='data/detection_store', output_path='data/detections_encoded.npz',
+                           tolerance=0):
+    """
+    Encode every track of a detection store (mmc/detection_store.py) into one file
+    readable with `EncodedTracks`, and report sizes against the text and JSON forms.
+    """
+    from detection_store import DetectionStore
+
+    start = time.perf_counter()
+    store = DetectionStore(store_dir)
+    frames_col, boxes_col = store.columns['frame'], store.columns['bbox']
+    offsets = np.asarray(store.track_offsets)
+
+    blobs, max_error = [], 0
+    for t in range(len(store)):
+        rows = slice(int(offsets[t]), int(offsets[t + 1]))
+        frames, boxes = np.asarray(frames_col[rows]), np.asarray(boxes_col[rows])
+        blob = encode_track(frames, boxes, tolerance)
+        _, decoded = decode_track(blob)
+        max_error = max(max_error, int(np.abs(decoded - boxes).max()) if len(boxes) else 0)
+        blobs.append(blob)
+
+    blob_offsets = np.concatenate([[0], np.cumsum([len(b) for b in blobs])]).astype(np.int64)
+    np.savez(
+        output_path,
+        track_keys=np.asarray(store.track_keys),
+        offsets=blob_offsets,
+        blob=np.frombuffer(b''.join(blobs), dtype=np.uint8),
+        tolerance=tolerance,
+    )
+
+    n = int(offsets[-1])
+    encoded = int(blob_offsets[-1])
+    # Baselines: the frame + bbox columns of the store, and the `detections` JSON payload
+    raw = frames_col.nbytes + boxes_col.nbytes
+    json_size = sum(len(json.dumps(store[key])) for key in store)
+    print(f"Encoded {len(store)} tracks, {n} detections (tolerance {tolerance}, max error {max_error}) "
+          f"in {time.perf_counter() - start:.2f}s -> {output_path}")
+    print(f"  columns {raw / 1e6:.2f} MB, JSON {json_size / 1e6:.2f} MB, encoded {encoded / 1e6:.3f} MB "
+          f"({raw / max(encoded, 1):.1f}x / {json_size / max(encoded, 1):.1f}x smaller)")
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delta/keyframe codec for per-track detections")
+    parser.add_argument('--store', default='data/detection_store', help="detection store to encode")
+    parser.add_argument('--output', default='data/detections_encoded.npz')
+    parser.add_argument('--tolerance', type=int, default=0, help="max box error in pixels (0 = lossless)")
+    args = parser.parse_args()
+    encode_detection_store(args.store, args.output, args.tolerance)
+
+
+if __name__ == "__main__":
+    main()
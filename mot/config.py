@@ -34,6 +34,7 @@ CAMERA_ID_OFFSET = 100_000
 
 #models
 REID_MODEL_NAME = "osnet_x1_0"
+REID_MODEL_PATH = "./models/osnet_x1_0_market_256x128_amsgrad_ep150_stp60_lr0.0015_b64_fb10_softmax_labelsmooth_flip.pth"  # tracker and ReIDModel
 REID_EMB_SIZE = 512
 
 CLIP_MODEL_NAME = "ViT-H-14-378-quickgelu"
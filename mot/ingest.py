@@ -0,0 +1,372 @@
+import argparse
+import contextlib
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from config import (
+    CAMERAS, CAMERA_ID_OFFSET, CONFIDENCE_THRESHOLD, SEQ_ID_OFFSET, SEQUENCES, VID_STRIDE
+)
+
+# Multi-camera ingest: every (sequence, camera) video is one job on a process pool.
+# A job tracks its video and writes its own files, as the run_mot notebook does:
+#   {output_dir}/crops/{seq}/{camera}/{gid}_{frame:06d}.webp   sampled crops of every tracklet
+#   {output_dir}/metadata/{seq}_{camera}.txt                   "seq cam frame gid x1 y1 x2 y2" lines
+#   {output_dir}/features/{seq}_{camera}.pkl                   {(seq, cam, gid): {'reid', 'clip'}}
+#   {output_dir}/logs/{seq}_{camera}.log                       stdout of the job
+# and {output_dir}/ingest_summary.json has the status and timings of every job.
+# Workers are spawned processes whose BLAS / OpenMP / torch / cv2 threads are capped at
+# threads_per_worker (environment inherited from the parent, read when numpy and torch
+# load), so N workers do not oversubscribe the cores; a failing job is
+# recorded and the others go on. With --shared-detector the cameras are threads of one
+# process instead, detecting through one batched DetectionService (tracking/detection_service.py).
+_WORKER_MODELS = {}
+_WORKER_MODELS_LOCK = threading.Lock()  # camera threads of run_ingest_shared share the models
+_THREAD_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+def list_jobs(video_dir=None, seqs=None, cameras=None, seq=None):
+    """
+    [(seq_name, camera_name, video_path)] of the videos to track: every
+    `{video_dir}/seq_*/camera_*` video of `seqs` (default config.SEQUENCES), or
+    without video_dir the config.CAMERAS videos as sequence `seq`.
+    """
+    if video_dir is None:
+        seq = seq or SEQUENCES[0]
+        return [(seq, f"camera_{cam_id}", path) for cam_id, path in sorted(CAMERAS.items())
+                if cameras is None or cam_id in cameras]
+
+    seqs = set(SEQUENCES.values() if seqs is None else seqs)
+    jobs = []
+    for seq_dir in sorted(glob.glob(os.path.join(video_dir, 'seq_*'))):
+        seq_name = os.path.basename(seq_dir)
+        if seq_name not in seqs:
+            continue
+        for video_path in sorted(glob.glob(os.path.join(seq_dir, 'camera_*'))):
+            camera_name = "_".join(os.path.basename(video_path).split('_')[:2])
+            if cameras is None or int(camera_name.split('_')[-1]) in cameras:
+                jobs.append((seq_name, camera_name, video_path))
+    return jobs
+
+
+def save_crop_webp(crop, path):
+    import cv2
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cv2.imwrite(
+        path,
+        crop,
+        [cv2.IMWRITE_WEBP_QUALITY, 100]  # 100 = lossless
+    )
+
+
+def safe_delete(path):
+    try:
+        if path and os.path.exists(path):
+            os.remove(path)
+    except Exception as e:
+        print(f"[WARN] Failed to delete {path}: {e}")
+
+
+def _model(name, device):
+    """ReID / CLIP model of this process, loaded once and kept for the next jobs."""
+    with _WORKER_MODELS_LOCK:
+        if (name, device) not in _WORKER_MODELS:
+            if name == 'reid':
+                from models.reid import ReIDModel
+                _WORKER_MODELS[name, device] = ReIDModel(device=device)
+            else:
+                from models.clip_model import CLIPModel
+                _WORKER_MODELS[name, device] = CLIPModel(device=device)
+        return _WORKER_MODELS[name, device]
+
+
+def process_camera(video_path, seq_name, camera_name, output_dir='output', tracker='deepsort',
+                   vid_stride=VID_STRIDE, confidence=CONFIDENCE_THRESHOLD, model_name='yolov8x.pt',
+                   device='cpu', features=True, progress=None, detector=None):
+    """
+    Track one camera video and write its crops, metadata and (features=True)
+    feature files (see the layout above). `progress(frame_idx)` is called every
+    100 tracked frames. `detector` is a shared DetectionService (see
+    run_ingest_shared). Returns counts for the job summary.
+    """
+    import cv2
+    from sampling.sampler import aggregate_embeddings, sample_best_per_window
+    from storage.embeddings import save_feature_pickle
+    from tracking.detector_tracker import run_tracking
+    from tracking.tracklet import TrackletManager
+
+    seq_id = int(seq_name.split('_')[-1])
+    cam_id = int(camera_name.split('_')[-1])
+    manager = TrackletManager()
+    n_frames = 0
+    print(f'Processing {seq_name}/{camera_name}: {video_path}')
+    for frame_id, frame, boxes, ids, confs, *embeds in run_tracking(
+            video_path, vid_stride=vid_stride, confidence=confidence, model_name=model_name,
+            device=device, tracker=tracker, return_embeddings=features, detector=detector):
+        n_frames += 1
+        if n_frames % 100 == 0:
+            print(f'    Processing frame {frame_id}')
+            if progress is not None:
+                progress(frame_id)
+        embeds = embeds[0] if embeds else [None] * len(ids)
+        for box, tid, conf, emb in zip(boxes, ids, confs, embeds):
+            gid = seq_id * SEQ_ID_OFFSET + cam_id * CAMERA_ID_OFFSET + tid
+            x1, y1, x2, y2 = map(int, box)
+
+            # invalid box (alive but not detected)
+            if x2 <= x1 or y2 <= y1:
+                continue
+
+            crop_path = os.path.join(output_dir, "crops", seq_name, camera_name, f"{gid}_{frame_id:06d}.webp")
+            save_crop_webp(frame[y1:y2, x1:x2], crop_path)
+            manager.get(gid, seq_id, cam_id).add_frame(frame_id, box, conf, crop_path, emb)
+
+    tracklets = list(manager.all())
+    print(f'Start SAMPLING and EMBEDDING ({len(tracklets)} tracklets)')
+    for t in tracklets:
+        candidates = sample_best_per_window(t.frames)
+        candidate_paths = set(f.crop_path for f in candidates)
+
+        # delete crops that are not used for CLIP & ReID embedding
+        for f in t.frames:
+            if f.crop_path not in candidate_paths:
+                safe_delete(f.crop_path)
+                f.crop_path = None
+
+        if not features:
+            continue
+        imgs = [cv2.imread(f.crop_path) for f in candidates]
+
+        # tracker-time OSNet embeddings of the same crops; ReID pass only when missing
+        reid_feat = aggregate_embeddings(candidates)
+        if reid_feat is None:
+            reid_feat = _model('reid', device).extract(imgs).mean(axis=0)
+            reid_feat = reid_feat / np.linalg.norm(reid_feat)
+        t.reid_embeddings.append(reid_feat)
+
+        clip_feat = np.mean([_model('clip', device).encode_image(img) for img in imgs], axis=0)
+        t.clip_embeddings.append(clip_feat / np.linalg.norm(clip_feat))
+
+    print('Start SAVING metadata')
+    os.makedirs(os.path.join(output_dir, "metadata"), exist_ok=True)
+    with open(os.path.join(output_dir, "metadata", f"{seq_name}_{camera_name}.txt"), "w") as f:
+        for t in tracklets:
+            for frame in t.frames:
+                f.write(f"{t.sequence_id} {t.camera_id} {frame.frame_id} {t.global_id} {int(frame.bbox[0])} "
+                        f"{int(frame.bbox[1])} {int(frame.bbox[2])} {int(frame.bbox[3])}\n")
+    if features:
+        save_feature_pickle(tracklets, os.path.join(output_dir, "features", f"{seq_name}_{camera_name}.pkl"))
+    return {'frames': n_frames, 'tracklets': len(tracklets)}
+
+
+@contextlib.contextmanager
+def _worker_thread_env(threads):
+    """
+    Set the BLAS / OpenMP thread caps in this process's environment while the
+    pool runs: spawned workers inherit it, and numpy reads it on import, which
+    happens (with this module) before any initializer runs.
+    """
+    saved = {var: os.environ.get(var) for var in _THREAD_VARS}
+    os.environ.update({var: str(threads) for var in _THREAD_VARS})
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+def _init_worker(threads):
+    """Cap the torch / cv2 threads of a worker process before the models load."""
+    import cv2
+    import torch
+
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    cv2.setNumThreads(threads)
+
+
+def _run_camera_job(seq_name, camera_name, video_path, log_path, progress_queue, kwargs, capture=True):
+    """
+    Worker entry point: one camera with its output captured in its own log
+    (capture=False: only the error, for cameras sharing the process's stdout).
+    """
+    start = time.perf_counter()
+    record = {'seq': seq_name, 'camera': camera_name, 'video': video_path, 'log': log_path}
+
+    def progress(frame_idx):
+        progress_queue.put((seq_name, camera_name, frame_idx))
+
+    with open(log_path, 'w') as log, contextlib.redirect_stdout(log) if capture else contextlib.nullcontext():
+        try:
+            record.update(process_camera(video_path, seq_name, camera_name, progress=progress, **kwargs))
+            record['status'] = 'ok'
+        except Exception as e:
+            traceback.print_exc(file=log)
+            record['status'] = 'failed'
+            record['error'] = f"{type(e).__name__}: {e}"
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def run_ingest(jobs, output_dir='output', workers=None, threads_per_worker=None, progress_interval=30.0,
+               **kwargs):
+    """
+    Run `process_camera` for every (seq_name, camera_name, video_path) job on a
+    process pool, largest video first, printing the latest frame of the running
+    jobs every `progress_interval` seconds.
+
+    Returns:
+        List of job records (status is 'ok' or 'failed')
+    """
+    import multiprocessing as mp
+    from concurrent.futures import ProcessPoolExecutor
+
+    log_dir = os.path.join(output_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    workers = workers or max(1, min(len(jobs), os.cpu_count()))
+    threads_per_worker = threads_per_worker or max(1, os.cpu_count() // workers)
+    jobs = sorted(jobs, key=lambda job: os.path.getsize(job[2]) if os.path.exists(job[2]) else 0, reverse=True)
+    print(f"Tracking {len(jobs)} videos on {workers} workers x {threads_per_worker} threads...")
+
+    start = time.perf_counter()
+    ctx = mp.get_context('spawn')  # fresh interpreters: no forked torch / CUDA state
+    with _worker_thread_env(threads_per_worker), ctx.Manager() as manager, ProcessPoolExecutor(
+            max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(threads_per_worker,)) as pool:
+        progress_queue = manager.Queue()
+        futures = {
+            pool.submit(_run_camera_job, seq_name, camera_name, video_path,
+                        os.path.join(log_dir, f"{seq_name}_{camera_name}.log"),
+                        progress_queue, dict(kwargs, output_dir=output_dir)): (seq_name, camera_name, video_path)
+            for seq_name, camera_name, video_path in jobs
+        }
+        summary = _wait_for_jobs(futures, progress_queue, progress_interval, start)
+    return _save_summary(summary, output_dir, start)
+
+
+def run_ingest_shared(jobs, output_dir='output', max_batch=16, max_wait=0.01, progress_interval=30.0,
+                      model_name='yolov8x.pt', **kwargs):
+    """
+    `run_ingest` with every camera as a thread of this process, all detecting
+    through one DetectionService: frames of the cameras share batched YOLO forward
+    passes (up to max_batch frames, formed within max_wait seconds).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from tracking.detection_service import DetectionService
+
+    log_dir = os.path.join(output_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    print(f"Tracking {len(jobs)} videos with a shared detector (batch {max_batch}, "
+          f"max wait {1000 * max_wait:.0f} ms)...")
+
+    start = time.perf_counter()
+    progress_queue = queue.Queue()
+    with DetectionService(model_name, max_batch, max_wait) as detector, \
+            ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="camera") as pool:
+        futures = {
+            pool.submit(_run_camera_job, seq_name, camera_name, video_path,
+                        os.path.join(log_dir, f"{seq_name}_{camera_name}.log"), progress_queue,
+                        dict(kwargs, output_dir=output_dir, detector=detector), False): (seq_name, camera_name, video_path)
+            for seq_name, camera_name, video_path in jobs
+        }
+        summary = _wait_for_jobs(futures, progress_queue, progress_interval, start)
+    detector.report()
+    return _save_summary(summary, output_dir, start)
+
+
+def _wait_for_jobs(futures, progress_queue, progress_interval, start):
+    """Job records of `futures` as they finish, with the running jobs' progress every progress_interval."""
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    summary, latest = [], {}
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=progress_interval, return_when=FIRST_COMPLETED)
+        while True:
+            try:
+                seq_name, camera_name, frame_idx = progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            latest[seq_name, camera_name] = frame_idx
+        for future in done:
+            seq_name, camera_name, video_path = futures[future]
+            latest.pop((seq_name, camera_name), None)
+            try:
+                record = future.result()
+            except Exception as e:
+                # The worker process itself died (e.g. out of memory)
+                record = {'seq': seq_name, 'camera': camera_name, 'video': video_path,
+                          'status': 'failed', 'error': f"{type(e).__name__}: {e}", 'seconds': None}
+            summary.append(record)
+            detail = record.get('error') or f"{record.get('frames')} frames, {record.get('tracklets')} tracklets"
+            print(f"  [{len(summary)}/{len(futures)}] {seq_name}/{camera_name}: {record['status']} "
+                  f"({detail}) after {time.perf_counter() - start:.0f}s")
+        if not done and latest:
+            running = ", ".join(f"{s}/{c} frame {f}" for (s, c), f in sorted(latest.items()))
+            print(f"  [PROGRESS {time.perf_counter() - start:.0f}s] {running}")
+    return summary
+
+
+def _save_summary(summary, output_dir, start):
+    summary.sort(key=lambda r: (r['seq'], r['camera']))
+    summary_path = os.path.join(output_dir, 'ingest_summary.json')
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    failed = [r for r in summary if r['status'] == 'failed']
+    print(f"Done in {time.perf_counter() - start:.1f}s: {len(summary) - len(failed)} succeeded, "
+          f"{len(failed)} failed. Summary saved to {summary_path}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Track every configured camera video on a process pool")
+    parser.add_argument('--video-dir', help="folder of seq_*/camera_* videos (default: config.CAMERAS)")
+    parser.add_argument('--seqs', nargs='+', help="sequences under --video-dir (default: config.SEQUENCES)")
+    parser.add_argument('--seq', help="sequence name of the config.CAMERAS videos (default: first of config.SEQUENCES)")
+    parser.add_argument('--cameras', nargs='+', type=int, help="camera ids to track (default: all)")
+    parser.add_argument('--output-dir', default='output')
+    parser.add_argument('--workers', type=int, help="parallel videos (default: one per video, up to the core count)")
+    parser.add_argument('--threads-per-worker', type=int, help="torch / OpenMP threads per worker (default: cores / workers)")
+    parser.add_argument('--tracker', choices=['deepsort', 'motion'], default='deepsort')
+    parser.add_argument('--vid-stride', type=int, default=VID_STRIDE)
+    parser.add_argument('--confidence', type=float, default=CONFIDENCE_THRESHOLD)
+    parser.add_argument('--model', default='yolov8x.pt', help="YOLO weights")
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--no-features', action='store_true', help="only crops and metadata, no ReID / CLIP features")
+    parser.add_argument('--progress-interval', type=float, default=30.0, help="seconds between progress lines")
+    parser.add_argument('--shared-detector', action='store_true',
+                        help="track the cameras as threads of one process with one batched detector")
+    parser.add_argument('--max-batch', type=int, default=16, help="frames per shared detector pass")
+    parser.add_argument('--max-wait-ms', type=float, default=10.0, help="latency cap of a shared detector batch")
+    args = parser.parse_args()
+
+    jobs = list_jobs(args.video_dir, args.seqs, args.cameras, args.seq)
+    if not jobs:
+        parser.error("no videos to track")
+    kwargs = dict(
+        progress_interval=args.progress_interval, tracker=args.tracker, vid_stride=args.vid_stride,
+        confidence=args.confidence, model_name=args.model, device=args.device, features=not args.no_features
+    )
+    if args.shared_detector:
+        summary = run_ingest_shared(jobs, output_dir=args.output_dir, max_batch=args.max_batch,
+                                    max_wait=args.max_wait_ms / 1000, **kwargs)
+    else:
+        summary = run_ingest(jobs, output_dir=args.output_dir, workers=args.workers,
+                             threads_per_worker=args.threads_per_worker, **kwargs)
+    if any(r['status'] == 'failed' for r in summary):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,18 @@ import torchreid
 from torchvision import transforms
 from PIL import Image
 
+from config import REID_MODEL_NAME, REID_MODEL_PATH
+
 class ReIDModel:
-    def __init__(self, device='gpu'):
+    # Same OSNet weights as the tracker (tracking/detector_tracker.py), so its features
+    # can be mixed with the tracker-time embeddings (sampling.aggregate_embeddings)
+    def __init__(self, device='gpu', model_name=REID_MODEL_NAME, model_path=REID_MODEL_PATH):
+        self.model_name = model_name
+        self.model_path = model_path
         self.model = torchreid.utils.feature_extractor.FeatureExtractor(
-            model_name="osnet_x1_0",
+            model_name=model_name,
             device=device,
-            model_path='osnet_x1_0_market_256x128_amsgrad_ep150_stp60_lr0.0015_b64_fb10_softmax_labelsmooth_flip.pth'
+            model_path=model_path
         )
     def extract(self, images):
         feats = self.model(images)
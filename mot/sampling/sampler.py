@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def sample_best_per_window(tracklet_frames, window=30, ratio_to_largest_area=0.5, number_to_aggregate=3):
     sampled = []
     largest_area = 0.0
@@ -17,4 +20,20 @@ def sample_best_per_window(tracklet_frames, window=30, ratio_to_largest_area=0.5
     # only keep those that are large enough
     filtered = [item[0] for item in sampled if item[1] >= ratio_to_largest_area*largest_area]
     filtered.sort(key=lambda f: f.confidence, reverse=True)
-    return filtered[:number_to_aggregate]
\ No newline at end of file
+    return filtered[:number_to_aggregate]
+
+
+def aggregate_embeddings(frames):
+    """
+    L2-normalized mean of the tracker-time embeddings of `frames` (e.g. the
+    sample_best_per_window candidates); None when a frame has no embedding.
+    They come from the tracker's OSNet (config.REID_MODEL_NAME / REID_MODEL_PATH)
+    on the in-memory detection crops, so they match re-embedding the saved
+    crops with models.reid.ReIDModel only up to the crops' webp compression.
+    Fall back to a ReIDModel with the same weights, or features of two models
+    end up in one file.
+    """
+    if not frames or any(f.embedding is None for f in frames):
+        return None
+    feat = np.mean([f.embedding for f in frames], axis=0)
+    return (feat / np.linalg.norm(feat)).astype(np.float32)
@@ -1,5 +1,14 @@
+import os
+import pickle
+import sys
+
 import numpy as np
 
+from config import SEQ_ID_OFFSET, CAMERA_ID_OFFSET
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "mmc"))
+from embedding_store import EmbeddingStore
+
 
 def collect_embeddings(tracklets):
     reid, clip = {}, {}
@@ -14,8 +23,70 @@ def collect_embeddings(tracklets):
     return reid, clip
 
 
-def save_embeddings(reid, clip, out_dir="output"):
-    np.save(f"{out_dir}/reid_embeddings.npy", reid)
-    np.save(f"{out_dir}/clip_embeddings.npy", clip)
+def save_feature_pickle(tracklets, path):
+    """
+    Write the per-camera feature file ({(seq_id, cam_id, obj_id): {'reid', 'clip'}},
+    as in data/new_feature_objects) of the tracklets with both embeddings.
+    """
+    features = {
+        (t.sequence_id, t.camera_id, t.global_id): {
+            "reid": np.asarray(t.reid_embeddings[0], dtype=np.float32),
+            "clip": np.asarray(t.clip_embeddings[0], dtype=np.float32),
+        }
+        for t in tracklets
+        if t.reid_embeddings and t.clip_embeddings
+    }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        pickle.dump(features, f, protocol=pickle.HIGHEST_PROTOCOL)
+    print(f"[INFO] Saved features of {len(features)} tracklets to {path}")
+    return len(features)
+
+
+def track_key(global_id):
+    """(seq_id, cam_id, obj_id) of a tracker global id; obj_id is the global id, as in the metadata files."""
+    return global_id // SEQ_ID_OFFSET, global_id % SEQ_ID_OFFSET // CAMERA_ID_OFFSET, global_id
+
 
-    print("[INFO] Saved embeddings (.npy)")
+def save_embeddings(reid, clip, out_dir="output", dtype="float32"):
+    """
+    Upsert {global_id: embedding} dicts into the embedding store in `out_dir/embeddings`
+    (see mmc/embedding_store.py), creating it on first use; re-running a camera
+    replaces its earlier rows. Tracklets need both a ReID and a CLIP embedding to be stored.
+    """
+    store_dir = os.path.join(out_dir, "embeddings")
+    if os.path.exists(os.path.join(store_dir, "meta.json")):
+        store = EmbeddingStore(store_dir)
+    else:
+        store = EmbeddingStore.create(store_dir, dtype=dtype)
+
+    ids = [gid for gid in reid if gid in clip]
+    skipped = len(set(reid) ^ set(clip))
+    replaced = 0
+    if ids:
+        replaced = store.upsert(
+            [track_key(gid) for gid in ids],
+            reid=np.stack([reid[gid] for gid in ids]),
+            clip=np.stack([clip[gid] for gid in ids]),
+        )
+
+    print(f"[INFO] Saved {len(ids)} embeddings to {store_dir} ({replaced} replaced, {len(store)} total)")
+    if skipped:
+        print(f"[WARN] Skipped {skipped} tracklets with only one of ReID/CLIP")
+
+
+def load_embeddings(out_dir="output"):
+    """
+    Return ({global_id: reid}, {global_id: clip}) from `out_dir`, reading the
+    embedding store or, for older outputs, the dict-in-.npy files.
+    """
+    store_dir = os.path.join(out_dir, "embeddings")
+    if os.path.exists(os.path.join(store_dir, "meta.json")):
+        store = EmbeddingStore(store_dir)
+        ids = np.asarray(store.keys)[:, 2].tolist()
+        reid, clip = store.matrix("reid"), store.matrix("clip")
+        return dict(zip(ids, reid)), dict(zip(ids, clip))
+
+    reid = np.load(f"{out_dir}/reid_embeddings.npy", allow_pickle=True).item()
+    clip = np.load(f"{out_dir}/clip_embeddings.npy", allow_pickle=True).item()
+    return reid, clip
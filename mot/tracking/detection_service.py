@@ -0,0 +1,120 @@
+import collections
+import threading
+import time
+
+# Shared detector for several camera streams in one process (run_tracking(detector=...)):
+#   streams call service(frames, **predict_args) like a YOLO model and block for their results
+#   one service thread batches the pending frames of all streams and runs one forward pass,
+#   as soon as max_batch frames are waiting or the oldest has waited max_wait seconds
+# Frames are only batched with frames of the same predict args and shape, so every frame is
+# letterboxed as it would be alone and each camera's detections (and tracks) are unchanged.
+
+
+class _Request:
+    __slots__ = ('frame', 'predict_args', 'key', 'arrival', 'done', 'result', 'error')
+
+    def __init__(self, frame, predict_args):
+        self.frame = frame
+        self.predict_args = predict_args
+        self.key = (tuple(sorted((k, repr(v)) for k, v in predict_args.items())), frame.shape)
+        self.arrival = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DetectionService:
+    """Batched YOLO detection shared by the tracking streams of one process."""
+
+    def __init__(self, model_name='yolov8x.pt', max_batch=16, max_wait=0.01, model=None):
+        if model is None:
+            from ultralytics import YOLO
+            model = YOLO(model_name)
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.stats = {'batches': 0, 'frames': 0, 'busy': 0.0, 'wait': 0.0}
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._serve, name="detection-service", daemon=True)
+        self._thread.start()
+
+    def __call__(self, frames, **predict_args):
+        """Results of model(frames, **predict_args), computed in batches with the other streams."""
+        requests = [_Request(frame, predict_args) for frame in frames]
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("DetectionService is closed")
+            self._pending.extend(requests)
+            self._cond.notify_all()
+        for request in requests:
+            request.done.wait()
+            if request.error is not None:
+                raise request.error
+        return [request.result for request in requests]
+
+    def _next_batch(self):
+        """Wait for a batch: up to max_batch requests like the oldest one, or [] when closed."""
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return []
+            oldest = self._pending[0]
+            deadline = oldest.arrival + self.max_wait
+            while not self._closed:
+                ready = sum(1 for r in self._pending if r.key == oldest.key)
+                remaining = deadline - time.perf_counter()
+                if ready >= self.max_batch or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch, rest = [], collections.deque()
+            for request in self._pending:
+                if request.key == oldest.key and len(batch) < self.max_batch:
+                    batch.append(request)
+                else:
+                    rest.append(request)
+            self._pending = rest
+            return batch
+
+    def _serve(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            start = time.perf_counter()
+            try:
+                results = self.model([r.frame for r in batch], **batch[0].predict_args)
+                for request, result in zip(batch, results):
+                    request.result = result
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            self.stats['batches'] += 1
+            self.stats['frames'] += len(batch)
+            self.stats['busy'] += time.perf_counter() - start
+            self.stats['wait'] += sum(start - r.arrival for r in batch)
+            for request in batch:
+                request.done.set()
+
+    def close(self):
+        """Finish the pending requests and stop the service thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def report(self):
+        s = self.stats
+        print(f"[DETECTOR] {s['frames']} frames in {s['batches']} batches "
+              f"(mean {s['frames'] / max(s['batches'], 1):.1f}, max {self.max_batch}), "
+              f"busy {s['busy']:.2f}s ({s['frames'] / max(s['busy'], 1e-9):.1f} fps), "
+              f"mean wait {1000 * s['wait'] / max(s['frames'], 1):.1f} ms")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,107 +1,415 @@
+import queue
+import threading
+import time
+
+import cv2
 from ultralytics import YOLO
 from deep_sort_realtime.deepsort_tracker import DeepSort
 import numpy as np
 from deep_person_reid.torchreid.utils.feature_extractor import FeatureExtractor
+from config import REID_MODEL_NAME, REID_MODEL_PATH
+from tracking.motion_tracker import MotionTracker, iou_matrix, linear_assignment
+
+# Pipelined tracking (run_tracking(pipelined=True)): one thread per stage, bounded queues between them
+#   decode   cv2 reads every vid_stride-th frame                      -> (frame_idx, frame)
+#   detect   YOLO (or a shared DetectionService) on the frames already decoded (up to detect_batch),
+#            then the crops of every box                             -> (frame_idx, frame, bbs, crops)
+#   embed    one OSNet call on the crops of consecutive frames
+#            (up to embed_batch crops)                              -> (frame_idx, frame, bbs, embeds)
+#   track    tracker.update_tracks in frame order, in the caller's thread (the generator)
+# Trackers that need no embeddings (tracker='motion') skip the embed stage and the ReID model,
+# unless run_tracking(return_embeddings=True) asks for the crop embeddings of every track.
+# Stages overlap, so decode and crop slicing run while the models compute (torch and cv2
+# release the GIL). Frames without boxes or crops never reach the tracker, as before.
+_DONE = object()
+TRACKERS = ('deepsort', 'motion')
+
+
+def make_tracker(name='deepsort', max_age=90):
+    """DeepSort (appearance + motion) or MotionTracker (IoU + motion only)."""
+    if name == 'deepsort':
+        return DeepSort(max_age=max_age)
+    if name == 'motion':
+        return MotionTracker(max_age=max_age)
+    raise ValueError(f"Unknown tracker {name!r}, expected one of {TRACKERS}")
+
+
+def read_frames(video_path, vid_stride=1):
+    """Yield (frame_idx, BGR frame) of every vid_stride-th frame, like the YOLO video loader."""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video: {video_path}")
+    try:
+        frame_idx = 0
+        while True:
+            # YOLO grabs vid_stride frames and keeps the last one
+            if not all(cap.grab() for _ in range(vid_stride)):
+                return
+            ok, frame = cap.retrieve()
+            if not ok:
+                return
+            yield frame_idx, frame
+            frame_idx += 1
+    finally:
+        cap.release()
+
+
+def frame_detections(frame, boxes_xyxy, confs):
+    """DeepSort detections ([left, top, w, h], conf, '0') of one frame and their crops."""
+    bbs = [] # List[ Tuple( List[float or int], float, str ) ] ( [left,top,w,h] , confidence, detection_class)
+    crops = []
+    for box, conf in zip(boxes_xyxy, confs):
+        left, top, right, bottom = map(int, box)
+
+        if right <= left or bottom <= top:
+            continue
+
+        w = right - left
+        h = bottom - top
+        crop = frame[top:bottom, left:right]
+
+        if crop.size == 0:
+            continue
+
+        crops.append(crop)
+        bbs.append( ([left, top, w, h], conf, '0') )
+    return bbs, crops
+
+
+def track_outputs(tracks, bbs=None, embeds=None):
+    """
+    (boxes_xyxy, ids, confs) arrays of the confirmed tracks. With the frame's
+    detections `bbs` and their `embeds`, also (n_tracks, D) embeddings of the
+    detection each track matched this frame (NaN rows for unmatched tracks).
+    """
+    ids = []
+    confs = []
+    ltrb_boxes = []
+    for track in tracks:
+        if not track.is_confirmed():
+            continue
+
+        track_id = int(track.track_id)
+        ltrb = track.to_ltrb(orig=True, orig_strict=True)
+        if ltrb is None:
+            ltrb = [0,0,0,0]
+        conf = track.get_det_conf()
+
+        if conf is None:
+            conf = 0.0
+
+        ids.append(track_id)
+        confs.append(conf)
+        ltrb_boxes.append(ltrb)
+
+    if embeds is None:
+        return np.array(ltrb_boxes), np.array(ids), np.array(confs)
+
+    # Matched tracks report their detection's box as it was given, so the box finds the embedding
+    rows = {(l, t, l + w, t + h): i for i, ((l, t, w, h), _, _) in enumerate(bbs)}
+    track_embeds = np.full((len(ids), embeds.shape[1]), np.nan, dtype=np.float32)
+    for k, ltrb in enumerate(ltrb_boxes):
+        row = rows.get(tuple(int(v) for v in np.rint(ltrb)))
+        if row is not None:
+            track_embeds[k] = embeds[row]
+    return np.array(ltrb_boxes), np.array(ids), np.array(confs), track_embeds
+
+
+def id_switches(reference, outputs, iou_threshold=0.5):
+    """
+    Compare two run_tracking outputs of the same video, e.g. DeepSort as reference
+    and the motion tracker: boxes are matched per frame by IoU and an ID switch is a
+    reference id matched to another id than the last time (CLEAR-MOT IDSW with the
+    reference as ground truth). Frames are (frame_idx, img, boxes, ids, confs); img
+    is ignored.
+    """
+    reference = {frame_idx: (boxes, ids) for frame_idx, _, boxes, ids, _ in reference}
+    outputs = {frame_idx: (boxes, ids) for frame_idx, _, boxes, ids, _ in outputs}
+    last_match = {}
+    n_reference = matched = switches = 0
+    for frame_idx in sorted(reference):
+        ref_boxes, ref_ids = reference[frame_idx]
+        boxes, ids = outputs.get(frame_idx, (np.zeros((0, 4)), np.zeros(0)))
+        n_reference += len(ref_ids)
+        if not len(ref_ids) or not len(ids):
+            continue
+        matches, _, _ = linear_assignment(1 - iou_matrix(ref_boxes, boxes), 1 - iou_threshold)
+        for i, j in matches:
+            ref_id, track_id = int(ref_ids[i]), int(ids[j])
+            matched += 1
+            if last_match.get(ref_id, track_id) != track_id:
+                switches += 1
+            last_match[ref_id] = track_id
+    return {
+        'reference_boxes': n_reference,
+        'matched': matched,
+        'id_switches': switches,
+        'reference_ids': len({int(i) for _, ids in reference.values() for i in ids}),
+        'ids': len({int(i) for _, ids in outputs.values() for i in ids}),
+    }
+
+
+class StagePipeline:
+    """Threads, bounded queues and per-stage counters of the pipelined tracking loop."""
+
+    def __init__(self, queue_size=8):
+        self.queue_size = queue_size
+        self.stop = threading.Event()
+        self.errors = []
+        self.threads = []
+        self.stats = {}  # stage -> [frames, busy seconds]
+        self.start_time = time.perf_counter()
+
+    def queue(self):
+        return queue.Queue(self.queue_size)
+
+    def put(self, q, item):
+        """Put unless the pipeline is stopping; False when it is."""
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, q):
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def get_batch(self, q, size, size_of=None):
+        """
+        Block for one item, then take the items already queued while the batch is
+        under `size` (items, or the sum of `size_of(item)`). [] at the end.
+        """
+        item = self.get(q)
+        if item is _DONE:
+            return []
+        batch = [item]
+        total = size_of(item) if size_of else 1
+        while total < size:
+            try:
+                item = q.get_nowait()
+            except queue.Empty:
+                break
+            if item is _DONE:
+                q.put_nowait(_DONE)  # for the next call; the slot was just freed
+                break
+            batch.append(item)
+            total += size_of(item) if size_of else 1
+        return batch
+
+    def record(self, stage, frames, seconds):
+        counts = self.stats.setdefault(stage, [0, 0.0])
+        counts[0] += frames
+        counts[1] += seconds
 
-def run_tracking(video_path, 
-                 vid_stride, 
-                 confidence, 
+    def start(self, stage, body, *args):
+        """Run `body(*args)` in a thread; an exception stops the whole pipeline."""
+        self.stats.setdefault(stage, [0, 0.0])
+
+        def run():
+            try:
+                body(*args)
+            except BaseException as e:
+                self.errors.append(e)
+                self.stop.set()
+
+        thread = threading.Thread(target=run, name=f"tracking-{stage}", daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def close(self):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+    def report(self):
+        wall = time.perf_counter() - self.start_time
+        frames = max((counts[0] for counts in self.stats.values()), default=0)
+        print(f"[PIPELINE] {frames} frames in {wall:.2f}s ({frames / max(wall, 1e-9):.1f} fps)")
+        for stage, (n, busy) in self.stats.items():
+            print(f"  {stage:<7} {n:>6} frames, busy {busy:7.2f}s ({n / max(busy, 1e-9):8.1f} fps)")
+
+
+def _decode_stage(pipe, video_path, vid_stride, outbox):
+    frames = read_frames(video_path, vid_stride)
+    try:
+        while True:
+            start = time.perf_counter()
+            item = next(frames, None)
+            if item is None:
+                break
+            pipe.record('decode', 1, time.perf_counter() - start)
+            if not pipe.put(outbox, item):
+                return
+    finally:
+        frames.close()
+    pipe.put(outbox, _DONE)
+
+
+def _detect_stage(pipe, model, predict_args, detect_batch, inbox, outbox):
+    while True:
+        batch = pipe.get_batch(inbox, detect_batch)
+        if not batch:
+            break
+        start = time.perf_counter()
+        results = model([frame for _, frame in batch], **predict_args)
+        detected = []
+        for (frame_idx, frame), r in zip(batch, results):
+            if r.boxes is None or len(r.boxes) == 0:
+                continue
+            bbs, crops = frame_detections(frame, r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy())
+            if len(crops) == 0:
+                print(f"Empty crops at frame {frame_idx}, boxes: {len(r.boxes)}")
+                continue
+            detected.append((frame_idx, frame, bbs, crops))
+        pipe.record('detect', len(batch), time.perf_counter() - start)
+        for item in detected:
+            if not pipe.put(outbox, item):
+                return
+    pipe.put(outbox, _DONE)
+
+
+def _embed_stage(pipe, embedder, embed_batch, inbox, outbox):
+    while True:
+        batch = pipe.get_batch(inbox, embed_batch, size_of=lambda item: len(item[3]))
+        if not batch:
+            break
+        start = time.perf_counter()
+        embeds = embedder([crop for *_, crops in batch for crop in crops]).cpu().numpy()
+        offsets = np.cumsum([0] + [len(crops) for *_, crops in batch])
+        pipe.record('embed', len(batch), time.perf_counter() - start)
+        for (frame_idx, frame, bbs, _), i, j in zip(batch, offsets[:-1], offsets[1:]):
+            if not pipe.put(outbox, (frame_idx, frame, bbs, embeds[i:j])):
+                return
+    pipe.put(outbox, _DONE)
+
+
+def run_tracking(video_path,
+                 vid_stride,
+                 confidence,
                  model_name = 'yolov8x.pt',
-                 save: bool = False, 
-                 visualize: bool = False, 
-                 project_name: str = None, 
+                 save: bool = False,
+                 visualize: bool = False,
+                 project_name: str = None,
                  name: str = None,
                  show: bool = False,
                  verbose: bool = False,
-                 device: str = 'cpu'):
+                 device: str = 'cpu',
+                 tracker: str = 'deepsort',
+                 return_embeddings: bool = False,
+                 detector=None,
+                 pipelined: bool = True,
+                 queue_size: int = 8,
+                 detect_batch: int = 4,
+                 embed_batch: int = 64):
+    """
+    Yield (frame_idx, frame, boxes_xyxy, ids, confs) of the confirmed tracks of every
+    frame with detections. tracker is 'deepsort' or 'motion' (see make_tracker).
+    return_embeddings=True appends the OSNet embedding of each track's detection in
+    that frame (see track_outputs), the same vectors the tracker was fed, so the
+    ReID features of the tracklets need no second pass (sampling.aggregate_embeddings).
+    detector: a DetectionService (tracking/detection_service.py) shared with other
+    streams, used instead of loading model_name.
+    pipelined=True runs decode, detection and embedding in
+    their own threads (see above); save / visualize / show need YOLO's own video
+    loader and use the sequential loop. Per-stage throughput is printed at the end.
+    """
+    if detector is not None and (save or visualize or show):
+        raise ValueError("save / visualize / show need the stream's own YOLO model, not a shared detector")
+
     # Initialize model and tracker
-    model = YOLO(model_name)
+    model = detector if detector is not None else YOLO(model_name)
 
-    embedder = FeatureExtractor(
-        model_name='osnet_x1_0',
-        model_path='./models/osnet_x1_0_market_256x128_amsgrad_ep150_stp60_lr0.0015_b64_fb10_softmax_labelsmooth_flip.pth',
-        device= device,
-    )
+    tracker = make_tracker(tracker, max_age=90) # must define tracker here
 
-    tracker = DeepSort(max_age=90) # must define tracker here
-    
-    try:
-        # Detecting
-        results = model(
-            source=video_path,
-            stream=True,
-            classes=[0],
-            vid_stride=vid_stride,
-            conf=confidence,
-            visualize=visualize,
-            save=save,
-            project=project_name,
-            name=name,
-            show=show,
-            verbose=verbose,
-            device=device
+    embedder = None
+    if return_embeddings or getattr(tracker, 'needs_embeddings', True):
+        embedder = FeatureExtractor(
+            model_name=REID_MODEL_NAME,
+            model_path=REID_MODEL_PATH,
+            device= device,
         )
 
-        # Tracking
-        for frame_idx, r in enumerate(results):
-            if r.boxes is None or len(r.boxes) == 0:
-                continue
+    if save or visualize or show:
+        pipelined = False
+    pipe = StagePipeline(queue_size)
+    try:
+        if not pipelined:
+            frames = _sequential_frames(pipe, model, embedder, video_path, vid_stride, confidence,
+                                        save, visualize, project_name, name, show, verbose, device)
+        else:
+            predict_args = dict(classes=[0], conf=confidence, verbose=verbose, device=device)
+            decoded, detected = pipe.queue(), pipe.queue()
+            pipe.start('decode', _decode_stage, pipe, video_path, vid_stride, decoded)
+            pipe.start('detect', _detect_stage, pipe, model, predict_args, detect_batch, decoded, detected)
+            if embedder is not None:
+                embedded = pipe.queue()
+                pipe.start('embed', _embed_stage, pipe, embedder, embed_batch, detected, embedded)
+            else:
+                embedded = detected
+            frames = iter(lambda: pipe.get(embedded), _DONE)
 
-            frame = r.orig_img # HxWxC, numpy array
-            bbs = [] # List[ Tuple( List[float or int], float, str ) ] ( [left,top,w,h] , confidence, detection_class)
-            boxes_xyxy = r.boxes.xyxy.cpu().numpy()
-            # boxes_xywh = r.boxes.xywh.cpu().numpy()
-            confs = r.boxes.conf.cpu().numpy()
-            crops = []
-            for box, conf in zip(boxes_xyxy, confs):
-                left, top, right, bottom = map(int, box)
+        # Tracking, in frame order
+        needs_embeddings = getattr(tracker, 'needs_embeddings', True)
+        for frame_idx, frame, bbs, embeds in frames:
+            if embedder is None:
+                embeds = None  # crops, unused
+            start = time.perf_counter()
+            tracks = tracker.update_tracks(bbs, embeds if needs_embeddings else None)
+            outputs = track_outputs(tracks, bbs, embeds) if return_embeddings else track_outputs(tracks)
+            pipe.record('track', 1, time.perf_counter() - start)
+            yield (frame_idx, frame) + outputs
 
-                if right <= left or bottom <= top:
-                    continue
+        if pipe.errors:
+            raise pipe.errors[0]
+        pipe.report()
+    finally:
+        pipe.close()
+        del model
 
-                w = right - left
-                h = bottom - top
-                crop = frame[top:bottom, left:right]
 
-                if crop.size == 0:
-                    continue
+def _sequential_frames(pipe, model, embedder, video_path, vid_stride, confidence,
+                       save, visualize, project_name, name, show, verbose, device):
+    """(frame_idx, frame, bbs, embeds) of the frames with detections, one step after the other."""
+    # Detecting (decode included)
+    results = model(
+        source=video_path,
+        stream=True,
+        classes=[0],
+        vid_stride=vid_stride,
+        conf=confidence,
+        visualize=visualize,
+        save=save,
+        project=project_name,
+        name=name,
+        show=show,
+        verbose=verbose,
+        device=device
+    )
 
-                crops.append(crop)
-                bbs.append( ([left, top, w, h], conf, '0') )
-            
-            if len(crops) == 0:
-                print(f"Empty crops at frame {frame_idx}, boxes: {len(boxes_xyxy)}")
-                continue
+    start = time.perf_counter()
+    for frame_idx, r in enumerate(results):
+        pipe.record('detect', 1, time.perf_counter() - start)
+        start = time.perf_counter()
+        if r.boxes is None or len(r.boxes) == 0:
+            continue
+
+        frame = r.orig_img # HxWxC, numpy array
+        bbs, crops = frame_detections(frame, r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy())
+        if len(crops) == 0:
+            print(f"Empty crops at frame {frame_idx}, boxes: {len(r.boxes)}")
+            continue
 
+        if embedder is not None:
             embeds = embedder(crops).cpu().numpy() # your own embedder to take in the cropped object chips, and output feature vectors
-            tracks = tracker.update_tracks(bbs, embeds)
-            ids = []
-            confs = []
-            ltrb_boxes = []
-            # ltwh_boxes = []
-            for track in tracks:
-                if not track.is_confirmed():
-                    continue
-
-                track_id = int(track.track_id)
-                ltrb = track.to_ltrb(orig=True, orig_strict=True)
-                if ltrb is None:
-                    ltrb = [0,0,0,0]
-                # ltwh = track.to_ltwh(orig=True, orig_strict=True)
-                conf = track.get_det_conf()
-                
-                if conf is None:
-                    conf = 0.0
-            
-                ids.append(track_id)
-                confs.append(conf)
-                ltrb_boxes.append(ltrb)
-                # ltwh_boxes.append(ltwh)
-            
-            boxes_xyxy = np.array(ltrb_boxes)
-            # boxes_xywh = np.array(ltwh_boxes)
-            ids = np.array(ids)
-            confs = np.array(confs)
-            yield frame_idx, r.orig_img, boxes_xyxy, ids, confs
-    finally:
-        del model
\ No newline at end of file
+            pipe.record('embed', 1, time.perf_counter() - start)
+        else:
+            embeds = None
+        yield frame_idx, frame, bbs, embeds
+        start = time.perf_counter()
@@ -0,0 +1,226 @@
+import numpy as np
+
+try:
+    import lap
+except ImportError:
+    lap = None
+
+# Motion-only tracker (ByteTrack-style association, no appearance embeddings):
+#   1. predict every track with a constant-velocity Kalman filter on (cx, cy, aspect, h)
+#   2. match confirmed and lost tracks to the high-confidence detections by IoU
+#   3. match the tracks still unmatched (not lost) to the low-confidence detections
+#   4. match tentative tracks to the remaining high-confidence detections
+#   5. start tentative tracks from the remaining detections above new_track_thresh
+# Tentative tracks are confirmed after n_init consecutive matches and dropped on a
+# miss; confirmed tracks are kept up to max_age frames without a match.
+# Same update_tracks / track interface as deep_sort_realtime's DeepSort.
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """(len(a), len(b)) IoU of [left, top, right, bottom] boxes."""
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    w = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    h = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    inter = w * h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def linear_assignment(cost, thresh):
+    """(matches (K, 2), unmatched rows, unmatched cols) with cost <= thresh; greedy without lap."""
+    rows, cols = cost.shape
+    if cost.size == 0:
+        return np.zeros((0, 2), dtype=int), np.arange(rows), np.arange(cols)
+    if lap is not None:
+        _, x, _ = lap.lapjv(cost, extend_cost=True, cost_limit=thresh)
+        matches = np.array([[i, j] for i, j in enumerate(x) if j >= 0], dtype=int).reshape(-1, 2)
+    else:
+        matches = []
+        used_rows, used_cols = set(), set()
+        for flat in np.argsort(cost, axis=None, kind='stable'):
+            i, j = divmod(int(flat), cols)
+            if cost[i, j] > thresh:
+                break
+            if i not in used_rows and j not in used_cols:
+                matches.append((i, j))
+                used_rows.add(i)
+                used_cols.add(j)
+        matches = np.array(matches, dtype=int).reshape(-1, 2)
+    return (matches, np.setdiff1d(np.arange(rows), matches[:, 0]),
+            np.setdiff1d(np.arange(cols), matches[:, 1]))
+
+
+class KalmanFilterXYAH:
+    """Constant-velocity Kalman filter on (cx, cy, aspect, h), batched over tracks."""
+
+    def __init__(self, std_position=1. / 20, std_velocity=1. / 160):
+        self.motion = np.eye(8)
+        self.motion[:4, 4:] = np.eye(4)
+        self.update_mat = np.eye(4, 8)
+        self.std_position = std_position
+        self.std_velocity = std_velocity
+
+    def initiate(self, xyah):
+        h = xyah[3]
+        std = np.array([2 * self.std_position * h, 2 * self.std_position * h, 1e-2, 2 * self.std_position * h,
+                        10 * self.std_velocity * h, 10 * self.std_velocity * h, 1e-5, 10 * self.std_velocity * h])
+        return np.concatenate([xyah, np.zeros(4)]), np.diag(std ** 2)
+
+    def predict(self, means, covs):
+        """Predict (N, 8) means and (N, 8, 8) covariances one frame ahead."""
+        h = means[:, 3]
+        std = np.stack([self.std_position * h, self.std_position * h, np.full_like(h, 1e-2), self.std_position * h,
+                        self.std_velocity * h, self.std_velocity * h, np.full_like(h, 1e-5), self.std_velocity * h], 1)
+        means = means @ self.motion.T
+        covs = self.motion @ covs @ self.motion.T + np.einsum('ni,ij->nij', std ** 2, np.eye(8))
+        return means, covs
+
+    def update(self, mean, cov, xyah):
+        h = mean[3]
+        std = np.array([self.std_position * h, self.std_position * h, 1e-1, self.std_position * h])
+        projected_cov = self.update_mat @ cov @ self.update_mat.T + np.diag(std ** 2)
+        gain = np.linalg.solve(projected_cov, (cov @ self.update_mat.T).T).T
+        mean = mean + gain @ (xyah - self.update_mat @ mean)
+        cov = cov - gain @ projected_cov @ gain.T
+        return mean, cov
+
+
+def ltwh_to_xyah(ltwh):
+    left, top, w, h = ltwh
+    return np.array([left + w / 2, top + h / 2, w / max(h, 1e-9), h], dtype=np.float64)
+
+
+class MotionTrack:
+    TENTATIVE, CONFIRMED, DELETED = 1, 2, 3
+
+    def __init__(self, track_id, ltwh, conf, det_class, mean, cov, n_init):
+        self.track_id = str(track_id)
+        self.mean, self.cov = mean, cov
+        self.hits = 1
+        self.time_since_update = 0
+        self.state = MotionTrack.CONFIRMED if n_init <= 1 else MotionTrack.TENTATIVE
+        self.det_class = det_class
+        self._set_detection(ltwh, conf)
+
+    def _set_detection(self, ltwh, conf):
+        left, top, w, h = ltwh
+        self.original_ltrb = np.array([left, top, left + w, top + h], dtype=np.float64)
+        self.det_conf = conf
+
+    def is_confirmed(self):
+        return self.state == MotionTrack.CONFIRMED
+
+    def is_tentative(self):
+        return self.state == MotionTrack.TENTATIVE
+
+    def is_deleted(self):
+        return self.state == MotionTrack.DELETED
+
+    def to_ltrb(self, orig=False, orig_strict=False):
+        """
+        Box of the track: the matched detection's when orig=True and the track was
+        matched this frame (None then with orig_strict=True otherwise), else the
+        Kalman estimate, as in deep_sort_realtime.
+        """
+        if orig and self.time_since_update == 0:
+            return self.original_ltrb.copy()
+        if orig and orig_strict:
+            return None
+        cx, cy, a, h = self.mean[:4]
+        w = a * h
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+    def get_det_conf(self):
+        """Confidence of the detection matched this frame, None when unmatched."""
+        return self.det_conf if self.time_since_update == 0 else None
+
+    def get_det_class(self):
+        return self.det_class
+
+
+class MotionTracker:
+    """
+    IoU/motion association tracker, a drop-in for DeepSort that ignores embeddings
+    (needs_embeddings = False lets run_tracking skip the ReID model).
+    """
+    needs_embeddings = False
+
+    def __init__(self, max_age=90, n_init=3, high_thresh=0.5, new_track_thresh=0.6,
+                 match_thresh=0.8, low_match_thresh=0.5, tentative_match_thresh=0.7):
+        self.max_age = max_age
+        self.n_init = n_init
+        self.high_thresh = high_thresh
+        self.new_track_thresh = new_track_thresh
+        self.match_thresh = match_thresh  # max 1 - IoU of a match
+        self.low_match_thresh = low_match_thresh
+        self.tentative_match_thresh = tentative_match_thresh
+        self.kf = KalmanFilterXYAH()
+        self.tracks = []
+        self._next_id = 1
+
+    def _associate(self, tracks, dets, raw_detections, det_boxes, thresh):
+        """Match `tracks` to detection indices `dets`; update the matched ones, return the rest."""
+        if not tracks or not len(dets):
+            return list(tracks), np.asarray(dets, dtype=int)
+        cost = 1 - iou_matrix([t.to_ltrb() for t in tracks], det_boxes[dets])
+        matches, unmatched_tracks, unmatched_dets = linear_assignment(cost, thresh)
+        for i, j in matches:
+            self._update(tracks[i], raw_detections[dets[j]])
+        return [tracks[i] for i in unmatched_tracks], np.asarray(dets, dtype=int)[unmatched_dets]
+
+    def _update(self, track, raw_detection):
+        ltwh, conf, det_class = raw_detection
+        track.mean, track.cov = self.kf.update(track.mean, track.cov, ltwh_to_xyah(ltwh))
+        track._set_detection(ltwh, conf)
+        track.det_class = det_class
+        track.hits += 1
+        track.time_since_update = 0
+        if track.is_tentative() and track.hits >= self.n_init:
+            track.state = MotionTrack.CONFIRMED
+
+    def update_tracks(self, raw_detections, embeds=None, frame=None):
+        """
+        raw_detections: [([left, top, w, h], confidence, detection_class), ...] as for
+        DeepSort; `embeds` and `frame` are ignored. Returns the live tracks.
+        """
+        det_boxes = np.array([[l, t, l + w, t + h] for (l, t, w, h), _, _ in raw_detections],
+                             dtype=np.float64).reshape(-1, 4)
+        confs = np.array([conf for _, conf, _ in raw_detections], dtype=np.float64)
+        high = np.flatnonzero(confs >= self.high_thresh)
+        low = np.flatnonzero(confs < self.high_thresh)
+
+        if self.tracks:
+            means, covs = self.kf.predict(np.stack([t.mean for t in self.tracks]),
+                                          np.stack([t.cov for t in self.tracks]))
+            for track, mean, cov in zip(self.tracks, means, covs):
+                track.mean, track.cov = mean, cov
+                track.time_since_update += 1
+
+        confirmed = [t for t in self.tracks if t.is_confirmed()]
+        tentative = [t for t in self.tracks if t.is_tentative()]
+
+        # High-confidence detections first, then the low ones for tracks seen last frame
+        unmatched, high_left = self._associate(confirmed, high, raw_detections, det_boxes, self.match_thresh)
+        recent = [t for t in unmatched if t.time_since_update == 1]
+        self._associate(recent, low, raw_detections, det_boxes, self.low_match_thresh)
+        unmatched_tentative, high_left = self._associate(tentative, high_left, raw_detections, det_boxes,
+                                                         self.tentative_match_thresh)
+
+        for track in unmatched_tentative:
+            track.state = MotionTrack.DELETED
+        for track in confirmed:
+            if track.time_since_update > self.max_age:
+                track.state = MotionTrack.DELETED
+
+        for det in high_left:
+            if confs[det] < self.new_track_thresh:
+                continue
+            ltwh, conf, det_class = raw_detections[det]
+            mean, cov = self.kf.initiate(ltwh_to_xyah(ltwh))
+            self.tracks.append(MotionTrack(self._next_id, ltwh, conf, det_class, mean, cov, self.n_init))
+            self._next_id += 1
+
+        self.tracks = [t for t in self.tracks if not t.is_deleted()]
+        return self.tracks
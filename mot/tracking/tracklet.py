@@ -7,6 +7,7 @@ class TrackletFrame:
     bbox: np.ndarray # [left, top, right, bottom]
     confidence: float
     crop_path: str
+    embedding: np.ndarray = None # tracker-time ReID embedding of the crop, if kept
 
 
 class Tracklet:
@@ -18,9 +19,11 @@ class Tracklet:
         self.reid_embeddings = []
         self.clip_embeddings = []
 
-    def add_frame(self, frame_id, bbox, confidence, image):
+    def add_frame(self, frame_id, bbox, confidence, image, embedding=None):
+        if embedding is not None and np.isnan(embedding).any():
+            embedding = None # track not matched to a detection in this frame
         self.frames.append(
-            TrackletFrame(frame_id, bbox, confidence, image)
+            TrackletFrame(frame_id, bbox, confidence, image, embedding)
         )
 
 
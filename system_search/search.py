@@ -1,3 +1,5 @@
+import os
+import sys
 import torch
 from system_search.model import ReIDModel, CLIPModel
 from qdrant_client import QdrantClient
@@ -7,11 +9,16 @@ from PIL import Image
 import numpy as np
 from collections import defaultdict
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "mmc"))
+from fusion import fuse_embeddings
+
 logger = get_logger("search")
 
 class SystemSearch:
-    def __init__(self):
+    def __init__(self, fused_w_reid=None):
         logger.info("Initializing SystemSearch")
+        # Set to the collection's w_reid to search images on "vector_fused"
+        self.fused_w_reid = fused_w_reid
 
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         logger.info(f"Using device: {self.device}")
@@ -76,16 +83,21 @@ class SystemSearch:
             # Thêm thum_url riêng cho từng track
             track_thum_url = f"static/crops/{seq_id}/{cam_id}/{obj_id}.jpg"
 
-            objects_full_list[global_id].append({
+            track = {
                 "point_id": point.id,
                 "seq_id": seq_id,
                 "cam_id": cam_id,
                 "obj_id": obj_id,
-                "detections": payload["detections"],
                 "frame_start": payload["frame_start"],
                 "frame_end": payload["frame_end"],
                 "thum_url": track_thum_url,  # Ảnh riêng của track
-            })
+            }
+            # Detections dạng list hoặc dạng nén (mmc/track_codec.py), trả nguyên cho client
+            if "detections_codec" in payload:
+                track["detections_codec"] = payload["detections_codec"]
+            else:
+                track["detections"] = payload["detections"]
+            objects_full_list[global_id].append(track)
 
         return objects_full_list
 
@@ -113,7 +125,10 @@ class SystemSearch:
                 img_np = np.array(img)
                 emb_img_reid = self.reidmodel.extract(img_np)[0]
                 emb_img_clip = self.clipmodel.encode_image(img_np)
-                objects = self.search_image_only(emb_img_reid, emb_img_clip, max_results)
+                if self.fused_w_reid is not None:
+                    objects = self.search_image_fused(emb_img_reid, emb_img_clip, self.fused_w_reid, max_results)
+                else:
+                    objects = self.search_image_only(emb_img_reid, emb_img_clip, max_results)
             elif text_query and image_path:  # Có cả 2
                 emb_text = self.clipmodel.encode_text(text_query)
                 img = Image.open(image_path).convert('RGB')
@@ -190,6 +205,23 @@ class SystemSearch:
             group_size=1,
         )
 
+    def search_image_fused(self, vector_reid, vector_clip_image, w_reid=0.7, limit=10):
+        """
+        Single-vector image search on "vector_fused" (see database/upload_data.py),
+        scoring w_reid·cos(reid) + (1-w_reid)·cos(clip) instead of two prefetches + RRF.
+        w_reid must match the value the collection was built with.
+        """
+        vector_fused = fuse_embeddings(vector_reid, vector_clip_image, w_reid, normalize=True)
+        return self.client.query_points_groups(
+            collection_name=self.collection_name,
+            query=vector_fused.tolist(),
+            using="vector_fused",
+            group_by="global_id",
+            group_size=1,
+            limit=limit,
+            with_payload=True
+        )
+
     def search_hybrid(self, vector_reid, vector_clip_text, limit=30):
         return self.client.query_points_groups(
             collection_name=self.collection_name,
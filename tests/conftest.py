@@ -0,0 +1,49 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "mmc"))
+
+
+@pytest.fixture(scope='session')
+def mmc_cwd(tmp_path_factory):
+    """
+    Working directory with the files mmc/config.py reads on import, for the
+    matching modules (config loads data/metadata/temporal_configs.json from the cwd).
+    """
+    root = tmp_path_factory.mktemp('mmc')
+    os.makedirs(root / 'data' / 'metadata')
+    with open(root / 'data' / 'metadata' / 'temporal_configs.json', 'w') as f:
+        json.dump({}, f)
+    return root
+
+
+@pytest.fixture(scope='session')
+def maching_cam(mmc_cwd):
+    cwd = os.getcwd()
+    os.chdir(mmc_cwd)
+    try:
+        import maching_cam
+    finally:
+        os.chdir(cwd)
+    return maching_cam
+
+
+@pytest.fixture(scope='session')
+def matching_seq(maching_cam):
+    import matching_seq
+    return matching_seq
+
+
+@pytest.fixture(scope='session')
+def sharding(matching_seq):
+    import sharding
+    return sharding
+
+
+@pytest.fixture(scope='session')
+def pipeline(matching_seq):
+    import pipeline
+    return pipeline
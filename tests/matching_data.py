@@ -0,0 +1,40 @@
+import numpy as np
+
+# Small synthetic inputs for the clustering engines: noisy embeddings around a few
+# identities, so that thresholds and the time / camera constraints all matter.
+
+
+def _normalize(x):
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+
+def tracklets(n=60, n_ids=8, seed=0):
+    """(reid, clip, intervals) of `n` tracklets of one camera."""
+    rng = np.random.default_rng(seed)
+    ids = rng.integers(n_ids, size=n)
+    reid = _normalize(rng.normal(size=(n_ids, 32))[ids] + 0.6 * rng.normal(size=(n, 32)))
+    clip = _normalize(rng.normal(size=(n_ids, 16))[ids] + 0.6 * rng.normal(size=(n, 16)))
+    starts = rng.integers(0, 2000, size=n)
+    intervals = [(int(s), int(s + rng.integers(10, 300))) for s in starts]
+    return reid, clip, intervals
+
+
+def nodes(node_class, n=50, n_ids=6, seed=1):
+    """`n` single-track global matching nodes spread over 3 sequences and 4 cameras."""
+    reid, clip, _ = tracklets(n, n_ids, seed)
+    rng = np.random.default_rng(seed)
+    result = []
+    for i in range(n):
+        node = node_class()
+        node.id = i
+        node.seq_id = int(rng.integers(3))
+        node.cam_id = int(rng.integers(4))
+        node.track_keys = [(node.seq_id, node.cam_id, i)]
+        node.reid_average, node.clip_average = reid[i], clip[i]
+        result.append(node)
+    return result
+
+
+def as_sets(clusters):
+    """Clusters in a canonical order, for comparing engines."""
+    return sorted(sorted(int(i) for i in cluster) for cluster in clusters)
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from detection_store import convert_metadata_dir
+
+# (seq_id, cam_id) -> {obj_id: frames}
+TRACKS = {
+    (0, 1): {1: [10, 11, 12], 2: [40, 45]},
+    (0, 2): {7: [100, 130]},
+    (1, 1): {3: [5, 6]},
+}
+
+
+@pytest.fixture
+def metadata_dir(tmp_path):
+    root = tmp_path / 'metadata'
+    for (seq_id, cam_id), tracks in TRACKS.items():
+        seq_dir = root / f"seq_{seq_id:03d}"
+        os.makedirs(seq_dir, exist_ok=True)
+        with open(seq_dir / f"seq_{seq_id:03d}_camera_{cam_id}.txt", 'w') as f:
+            for obj_id, frames in tracks.items():
+                for frame in frames:
+                    f.write(f"{seq_id} {cam_id} {frame} {obj_id} 10 20 50 120\n")
+    return str(root)
+
+
+def _nodes(matching_seq):
+    nodes = []
+    for seq_id, cam_id, keys in ((0, 1, [(0, 1, 1), (0, 1, 2)]), (0, 2, [(0, 2, 7)]), (1, 1, [(1, 1, 3)]),
+                                 (1, 3, [(1, 3, 9)])):
+        node = matching_seq.Node()
+        node.id, node.seq_id, node.cam_id, node.track_keys = len(nodes), seq_id, cam_id, keys
+        nodes.append(node)
+    return nodes
+
+
+def test_node_intervals_from_text_and_detection_store(matching_seq, metadata_dir, tmp_path):
+    expected = [(10, 45), (100, 130), (5, 6), (0, -1)]
+    nodes = _nodes(matching_seq)
+    matching_seq.compute_node_intervals(nodes, metadata_dir)
+    assert [node.interval for node in nodes] == expected
+
+    store_dir = str(tmp_path / 'store')
+    convert_metadata_dir(metadata_dir, store_dir)
+    nodes = _nodes(matching_seq)
+    matching_seq.compute_node_intervals(nodes, metadata_dir='missing', detection_store=store_dir)
+    assert [node.interval for node in nodes] == expected
+
+
+def test_block_node_pairs_reads_the_detection_store(matching_seq, metadata_dir, tmp_path):
+    store_dir = str(tmp_path / 'store')
+    convert_metadata_dir(metadata_dir, store_dir)
+    from_text, _ = matching_seq.block_node_pairs(_nodes(matching_seq), metadata_dir)
+    from_store, report = matching_seq.block_node_pairs(_nodes(matching_seq), 'missing', store_dir)
+    assert (from_text == from_store).all()
+    assert from_store.shape == (4, 4)
@@ -0,0 +1,18 @@
+import pytest
+
+from matching_data import as_sets, tracklets
+
+
+@pytest.mark.parametrize('tau', [0.6, 0.75])
+def test_heap_engine_matches_legacy(maching_cam, tau):
+    reid, clip, intervals = tracklets()
+    expected = as_sets(maching_cam.agglomerative_with_time_constraint_weighted(reid, clip, intervals, tau=tau))
+    assert len(expected) < len(reid)
+    assert as_sets(maching_cam.agglomerative_with_time_constraint_heap(reid, clip, intervals, tau=tau)) == expected
+
+
+def test_heap_engine_keeps_overlapping_tracklets_apart(maching_cam):
+    reid, clip, intervals = tracklets()
+    for cluster in maching_cam.agglomerative_with_time_constraint_heap(reid, clip, intervals, tau=0.5):
+        spans = sorted(intervals[i] for i in cluster)
+        assert all(a[1] < b[0] for a, b in zip(spans, spans[1:]))
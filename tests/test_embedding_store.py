@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from embedding_store import EmbeddingStore, encode_keys
+
+DIMS = {'reid': 4, 'clip': 3}
+
+
+def _vectors(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return {name: rng.normal(size=(n, dim)).astype(np.float32) for name, dim in DIMS.items()}
+
+
+@pytest.fixture(params=['float32', 'float16', 'int8'])
+def store(request, tmp_path):
+    return EmbeddingStore.create(str(tmp_path / 'store'), dtype=request.param, dims=DIMS)
+
+
+def _tolerance(store):
+    return {np.dtype(np.float32): 1e-6, np.dtype(np.float16): 1e-2, np.dtype(np.int8): 5e-2}[store.dtype]
+
+
+def test_append_and_lookup(store):
+    keys = np.array([[1, 2, 30], [0, 5, 7], [1, 1, 4]])
+    vectors = _vectors(3)
+    store.append(keys, **vectors)
+    more_keys = np.array([[0, 5, 3], [2, 0, 0]])
+    more = _vectors(2, seed=1)
+    store.append(more_keys, **more)
+
+    assert len(store) == 5
+    np.testing.assert_array_equal(store.rows([[2, 0, 0], [1, 2, 30], [0, 5, 3]]), [4, 0, 3])
+    for name in DIMS:
+        np.testing.assert_allclose(store.get(name, keys), vectors[name], atol=_tolerance(store))
+        np.testing.assert_allclose(store.get(name, more_keys[::-1]), more[name][::-1], atol=_tolerance(store))
+    assert (1, 1, 4) in store
+    assert (1, 1, 5) not in store
+    np.testing.assert_array_equal(store.select(0), [1, 3])
+    np.testing.assert_array_equal(store.select(1, 2), [0])
+
+
+def test_store_reopens_with_committed_rows(store):
+    keys = np.array([[0, 1, 1], [0, 1, 2]])
+    vectors = _vectors(2)
+    store.append(keys, **vectors)
+    reopened = EmbeddingStore(store.store_dir)
+    assert len(reopened) == 2
+    np.testing.assert_allclose(reopened.get('reid', keys), vectors['reid'], atol=_tolerance(store))
+
+
+def test_missing_keys(store):
+    store.append([[0, 1, 1]], **_vectors(1))
+    with pytest.raises(KeyError):
+        store.rows([[0, 1, 1], [0, 1, 2]])
+    np.testing.assert_array_equal(store.rows([[0, 1, 1], [0, 1, 2]], missing='ignore'), [0, -1])
+
+
+def test_duplicate_keys_are_rejected(store):
+    store.append([[0, 1, 1]], **_vectors(1))
+    with pytest.raises(ValueError, match="Duplicate keys"):
+        store.append([[0, 1, 1]], **_vectors(1))
+    with pytest.raises(ValueError, match="Duplicate keys"):
+        store.append([[0, 1, 2], [0, 1, 2]], **_vectors(2))
+    with pytest.raises(ValueError, match="Duplicate keys"):
+        store.upsert([[0, 1, 3], [0, 1, 3]], **_vectors(2))
+    assert len(store) == 1
+
+
+def test_upsert_overwrites_and_appends(store):
+    store.append([[0, 1, 1], [0, 1, 2]], **_vectors(2))
+    new = _vectors(2, seed=3)
+    assert store.upsert([[0, 1, 2], [0, 1, 5]], **new) == 1
+    assert len(store) == 3
+    for name in DIMS:
+        np.testing.assert_allclose(store.get(name, [[0, 1, 2], [0, 1, 5]]), new[name], atol=_tolerance(store))
+
+
+def test_wrong_modalities_are_rejected(store):
+    with pytest.raises(ValueError):
+        store.append([[0, 1, 1]], reid=_vectors(1)['reid'])
+
+
+def test_key_range():
+    limits = [(1 << 21) - 1, (1 << 10) - 1, (1 << 32) - 1]
+    codes = encode_keys([[0, 0, 0], limits, [0, 0, 1], [0, 1, 0], [1, 0, 0]])
+    assert codes[0] == 0 and codes[1] == np.iinfo(np.int64).max
+    assert list(codes[2:]) == sorted(codes[2:])
+    for bad in ([1 << 21, 0, 0], [0, 1 << 10, 0], [0, 0, 1 << 32], [0, -1, 0]):
+        with pytest.raises(ValueError, match="outside the packed key range"):
+            encode_keys([bad])
+
+
+def test_out_of_range_keys_are_not_appended(store):
+    with pytest.raises(ValueError):
+        store.append([[0, 0, 1 << 32]], **_vectors(1))
+    assert len(store) == 0
+
+
+def test_int8_matrix_is_dequantized(tmp_path):
+    store = EmbeddingStore.create(str(tmp_path / 'store'), dtype='int8', dims=DIMS)
+    vectors = _vectors(5)
+    store.append([[0, 1, i] for i in range(5)], **vectors)
+    matrix = store.matrix('reid')
+    assert len(matrix) == 5
+    np.testing.assert_allclose(matrix[1:4], store.take('reid', slice(1, 4)))
+    np.testing.assert_allclose(np.asarray(matrix), vectors['reid'], atol=5e-2)
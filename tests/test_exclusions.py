@@ -0,0 +1,42 @@
+import numpy as np
+
+from exclusions import ExclusionSet, keys_from_ids_json, load_exclusions
+
+
+def test_add_remove_and_reload(tmp_path):
+    path = str(tmp_path / 'sub' / 'exclusions.npz')
+    exclusions = ExclusionSet(path)
+    assert len(exclusions) == 0 and (0, 1, 2) not in exclusions
+
+    assert exclusions.add([(0, 1, 2), (3, 4, 5), (0, 1, 2)], 'single_image') == 2
+    assert exclusions.add([(3, 4, 5), (1, 1, 1)], 'short') == 1
+    reloaded = ExclusionSet(path)
+    assert len(reloaded) == 3
+    assert (0, 1, 2) in reloaded and (1, 1, 1) in reloaded and (0, 1, 3) not in reloaded
+    assert reloaded.counts() == {'single_image': 2, 'short': 1}
+
+    assert reloaded.remove([(3, 4, 5), (9, 9, 9)]) == 1
+    assert sorted(map(tuple, ExclusionSet(path).keys.tolist())) == [(0, 1, 2), (1, 1, 1)]
+
+
+def test_mask_and_filter(tmp_path):
+    exclusions = ExclusionSet(str(tmp_path / 'exclusions.npz'))
+    mapping = {(0, 1, i): i for i in range(5)}
+    assert exclusions.filter(mapping) == mapping
+    assert not exclusions.mask(list(mapping)).any()
+
+    exclusions.add([(0, 1, 1), (0, 1, 3), (2, 0, 0)])
+    np.testing.assert_array_equal(exclusions.mask(list(mapping)), [False, True, False, True, False])
+    assert exclusions.filter(mapping) == {(0, 1, 0): 0, (0, 1, 2): 2, (0, 1, 4): 4}
+    assert len(mapping) == 5
+
+
+def test_load_exclusions_is_opt_in(tmp_path):
+    assert load_exclusions(None) is None
+    assert len(load_exclusions(str(tmp_path / 'missing.npz'))) == 0
+
+
+def test_keys_from_ids_json():
+    keys = keys_from_ids_json({'seq_000': {'camera_1': ['100001', '7']}, 'seq_012': {'camera_3': ['5']}})
+    assert sorted(map(tuple, keys.tolist())) == [(0, 1, 7), (0, 1, 100001), (12, 3, 5)]
+    assert keys_from_ids_json({}).shape == (0, 3)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from fusion import fuse_embeddings, fused_similarity_matrix
+from matching_data import as_sets, nodes, tracklets
+
+
+@pytest.mark.parametrize('w_reid', [0.0, 0.3, 0.7, 1.0])
+def test_fused_product_is_the_weighted_similarity(w_reid):
+    reid, clip, _ = tracklets()
+    fused = fuse_embeddings(reid, clip, w_reid)
+    np.testing.assert_allclose(np.linalg.norm(fused, axis=1), 1, atol=1e-5)
+    expected = w_reid * (reid @ reid.T) + (1 - w_reid) * (clip @ clip.T)
+    np.testing.assert_allclose(fused_similarity_matrix(fused), expected, atol=1e-5)
+
+
+def test_normalize_fuses_raw_vectors():
+    reid, clip, _ = tracklets()
+    fused = fuse_embeddings(3 * reid, 0.5 * clip, 0.7, normalize=True)
+    np.testing.assert_allclose(fused, fuse_embeddings(reid, clip, 0.7), atol=1e-6)
+    np.testing.assert_allclose(fuse_embeddings(reid[0], clip[0], 0.7), fused[0], atol=1e-6)
+
+
+def test_fused_camera_engines_match_legacy(maching_cam):
+    reid, clip, intervals = tracklets()
+    expected = as_sets(maching_cam.agglomerative_with_time_constraint_weighted(reid, clip, intervals, tau=0.75))
+    assert as_sets(maching_cam.agglomerative_with_time_constraint_heap(
+        reid, clip, intervals, tau=0.75, fused=True)) == expected
+    assert as_sets(maching_cam.agglomerative_with_time_constraint_knn(
+        reid, clip, intervals, tau=0.75, k=len(reid) - 1, fused=True)) == expected
+
+
+def test_fused_global_engine_matches_legacy(matching_seq):
+    items = nodes(matching_seq.Node)
+    thresholds = {'tau_same_seq': 0.8, 'tau_diff_seq': 0.7}
+    expected = as_sets(matching_seq.agglomerative_clustering_global(items, **thresholds))
+    assert as_sets(matching_seq.agglomerative_clustering_global_heap(items, fused=True, **thresholds)) == expected
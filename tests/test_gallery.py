@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+from crop_catalog import pack_camera
+from gallery import GALLERY_MODES, build_galleries, changed_global_ids, load_manifest, read_gallery_image
+
+# (seq_id, cam_id) -> {obj_id: frames}; camera 2 is packed
+CROPS = {
+    (0, 1): {1: [3, 4], 2: [7]},
+    (0, 2): {5: [10, 11, 12]},
+}
+CLUSTERS = [[(0, 1, 1), (0, 2, 5)], [(0, 1, 2)]]
+
+
+def _crop_bytes(seq_id, cam_id, obj_id, frame_id):
+    return f"crop {seq_id} {cam_id} {obj_id} {frame_id}".encode()
+
+
+@pytest.fixture
+def crops_dir(tmp_path):
+    root = tmp_path / 'crops'
+    for (seq_id, cam_id), objects in CROPS.items():
+        camera_dir = root / f"seq_{seq_id:03d}" / f"camera_{cam_id}"
+        os.makedirs(camera_dir)
+        for obj_id, frames in objects.items():
+            for frame_id in frames:
+                (camera_dir / f"{obj_id}_{frame_id:06d}.webp").write_bytes(
+                    _crop_bytes(seq_id, cam_id, obj_id, frame_id))
+    pack_camera(str(root / 'seq_000' / 'camera_2'))
+    return str(root)
+
+
+def _expected(clusters):
+    """{global_id: {gallery file name: bytes}}"""
+    return {
+        global_id: {
+            f"seq_{seq_id:03d}_cam_{cam_id}_obj_{obj_id:05d}_frame_{frame_id:06d}.webp":
+                _crop_bytes(seq_id, cam_id, obj_id, frame_id)
+            for seq_id, cam_id, obj_id in keys for frame_id in CROPS[(seq_id, cam_id)][obj_id]
+        }
+        for global_id, keys in enumerate(clusters) if keys
+    }
+
+
+def _read_folders(output_dir):
+    galleries = {}
+    for folder in sorted(os.listdir(output_dir)):
+        if folder.startswith('global_id_'):
+            path = os.path.join(output_dir, folder)
+            galleries[int(folder[len('global_id_'):])] = {
+                name: open(os.path.join(path, name), 'rb').read() for name in os.listdir(path)
+            }
+    return galleries
+
+
+def _read_manifest(output_dir):
+    return {global_id: {entry['name']: read_gallery_image(entry) for entry in entries}
+            for global_id, entries in load_manifest(output_dir).items()}
+
+
+@pytest.mark.parametrize('mode', [mode for mode in GALLERY_MODES if mode != 'manifest'])
+def test_file_galleries(crops_dir, tmp_path, mode):
+    output_dir = str(tmp_path / 'galleries')
+    assert build_galleries(CLUSTERS, crops_dir, output_dir, mode=mode, workers=2) == 6
+    assert _read_folders(output_dir) == _expected(CLUSTERS)
+
+    linked = os.path.join(output_dir, 'global_id_001', 'seq_000_cam_1_obj_00002_frame_000007.webp')
+    packed = os.path.join(output_dir, 'global_id_000', 'seq_000_cam_2_obj_00005_frame_000010.webp')
+    source = os.path.join(crops_dir, 'seq_000', 'camera_1', '2_000007.webp')
+    assert os.path.islink(linked) == (mode == 'symlink')
+    assert os.path.samefile(linked, source) == (mode != 'copy')
+    # Packed cameras have no crop files to link to
+    assert not os.path.islink(packed)
+
+
+def test_manifest_paths_are_relative_to_the_manifest(crops_dir, tmp_path, monkeypatch):
+    output_dir = str(tmp_path / 'galleries')
+    assert build_galleries(CLUSTERS, crops_dir, output_dir, mode='manifest') == 6
+    assert not any(name.startswith('global_id_') for name in os.listdir(output_dir))
+
+    # Readable from another working directory and after moving the whole tree
+    monkeypatch.chdir(str(tmp_path / 'crops'))
+    assert _read_manifest(output_dir) == _expected(CLUSTERS)
+    moved = str(tmp_path.parent / (tmp_path.name + '_moved'))
+    os.rename(str(tmp_path), moved)
+    monkeypatch.chdir(moved)
+    assert _read_manifest(os.path.join(moved, 'galleries')) == _expected(CLUSTERS)
+
+
+@pytest.mark.parametrize('mode', ['copy', 'manifest'])
+def test_incremental_update_and_stale_galleries(crops_dir, tmp_path, mode):
+    output_dir = str(tmp_path / 'galleries')
+    read = _read_manifest if mode == 'manifest' else _read_folders
+    build_galleries(CLUSTERS + [[(0, 2, 5)]], crops_dir, output_dir, mode=mode)
+
+    # ID 1 retired into ID 0, ID 2 gone: only the changed IDs are rewritten
+    updated = [[(0, 1, 1), (0, 1, 2), (0, 2, 5)], []]
+    changed = changed_global_ids(CLUSTERS + [[(0, 2, 5)]], updated)
+    assert changed == {0, 1, 2}
+    build_galleries(updated, crops_dir, output_dir, global_ids=changed, mode=mode)
+    assert read(output_dir) == _expected(updated)
+
+    # A full rebuild with fewer clusters drops the galleries past the last one
+    build_galleries(CLUSTERS[:1], crops_dir, output_dir, mode=mode)
+    assert read(output_dir) == _expected(CLUSTERS[:1])
+
+
+def test_unknown_mode_is_rejected(crops_dir, tmp_path):
+    with pytest.raises(ValueError):
+        build_galleries(CLUSTERS, crops_dir, str(tmp_path / 'galleries'), mode='move')
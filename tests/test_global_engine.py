@@ -0,0 +1,17 @@
+from matching_data import as_sets, nodes
+
+THRESHOLDS = {'tau_same_seq': 0.8, 'tau_diff_seq': 0.7}
+
+
+def test_heap_engine_matches_legacy(matching_seq):
+    items = nodes(matching_seq.Node)
+    expected = as_sets(matching_seq.agglomerative_clustering_global(items, **THRESHOLDS))
+    assert len(expected) < len(items)
+    assert as_sets(matching_seq.agglomerative_clustering_global_heap(items, **THRESHOLDS)) == expected
+
+
+def test_heap_engine_never_merges_a_camera_with_itself(matching_seq):
+    items = nodes(matching_seq.Node)
+    for cluster in matching_seq.agglomerative_clustering_global_heap(items, **THRESHOLDS):
+        seq_cams = [(items[i].seq_id, items[i].cam_id) for i in cluster]
+        assert len(seq_cams) == len(set(seq_cams))
@@ -0,0 +1,55 @@
+import numpy as np
+
+from knn_graph import knn_graph
+from matching_data import as_sets, nodes, tracklets
+
+
+def _pairs(rows, cols):
+    return set(zip(rows.tolist(), cols.tolist()))
+
+
+def test_full_graph_has_every_pair_above_min_sim():
+    reid, clip, _ = tracklets()
+    sim = 0.7 * (reid @ reid.T) + 0.3 * (clip @ clip.T)
+    expected = {(i, j) for i, j in zip(*np.nonzero(np.triu(sim > 0.6, 1)))}
+
+    rows, cols, sims = knn_graph(reid, clip, k=len(reid) - 1, min_sim=0.6, backend='numpy')
+    assert (rows < cols).all()
+    assert _pairs(rows, cols) == expected
+    np.testing.assert_allclose(sims, sim[rows, cols], atol=1e-5)
+
+
+def test_small_k_keeps_each_items_best_neighbors():
+    reid, clip, _ = tracklets()
+    sim = 0.7 * (reid @ reid.T) + 0.3 * (clip @ clip.T)
+    np.fill_diagonal(sim, -np.inf)
+    rows, cols, _ = knn_graph(reid, clip, k=3, backend='numpy', block_size=7)
+    edges = _pairs(rows, cols)
+    for i, row in enumerate(sim):
+        for j in np.argsort(-row)[:3].tolist():
+            assert (min(i, j), max(i, j)) in edges
+    assert len(edges) <= 3 * len(reid)
+
+
+def test_camera_knn_engine_matches_legacy(maching_cam):
+    reid, clip, intervals = tracklets()
+    expected = as_sets(maching_cam.agglomerative_with_time_constraint_weighted(reid, clip, intervals, tau=0.75))
+    clusters = maching_cam.agglomerative_with_time_constraint_knn(reid, clip, intervals, tau=0.75, k=len(reid) - 1)
+    assert as_sets(clusters) == expected
+
+
+def test_camera_knn_without_time_constraint_gives_components(maching_cam):
+    reid, clip, intervals = tracklets()
+    clusters = maching_cam.agglomerative_with_time_constraint_knn(reid, clip, intervals, tau=0.75,
+                                                                  k=len(reid) - 1, time_constraint=False)
+    assert sorted(i for cluster in clusters for i in cluster) == list(range(len(reid)))
+    constrained = maching_cam.agglomerative_with_time_constraint_heap(reid, clip, intervals, tau=0.75)
+    assert len(clusters) < len(constrained)
+
+
+def test_global_knn_engine_matches_legacy(matching_seq):
+    items = nodes(matching_seq.Node)
+    thresholds = {'tau_same_seq': 0.8, 'tau_diff_seq': 0.7}
+    expected = as_sets(matching_seq.agglomerative_clustering_global(items, **thresholds))
+    clusters = matching_seq.agglomerative_clustering_global_knn(items, k=len(items) - 1, **thresholds)
+    assert as_sets(clusters) == expected
@@ -0,0 +1,61 @@
+import pytest
+
+from matching_data import as_sets, nodes, tracklets
+from merge_tree import MergeTree
+
+
+def _camera_tree(maching_cam, floor=0.5):
+    reid, clip, intervals = tracklets()
+    history = []
+    maching_cam.agglomerative_with_time_constraint_heap(reid, clip, intervals, tau=floor, history=history)
+    keys = [(0, 1, i) for i in range(len(reid))]
+    return MergeTree.from_history('camera', history, [[key] for key in keys], [0] * len(keys),
+                                  floor=floor, w_reid=0.7)
+
+
+@pytest.mark.parametrize('tau', [0.5, 0.6, 0.75])
+def test_camera_cut_matches_clustering_at_the_threshold(maching_cam, tau):
+    reid, clip, intervals = tracklets()
+    expected = maching_cam.agglomerative_with_time_constraint_weighted(reid, clip, intervals, tau=tau)
+    assert as_sets(_camera_tree(maching_cam).cut(tau=tau)) == as_sets(expected)
+
+
+def _global_tree(matching_seq, items, floor=0.6):
+    history = []
+    matching_seq.agglomerative_clustering_global_heap(items, tau_same_seq=floor, tau_diff_seq=floor, history=history)
+    return MergeTree.from_history('global', history, [node.track_keys for node in items],
+                                  [node.seq_id for node in items], floor=floor, w_reid=0.7)
+
+
+@pytest.mark.parametrize('tau', [0.6, 0.7, 0.8])
+def test_global_cut_matches_clustering_at_one_threshold(matching_seq, tau):
+    items = nodes(matching_seq.Node)
+    expected = matching_seq.agglomerative_clustering_global(items, tau_same_seq=tau, tau_diff_seq=tau)
+    assert as_sets(_global_tree(matching_seq, items).cut(tau=tau)) == as_sets(expected)
+
+
+@pytest.mark.parametrize('same, diff', [(0.8, 0.7), (0.7, 0.8)])
+def test_global_cut_at_two_thresholds_is_conservative(matching_seq, same, diff):
+    items = nodes(matching_seq.Node)
+    expected = [set(cluster) for cluster in
+                matching_seq.agglomerative_clustering_global(items, tau_same_seq=same, tau_diff_seq=diff)]
+    clusters = _global_tree(matching_seq, items).cut(tau_same_seq=same, tau_diff_seq=diff)
+    assert sorted(i for cluster in clusters for i in cluster) == list(range(len(items)))
+    assert all(any(cluster <= other for other in expected) for cluster in clusters)
+
+
+def test_save_load_and_cluster_keys(maching_cam, tmp_path):
+    tree = _camera_tree(maching_cam)
+    path = str(tmp_path / 'tree.npz')
+    tree.save(path)
+    loaded = MergeTree.load(path)
+    assert loaded.stage == 'camera' and loaded.floor == tree.floor
+    clusters = loaded.cut(tau=0.75)
+    assert as_sets(clusters) == as_sets(tree.cut(tau=0.75))
+    keys = loaded.cluster_keys(clusters)
+    assert sorted(key for cluster in keys for key in cluster) == [(0, 1, i) for i in range(tree.n_items)]
+
+
+def test_cut_below_the_floor_is_rejected(maching_cam):
+    with pytest.raises(ValueError):
+        _camera_tree(maching_cam).cut(tau=0.4)
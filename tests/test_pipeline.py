@@ -0,0 +1,127 @@
+import os
+
+import pytest
+
+# (seq, cam) -> {obj_id: number of crops}
+CROPS = {
+    ('seq_000', 'camera_1'): {1: 3, 2: 1},
+    ('seq_000', 'camera_2'): {5: 2},
+    ('seq_001', 'camera_1'): {7: 1, 8: 4},
+}
+
+
+def _write(path, data=b''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+@pytest.fixture
+def site(pipeline, tmp_path, monkeypatch):
+    """A site in a temporary working directory: metadata, features and crops of three cameras."""
+    monkeypatch.chdir(tmp_path)
+    for (seq, cam), objects in CROPS.items():
+        _write(os.path.join('data/new_metadata_objects', seq, f"{seq}_{cam}.txt"), f"{seq} {cam}\n".encode())
+        _write(os.path.join(pipeline.FEATURE_DIR, seq, f"{seq}_{cam}.pkl"), b'features')
+        for obj_id, n_crops in objects.items():
+            for frame_id in range(n_crops):
+                _write(os.path.join('data/crops', seq, cam, f"{obj_id}_{frame_id:06d}.webp"), b'crop')
+    return tmp_path
+
+
+@pytest.fixture
+def jobs(pipeline, monkeypatch):
+    """Stand-in for the single-camera matching job: records its runs, fails the partitions in `failing`."""
+    runs, failing = [], set()
+
+    def run_job(seq, cam, log_path, kwargs):
+        runs.append(f"{seq}/{cam}")
+        if f"{seq}/{cam}" in failing:
+            return {'seq': seq, 'cam': cam, 'log': log_path, 'status': 'failed', 'error': 'boom', 'seconds': 0.0}
+        _write(os.path.join(kwargs['results_dir'], f"{seq}_{cam}_results.pkl"), b'results')
+        os.makedirs(os.path.join(kwargs['output_dir'], seq, cam), exist_ok=True)
+        return {'seq': seq, 'cam': cam, 'log': log_path, 'status': 'ok', 'n_clusters': 1, 'seconds': 0.0}
+
+    monkeypatch.setattr(pipeline, '_run_matching_job', run_job)
+    return runs, failing
+
+
+def _pipeline(pipeline, **kwargs):
+    return pipeline.Pipeline(workers=1, **kwargs)
+
+
+def test_content_fingerprints_ignore_touches(pipeline, tmp_path):
+    path = str(tmp_path / 'file')
+    _write(path, b'one')
+    content, mtime = pipeline.Fingerprints('content'), pipeline.Fingerprints('mtime')
+    before = content.file(path), mtime.file(path)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert content.file(path) == before[0]
+    assert mtime.file(path) != before[1]
+    _write(path, b'two')
+    assert content.file(path) != before[0]
+    assert content.file(str(tmp_path / 'missing')) is None
+
+
+def test_exclusions_stage_runs_only_changed_cameras(pipeline, site):
+    from exclusions import ExclusionSet
+
+    changed, _ = _pipeline(pipeline).run_exclusions()
+    assert changed == ['seq_000/camera_1', 'seq_000/camera_2', 'seq_001/camera_1']
+    assert sorted(map(tuple, ExclusionSet('data/exclusions.npz').keys.tolist())) == [(0, 1, 2), (1, 1, 7)]
+    assert _pipeline(pipeline).run_exclusions() == ([], [])
+
+    # A second crop for object 2: only its camera runs and the key is no longer excluded
+    _write('data/crops/seq_000/camera_1/2_000001.webp', b'crop')
+    assert _pipeline(pipeline).run_exclusions()[0] == ['seq_000/camera_1']
+    assert sorted(map(tuple, ExclusionSet('data/exclusions.npz').keys.tolist())) == [(1, 1, 7)]
+
+    # A lost output makes every partition that wrote it run again
+    os.remove('data/exclusions.npz')
+    assert len(_pipeline(pipeline).run_exclusions()[0]) == 3
+
+
+def test_cluster_stage_skips_unchanged_partitions(pipeline, site, jobs):
+    runs, _ = jobs
+    assert _pipeline(pipeline).run_cluster()[0] == sorted(f"{seq}/{cam}" for seq, cam in CROPS)
+    runs.clear()
+    assert _pipeline(pipeline).run_cluster() == ([], [])
+    assert runs == []
+
+    _write('data/new_metadata_objects/seq_001/seq_001_camera_1.txt', b'new detections\n')
+    assert _pipeline(pipeline).run_cluster()[0] == ['seq_001/camera_1']
+    # Touching a file without changing it is not a change
+    os.utime('data/new_metadata_objects/seq_001/seq_001_camera_1.txt')
+    assert _pipeline(pipeline).run_cluster() == ([], [])
+
+    # Results of a removed partition output are rebuilt
+    os.remove('new_clusters/results/seq_000_camera_2_results.pkl')
+    assert _pipeline(pipeline).run_cluster()[0] == ['seq_000/camera_2']
+    # So is everything with --force, and a dry run only lists without running
+    runs.clear()
+    assert _pipeline(pipeline, dry_run=True, force=True).run_cluster()[0] == sorted(f"{s}/{c}" for s, c in CROPS)
+    assert runs == []
+
+
+def test_exclusions_changes_re_cluster_their_camera(pipeline, site, jobs):
+    runs, _ = jobs
+    report = _pipeline(pipeline).run(['exclusions', 'cluster'])
+    assert len(report['cluster'][0]) == 3
+    _write('data/crops/seq_001/camera_1/7_000001.webp', b'crop')
+    report = _pipeline(pipeline).run(['exclusions', 'cluster'])
+    assert report == {'exclusions': (['seq_001/camera_1'], []), 'cluster': (['seq_001/camera_1'], [])}
+
+
+def test_failed_partitions_run_again_and_stop_later_stages(pipeline, site, jobs, monkeypatch):
+    runs, failing = jobs
+    failing.add('seq_000/camera_2')
+    monkeypatch.setattr(pipeline.Pipeline, 'run_global', lambda self: pytest.fail("global stage ran"))
+    report = _pipeline(pipeline).run(['cluster', 'global'])
+    assert report == {'cluster': (['seq_000/camera_1', 'seq_001/camera_1'], ['seq_000/camera_2'])}
+    assert not os.path.exists('new_clusters/results/seq_000_camera_2_results.pkl')
+
+    failing.clear()
+    runs.clear()
+    assert _pipeline(pipeline).run_cluster() == (['seq_000/camera_2'], [])
+    assert runs == ['seq_000/camera_2']
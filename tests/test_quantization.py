@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from knn_graph import knn_graph
+from matching_data import as_sets, nodes, tracklets
+from quantization import quantize_int8, similarity_candidates
+
+LOW_PRECISIONS = ['float16', 'int8']
+
+
+def test_int8_codes_are_within_half_a_step():
+    reid, _, _ = tracklets()
+    codes, scales = quantize_int8(reid)
+    assert codes.dtype == np.int8 and np.abs(codes).max() == 127
+    assert (np.abs(codes * scales[:, None] - reid) <= scales[:, None] / 2 + 1e-7).all()
+    codes, scales = quantize_int8(np.zeros((2, 4), dtype=np.float32))
+    assert not codes.any() and (scales == 1).all()
+
+
+@pytest.mark.parametrize('precision', LOW_PRECISIONS)
+@pytest.mark.parametrize('fused', [False, True])
+def test_candidates_are_exactly_the_pairs_above_min_sim(precision, fused):
+    reid, clip, _ = tracklets()
+    sim = 0.7 * (reid @ reid.T) + 0.3 * (clip @ clip.T)
+    expected = {(i, j) for i, j in zip(*np.nonzero(np.triu(sim > 0.6, 1)))}
+
+    rows, cols, sims = similarity_candidates(reid, clip, 0.7, precision, min_sim=0.6, fused=fused, block_size=16)
+    assert set(zip(rows.tolist(), cols.tolist())) == expected
+    np.testing.assert_allclose(sims, sim[rows, cols], atol=1e-5)
+
+
+@pytest.mark.parametrize('precision', LOW_PRECISIONS)
+def test_low_precision_knn_graph_matches_float32(precision):
+    reid, clip, _ = tracklets()
+    expected = knn_graph(reid, clip, k=len(reid) - 1, min_sim=0.6, backend='numpy')
+    rows, cols, sims = knn_graph(reid, clip, k=len(reid) - 1, min_sim=0.6, backend='numpy', precision=precision)
+    assert set(zip(rows.tolist(), cols.tolist())) == set(zip(expected[0].tolist(), expected[1].tolist()))
+
+
+@pytest.mark.parametrize('precision', LOW_PRECISIONS)
+def test_low_precision_camera_engines_match_legacy(maching_cam, precision):
+    reid, clip, intervals = tracklets()
+    expected = as_sets(maching_cam.agglomerative_with_time_constraint_weighted(reid, clip, intervals, tau=0.75))
+    assert as_sets(maching_cam.agglomerative_with_time_constraint_heap(
+        reid, clip, intervals, tau=0.75, precision=precision)) == expected
+    assert as_sets(maching_cam.agglomerative_with_time_constraint_knn(
+        reid, clip, intervals, tau=0.75, k=len(reid) - 1, precision=precision)) == expected
+
+
+@pytest.mark.parametrize('precision', LOW_PRECISIONS)
+def test_low_precision_global_engine_matches_legacy(matching_seq, precision):
+    items = nodes(matching_seq.Node)
+    thresholds = {'tau_same_seq': 0.8, 'tau_diff_seq': 0.7}
+    expected = as_sets(matching_seq.agglomerative_clustering_global(items, **thresholds))
+    clusters = matching_seq.agglomerative_clustering_global_heap(items, precision=precision, **thresholds)
+    assert as_sets(clusters) == expected
@@ -0,0 +1,154 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from matching_data import nodes
+
+THRESHOLDS = {'tau_same_seq': 0.8, 'tau_diff_seq': 0.7, 'w_reid': 0.7}
+
+
+def _write_lock(sharding, work_dir, shard_id, host, pid, token, age=0):
+    lock_path = sharding.shard_path(work_dir, shard_id, 'lock')
+    with open(lock_path, 'w') as f:
+        f.write(f"{host} {pid} {token}\n")
+    os.utime(lock_path, (time.time() - age, time.time() - age))
+    return lock_path
+
+
+def _lock_token(sharding, work_dir, shard_id):
+    return sharding._read_lock(sharding.shard_path(work_dir, shard_id, 'lock'))[2]
+
+
+def test_claim_is_exclusive(sharding, tmp_path):
+    work_dir = str(tmp_path)
+    assert sharding._claim(work_dir, 0)
+    assert not sharding._claim(work_dir, 0)
+    assert sharding._claim(work_dir, 1)
+    assert sorted(os.listdir(work_dir)) == ['shard_0000.lock', 'shard_0001.lock']
+
+
+def test_lock_of_a_live_or_recent_owner_is_kept(sharding, tmp_path):
+    work_dir = str(tmp_path)
+    _write_lock(sharding, work_dir, 0, sharding.socket.gethostname(), os.getpid(), 'live')
+    _write_lock(sharding, work_dir, 1, 'elsewhere', 123, 'recent', age=10)
+    assert not sharding._claim(work_dir, 0)
+    assert not sharding._claim(work_dir, 1, stale_after=60)
+    assert not sharding._claim(work_dir, 1)
+
+
+def test_lock_of_a_dead_owner_is_taken_over(sharding, tmp_path):
+    work_dir = str(tmp_path)
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    _write_lock(sharding, work_dir, 0, sharding.socket.gethostname(), process.pid, 'dead')
+    _write_lock(sharding, work_dir, 1, 'elsewhere', 123, 'stale', age=120)
+    assert sharding._claim(work_dir, 0)
+    assert sharding._claim(work_dir, 1, stale_after=60)
+    assert _lock_token(sharding, work_dir, 0) != 'dead'
+    assert _lock_token(sharding, work_dir, 1) != 'stale'
+
+
+def test_late_worker_does_not_remove_the_new_lock(sharding, tmp_path, monkeypatch):
+    work_dir = str(tmp_path)
+    lock_path = _write_lock(sharding, work_dir, 0, 'elsewhere', 123, 'stale', age=120)
+    dead = sharding._dead_owner(lock_path, stale_after=60)
+    assert sharding._claim(work_dir, 0, stale_after=60)
+    token = _lock_token(sharding, work_dir, 0)
+
+    # A worker that saw the dead lock before it was taken over
+    monkeypatch.setattr(sharding, '_dead_owner', lambda path, stale_after=None: dead)
+    assert not sharding._claim(work_dir, 0, stale_after=60)
+    assert _lock_token(sharding, work_dir, 0) == token
+
+
+@pytest.mark.parametrize('round', range(10))
+def test_racing_takeover_has_one_winner(sharding, tmp_path, monkeypatch, round):
+    work_dir = str(tmp_path)
+    _write_lock(sharding, work_dir, 0, 'elsewhere', 123, 'stale', age=120)
+
+    # Both workers see the dead lock before either takes it over
+    both_checked = threading.Barrier(2, timeout=5)
+    dead_owner = sharding._dead_owner
+
+    def checked(path, stale_after=None):
+        owner = dead_owner(path, stale_after)
+        both_checked.wait()
+        return owner
+
+    monkeypatch.setattr(sharding, '_dead_owner', checked)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(sharding._claim(work_dir, 0, stale_after=60)))
+               for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False, True]
+    assert _lock_token(sharding, work_dir, 0) != 'stale'
+
+
+def test_workers_process_every_shard_once(sharding, tmp_path, monkeypatch):
+    work_dir = str(tmp_path)
+    sharding.plan_shards(work_dir, seq_ids=list(range(6)), **THRESHOLDS)
+    _write_lock(sharding, work_dir, 2, 'elsewhere', 123, 'stale', age=120)
+    done = []
+
+    def cluster_shard(work_dir, shard_id, plan):
+        done.append(shard_id)
+        time.sleep(0.01)
+        return sharding.save_shard(work_dir, shard_id, [], [])
+
+    monkeypatch.setattr(sharding, 'cluster_shard', cluster_shard)
+    threads = [threading.Thread(target=sharding.run_worker, args=(work_dir, 60)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(done) == list(range(6))
+
+
+def test_failed_shard_releases_its_lock(sharding, tmp_path, monkeypatch):
+    work_dir = str(tmp_path)
+    sharding.plan_shards(work_dir, seq_ids=[0], **THRESHOLDS)
+
+    def cluster_shard(work_dir, shard_id, plan):
+        raise RuntimeError("worker failed")
+
+    monkeypatch.setattr(sharding, 'cluster_shard', cluster_shard)
+    with pytest.raises(RuntimeError):
+        sharding.run_worker(work_dir)
+    assert not os.path.exists(sharding.shard_path(work_dir, 0, 'lock'))
+
+
+def test_merge_keeps_shard_clusters_and_the_camera_veto(sharding, matching_seq, tmp_path):
+    work_dir = str(tmp_path)
+    items = nodes(matching_seq.Node)
+    seq_ids = sorted({node.seq_id for node in items})
+    sharding.plan_shards(work_dir, seq_ids=seq_ids, **THRESHOLDS)
+    thresholds = {k: v for k, v in THRESHOLDS.items() if k != 'w_reid'}
+
+    shard_clusters = []
+    for shard_id, seq_id in enumerate(seq_ids):
+        with pytest.raises(FileNotFoundError, match="Shards not finished"):
+            sharding.merge_shards(work_dir)
+        shard_nodes = [node for node in items if node.seq_id == seq_id]
+        clusters = matching_seq.agglomerative_clustering_global_heap(shard_nodes, **thresholds)
+        sharding.save_shard(work_dir, shard_id, shard_nodes, clusters)
+        shard_clusters.extend({tuple(shard_nodes[i].track_keys[0]) for i in cluster} for cluster in clusters)
+
+    results = sharding.merge_shards(work_dir, knn_k=len(items))
+    merged = [set(map(tuple, cluster)) for cluster in results]
+    assert sorted(key for cluster in merged for key in cluster) == sorted(node.track_keys[0] for node in items)
+    assert all(any(cluster <= other for other in merged) for cluster in shard_clusters)
+    assert len(merged) < len(shard_clusters)
+    for cluster in merged:
+        seq_cams = [key[:2] for key in cluster]
+        assert len(seq_cams) == len(set(seq_cams))
+
+    single_shot = matching_seq.agglomerative_clustering_global_heap(items, **thresholds)
+    reference = [[key for i in cluster for key in items[i].track_keys] for cluster in single_shot]
+    assert sharding.compare_clusterings(results, reference)['exact']
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from track_codec import (_HEADER, decode_records, decode_track, decode_track_text, encode_records, encode_track,
+                         encode_track_text)
+
+
+def _track(n=200, seed=0):
+    """A walking box with a few gaps in the frame ids and some jitter."""
+    rng = np.random.default_rng(seed)
+    frames = np.cumsum(rng.choice([1, 1, 1, 2, 7], size=n)) + 100
+    left = 50 + 3 * np.arange(n) + rng.integers(-2, 3, size=n)
+    top = 80 + np.arange(n) // 4
+    boxes = np.stack([left, top, left + 40, top + 120], axis=1)
+    return frames, boxes
+
+
+def test_lossless_round_trip():
+    frames, boxes = _track()
+    decoded_frames, decoded_boxes = decode_track(encode_track(frames, boxes))
+    np.testing.assert_array_equal(decoded_frames, frames)
+    np.testing.assert_array_equal(decoded_boxes, boxes)
+
+
+def test_round_trip_sorts_frames_and_rounds_boxes():
+    frames = np.array([12, 10, 11, 30])
+    boxes = np.array([[2.4, 3, 12, 13], [0, 1, 10, 11.6], [1, 2, 11, 12], [5, 5, 15, 15]])
+    decoded_frames, decoded_boxes = decode_track(encode_track(frames, boxes))
+    order = np.argsort(frames)
+    np.testing.assert_array_equal(decoded_frames, frames[order])
+    np.testing.assert_array_equal(decoded_boxes, np.rint(boxes[order]))
+
+
+@pytest.mark.parametrize('tolerance', [1, 4])
+def test_lossy_round_trip_within_tolerance(tolerance):
+    frames, boxes = _track()
+    data = encode_track(frames, boxes, tolerance=tolerance)
+    decoded_frames, decoded_boxes = decode_track(data)
+    np.testing.assert_array_equal(decoded_frames, frames)
+    assert np.abs(decoded_boxes - boxes).max() <= tolerance
+    n_keys = _HEADER.unpack_from(data)[4]
+    assert n_keys < _HEADER.unpack_from(encode_track(frames, boxes))[4]
+
+
+@pytest.mark.parametrize('n', [0, 1, 2])
+def test_short_tracks(n):
+    frames, boxes = _track(n)
+    decoded_frames, decoded_boxes = decode_track(encode_track(frames, boxes))
+    np.testing.assert_array_equal(decoded_frames, frames)
+    np.testing.assert_array_equal(decoded_boxes.reshape(-1, 4), boxes.reshape(-1, 4))
+
+
+def test_text_and_records_round_trip():
+    frames, boxes = _track(50)
+    decoded_frames, decoded_boxes = decode_track_text(encode_track_text(frames, boxes))
+    np.testing.assert_array_equal(decoded_frames, frames)
+    np.testing.assert_array_equal(decoded_boxes, boxes)
+
+    records = [{'frame_id': f, 'bbox': b} for f, b in zip(frames.tolist(), boxes.tolist())]
+    assert decode_records(encode_records(records)) == records
+
+
+def test_unknown_version_is_rejected():
+    frames, boxes = _track(10)
+    data = bytearray(encode_track(frames, boxes))
+    data[0] = 99
+    with pytest.raises(ValueError):
+        decode_track(bytes(data))
@@ -1,9 +1,13 @@
 import os
+import sys
 import json
 import pickle
 from pathlib import Path
 from typing import Dict, Set, Any, Iterable, Tuple
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "mmc"))
+from exclusions import ExclusionSet, keys_from_ids_json
+
 
 def _parse_camera_key(camera_key: str) -> str:
     """
@@ -162,7 +166,22 @@ def _filter_feature_pkl(in_path: Path, out_path: Path, remove_ids: Set[str]) ->
         pickle.dump(new_pairs, f, protocol=pickle.HIGHEST_PROTOCOL)
 
 
+def add_exclusions(ids_json: Dict[str, Any], exclusions_path: Path, reason: str = "single_image") -> int:
+    """
+    Record the ids to remove in the exclusion set read by the loaders (see
+    mmc/exclusions.py) instead of rewriting the metadata and feature trees.
+    Returns number of newly excluded tracks.
+    """
+    exclusions = ExclusionSet(str(exclusions_path))
+    added = exclusions.add(keys_from_ids_json(ids_json), reason)
+    print(f"Excluded {added} new tracks ({len(exclusions)} total) in {exclusions_path}")
+    return added
+
+
 def main() -> None:
+    # Rewrite filtered copies of the trees instead of only updating the exclusion set
+    rewrite_trees = False
+
     # Input roots
     ids_path = Path(r"K:\Python\PersonRetrieval\single_image_ids.json")
     feature_root = Path(r"K:\Python\PersonRetrieval\data\feature_objects")
@@ -172,9 +191,16 @@ def main() -> None:
     new_feature_root = Path(r"K:\Python\PersonRetrieval\data\new_feature_objects")
     new_metadata_root = Path(r"K:\Python\PersonRetrieval\data\new_metadata_objects")
 
+    # Exclusion set read by the loaders
+    exclusions_path = Path(r"K:\Python\PersonRetrieval\data\exclusions.npz")
+
     with ids_path.open("r", encoding="utf-8") as f:
         ids_json = json.load(f)
 
+    if not rewrite_trees:
+        add_exclusions(ids_json, exclusions_path)
+        return
+
     removal_map = _build_removal_map(ids_json)
 
     # Process only seq/cam that exist in ids.json
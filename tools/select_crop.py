@@ -1,5 +1,10 @@
 import json
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "mmc"))
+from exclusions import ExclusionSet, keys_from_ids_json
+from crop_catalog import CameraCrops
 
 def find_single_image_ids(crops_base_path="data/crops", output_json="single_image_ids.json"):
     """
@@ -37,23 +42,11 @@ def find_single_image_ids(crops_base_path="data/crops", output_json="single_imag
 
             cam_id = cam_dir  # "camera_1", "camera_2", ...
 
-            # Đếm số ảnh của mỗi ID
-            id_counts = defaultdict(int)
-
-            for filename in os.listdir(cam_path):
-                if not filename.endswith(".webp"):
-                    continue
-
-                # Parse tên file: "100001_000006.webp" -> id=100001, frame=000006
-                try:
-                    obj_id = filename.split("_")[0]
-                    id_counts[obj_id] += 1
-                except:
-                    print(f"Cannot parse filename: {filename}")
-                    continue
+            # Đếm số ảnh của mỗi ID (tên file: "100001_000006.webp" -> id=100001, frame=000006)
+            id_counts = CameraCrops(cam_path).counts()
 
             # Lọc các ID chỉ có 1 ảnh
-            single_ids = [obj_id for obj_id, count in id_counts.items() if count == 1]
+            single_ids = [str(obj_id) for obj_id, count in id_counts.items() if count == 1]
 
             if single_ids:
                 result[seq_id][cam_id] = sorted(single_ids)
@@ -99,22 +92,42 @@ def move_single_images(json_file="single_image_ids.json",
             dest_dir = os.path.join(output_base, seq_id, cam_id)
             os.makedirs(dest_dir, exist_ok=True)
 
+            # Index ảnh của camera một lần (chỉ thư mục, không dùng pack vì file bị di chuyển)
+            crops = CameraCrops(src_dir, use_pack=False)
+
             # Loop qua từng ID
             for obj_id in ids:
-                # Tìm tất cả file ảnh của ID này
-                for filename in os.listdir(src_dir):
-                    if filename.startswith(f"{obj_id}_") and filename.endswith(".webp"):
-                        src_file = os.path.join(src_dir, filename)
-                        dest_file = os.path.join(dest_dir, filename)
+                # Tất cả file ảnh của ID này
+                for _, filename in crops.crops(obj_id):
+                    src_file = crops.path(filename)
+                    dest_file = os.path.join(dest_dir, filename)
 
-                        # Di chuyển file (xóa khỏi crops gốc)
-                        shutil.move(src_file, dest_file)
-                        total_moved += 1
-                        print(f"Moved: {seq_id}/{cam_id}/{filename}")
+                    # Di chuyển file (xóa khỏi crops gốc)
+                    shutil.move(src_file, dest_file)
+                    total_moved += 1
+                    print(f"Moved: {seq_id}/{cam_id}/{filename}")
 
     print(f"Total files moved: {total_moved}")
     return total_moved
 
+def exclude_single_images(json_file="single_image_ids.json",
+                          exclusions_path="K:/Python/PersonRetrieval/data/exclusions.npz"):
+    """
+    Đánh dấu các single ID trong exclusion set (mmc/exclusions.py) thay vì di chuyển ảnh;
+    các loader sẽ bỏ qua chúng khi đọc.
+
+    Args:
+        json_file: File JSON chứa danh sách single IDs
+        exclusions_path: File exclusion set
+    """
+    with open(json_file, "r") as f:
+        single_ids = json.load(f)
+
+    exclusions = ExclusionSet(exclusions_path)
+    added = exclusions.add(keys_from_ids_json(single_ids), reason="single_image")
+    print(f"Excluded {added} new IDs ({len(exclusions)} total) in {exclusions_path}")
+    return added
+
 if __name__ == '__main__':
     # Tìm các ID chỉ có 1 ảnh
     # single_image_ids, counts = find_single_image_ids(
@@ -123,8 +136,13 @@ if __name__ == '__main__':
     # )
     # print(f"Found {counts} IDs with single image")
 
-    moved = move_single_images(
+    # moved = move_single_images(
+    #     json_file="single_image_ids.json",
+    #     crops_base="K:/Python/PersonRetrieval/data/crops",
+    #     output_base="K:/Python/PersonRetrieval/data/crops_single"
+    # )
+
+    excluded = exclude_single_images(
         json_file="single_image_ids.json",
-        crops_base="K:/Python/PersonRetrieval/data/crops",
-        output_base="K:/Python/PersonRetrieval/data/crops_single"
+        exclusions_path="K:/Python/PersonRetrieval/data/exclusions.npz"
     )
\ No newline at end of file
@@ -2,16 +2,41 @@ import os
 import re
 import glob
 import pickle
+import sys
 from collections import defaultdict
 from typing import Dict, Tuple, List, Any
 
+import numpy as np
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "mmc"))
+from detection_store import DetectionStore
 
-def load_global_mapping(pkl_path: str) -> Dict[Tuple[str, int, int], int]:
+
+def _id_number(value: Any) -> int:
+    """Integer id of 'seq_000' / 'camera_1' style names, or of an int."""
+    if isinstance(value, str):
+        m = re.search(r"(\d+)$", value)
+        if not m:
+            raise ValueError(f"Unexpected id: {value!r}")
+        return int(m.group(1))
+    return int(value)
+
+
+def mapping_key(seq_id: Any, cam_id: Any, obj_id: Any) -> Tuple[int, int, int]:
+    """Normalized (seq_id, cam_id, obj_id) mapping key: ints, whether given as 'seq_000' or 0."""
+    return _id_number(seq_id), _id_number(cam_id), int(obj_id)
+
+
+def _normalize_mapping(m: Dict[Tuple[Any, Any, Any], int]) -> Dict[Tuple[int, int, int], int]:
+    return {mapping_key(*k): v for k, v in m.items()}
+
+
+def load_global_mapping(pkl_path: str) -> Dict[Tuple[int, int, int], int]:
     """
     Expected mapping key: (seq_id, cam_id, obj_id) -> global_id
     Supports either direct-dict pickle or wrapper dict containing that mapping.
+    Keys are normalized to ints (see mapping_key), so 'seq_000' and 0 both work.
     """
     with open(pkl_path, "rb") as f:
         obj = pickle.load(f)
@@ -19,14 +44,14 @@ def load_global_mapping(pkl_path: str) -> Dict[Tuple[str, int, int], int]:
     if isinstance(obj, dict):
         # direct mapping
         if all(isinstance(k, tuple) and len(k) == 3 for k in obj.keys()):
-            return obj  # type: ignore[return-value]
+            return _normalize_mapping(obj)
 
         # try common wrapper keys
         for key in ("global_mapping", "mapping", "matches", "result", "results"):
             if key in obj and isinstance(obj[key], dict):
                 m = obj[key]
                 if all(isinstance(k, tuple) and len(k) == 3 for k in m.keys()):
-                    return m  # type: ignore[return-value]
+                    return _normalize_mapping(m)
 
 
 def _parse_seq_cam_from_path(path: str) -> Tuple[str, int]:
@@ -98,10 +123,11 @@ def _extract_obj_id(det: Dict[str, Any]) -> int:
 
 def build_mot_predictions_from_metadata(
     metadata_root: str,
-    global_mapping: Dict[Tuple[str, int, int], int],
+    global_mapping: Dict[Tuple[int, int, int], int],
 ) -> Dict[Tuple[str, int], pd.DataFrame]:
     """
-    Returns: {(seq_id, cam_id): MOT-format DataFrame}
+    Returns: {(seq_id, cam_id): MOT-format DataFrame}, seq_id as 'seq_000'.
+    `global_mapping` is keyed by int (seq, cam, obj), as from load_global_mapping.
     """
     rows_by_seq_cam: Dict[Tuple[str, int], List[Dict[str, Any]]] = defaultdict(list)
 
@@ -116,7 +142,7 @@ def build_mot_predictions_from_metadata(
             bbox = _extract_bbox(det)
             x1, y1, x2, y2 = bbox
 
-            global_id = global_mapping.get((seq_id, cam_id, obj_id))
+            global_id = global_mapping.get(mapping_key(seq_id, cam_id, obj_id))
             if global_id is None:
                 continue
 
@@ -153,6 +179,49 @@ def build_mot_predictions_from_metadata(
     return out
 
 
+def build_mot_predictions_from_store(
+    store_dir: str,
+    global_mapping: Dict[Tuple[int, int, int], int],
+) -> Dict[Tuple[str, int], pd.DataFrame]:
+    """
+    MOT predictions built column-wise from a detection store (see
+    mmc/detection_store.py), with the same {('seq_000', cam_id): DataFrame}
+    layout and columns as build_mot_predictions_from_metadata. The store keeps
+    no confidences, so `conf` is always 1.0. `global_mapping` is keyed by int
+    (seq, cam, obj), as from load_global_mapping.
+    """
+    store = DetectionStore(store_dir)
+    out: Dict[Tuple[str, int], pd.DataFrame] = {}
+
+    for entry in store.files:
+        camera = store.camera(entry["seq_id"], entry["cam_id"])
+        track_ids = np.array(
+            [global_mapping.get(key, -1) for key in map(tuple, camera.keys_array().tolist())], dtype=np.int64
+        )
+        ids = np.repeat(track_ids, np.diff(camera.offsets()))
+        keep = ids >= 0
+        if not keep.any():
+            continue
+
+        bbox = np.asarray(camera.column("bbox"), dtype=np.float64)[keep]
+        n = int(keep.sum())
+        df = pd.DataFrame({
+            "frame": np.asarray(camera.column("frame"))[keep].astype(np.int64),
+            "id": ids[keep],
+            "bb_left": bbox[:, 0],
+            "bb_top": bbox[:, 1],
+            "bb_width": bbox[:, 2] - bbox[:, 0],
+            "bb_height": bbox[:, 3] - bbox[:, 1],
+            "conf": np.ones(n),
+            "x": np.full(n, -1),
+            "y": np.full(n, -1),
+            "z": np.full(n, -1),
+        })
+        out[(f"seq_{entry['seq_id']:03d}", entry["cam_id"])] = df.sort_values(["frame", "id"], ascending=True)
+
+    return out
+
+
 def write_mot_files(predictions: Dict[Tuple[str, int], pd.DataFrame], out_dir: str) -> None:
     os.makedirs(out_dir, exist_ok=True)
 
@@ -174,10 +243,14 @@ def write_mot_files(predictions: Dict[Tuple[str, int], pd.DataFrame], out_dir: s
 def main() -> None:
     pkl_path = "global_matching_results_2 (1).pkl"
     metadata_root = os.path.join("data", "new_metadata_objects")
+    store_dir = os.path.join("data", "detection_store")  # used instead of metadata_root when present
     out_dir = "mot_predictions"
 
     global_mapping = load_global_mapping(pkl_path)
-    predictions = build_mot_predictions_from_metadata(metadata_root, global_mapping)
+    if os.path.isdir(store_dir):
+        predictions = build_mot_predictions_from_store(store_dir, global_mapping)
+    else:
+        predictions = build_mot_predictions_from_metadata(metadata_root, global_mapping)
     write_mot_files(predictions, out_dir)
 
     print(f"Wrote {len(predictions)} MOT files into: {out_dir}")